@@ -1,8 +1,29 @@
+import atexit
 import os
-from flask import Flask, request, jsonify
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
-from peft import PeftModel
-import torch
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+
+from backends import prepare_backend
+from batching import MicroBatcher, SingleFlight, bucket_label, bucket_of
+from code_blocks import find_blocks, normalize_code
+from comment_cache import CommentCache, cache_key, normalized_key
+from compaction import STEPS as COMPACTION_STEPS, Compactor
+from decoding import FULL, POLICIES_BY_NAME, DecodingPolicy, generation_kwargs
+import hierarchy
+import jobs
+import metrics
+import snapshot
+
+logger = logging.getLogger('docucode')
+
+def configure_logging(level=logging.INFO):
+    """Sets up the server's log format; the entry points call it, so importing app leaves logging alone."""
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 # This is a critical line to prevent TensorFlow imports
 os.environ['TRANSFORMERS_NO_TF_IMPORT'] = '1'
@@ -11,70 +32,836 @@ app = Flask(__name__)
 model = None
 tokenizer = None
 device = None
+model_id = None
+
+# torch and transformers are only imported once loading starts, so importing
+# this module stays cheap. Requests that arrive before the model is ready wait
+# up to MODEL_WAIT_SECONDS for it instead of failing.
+model_ready = threading.Event()
+load_state = {"stage": "not started", "progress": 0.0, "error": None}
+_load_lock = threading.Lock()
+MODEL_WAIT_SECONDS = float(os.environ.get('DOCUCODE_MODEL_WAIT_SECONDS', '300'))
+
+BASE_MODEL_NAME = "Salesforce/codet5-small"
+# Inference backend: 'torch' (fp32), 'int8' (dynamic quantization) or 'onnx' (ONNX Runtime).
+BACKEND = os.environ.get('DOCUCODE_BACKEND', 'torch')
+MAX_INPUT_LENGTH = 512
+# Settings of the widest decoding policy ('full'): 6 beams, up to 256 tokens,
+# no early stopping. Smaller inputs and tight latency budgets get cheaper
+# policies unless DOCUCODE_ADAPTIVE_DECODING=0.
+decoding_policy = DecodingPolicy(adaptive=os.environ.get('DOCUCODE_ADAPTIVE_DECODING', '1') != '0')
+# Beam search cannot emit tokens before it finishes, so the streaming endpoint
+# decodes greedily instead.
+STREAM_GENERATION_KWARGS = {
+    'max_length': 256,
+    'num_beams': 1,
+    'do_sample': False,
+}
+
+# Blocks are compacted before tokenization (see compaction.py). DOCUCODE_COMPACTION
+# lists the steps to apply ('none' for none) and DOCUCODE_TRUNCATION picks how
+# blocks still over the input limit are shortened.
+COMPACTION = os.environ.get('DOCUCODE_COMPACTION', ','.join(COMPACTION_STEPS))
+TRUNCATION = os.environ.get('DOCUCODE_TRUNCATION', 'head-tail')
+
+# Concurrent requests are merged into padded micro-batches of at most
+# MAX_BATCH_SIZE blocks, waiting at most MAX_BATCH_WAIT_MS for a batch to fill.
+# Blocks are batched only with others in the same input-length bucket
+# (LENGTH_BUCKETS are the upper bounds in tokens), and a batch is capped at
+# MAX_BATCH_TOKENS padded input tokens (0 for no cap).
+MAX_BATCH_SIZE = int(os.environ.get('DOCUCODE_MAX_BATCH_SIZE', '32'))
+MAX_BATCH_WAIT_MS = float(os.environ.get('DOCUCODE_MAX_BATCH_WAIT_MS', '10'))
+LENGTH_BUCKETS = tuple(int(bound) for bound in os.environ.get('DOCUCODE_LENGTH_BUCKETS', '32,64,128,256').split(',')
+                       if bound.strip())
+MAX_BATCH_TOKENS = int(os.environ.get('DOCUCODE_MAX_BATCH_TOKENS', '4096'))
+
+# Generated comments are cached by the normalized AST of each block, in memory
+# and in an SQLite file under DOCUCODE_CACHE_DIR (set it empty to stay in memory).
+CACHE_DIR = os.environ.get('DOCUCODE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'docucode'))
+comment_cache = CommentCache(
+    os.path.join(CACHE_DIR, 'comments.sqlite3') if CACHE_DIR else None,
+    max_memory_entries=int(os.environ.get('DOCUCODE_CACHE_MEMORY_ENTRIES', '4096')),
+    max_disk_bytes=int(float(os.environ.get('DOCUCODE_CACHE_DISK_MB', '64')) * 1024 * 1024),
+)
+
+# Jobs submitted to /jobs and their finished comments live in DOCUCODE_JOBS_DB
+# (by default next to the cache), so a restarted server resumes them.
+JOBS_DB = os.environ.get('DOCUCODE_JOBS_DB', os.path.join(CACHE_DIR, 'jobs.sqlite3') if CACHE_DIR else '')
+JOB_CHUNK_SIZE = int(os.environ.get('DOCUCODE_JOB_CHUNK_SIZE', '16'))
+# How long shutdown waits for the job runner to finish the chunk it is on.
+JOB_STOP_SECONDS = float(os.environ.get('DOCUCODE_JOB_STOP_SECONDS', '30'))
+# Folders a job's "path" may point into, separated by os.pathsep; with none
+# set, jobs can only be submitted as "codes".
+JOB_ROOTS = [os.path.realpath(root) for root in os.environ.get('DOCUCODE_JOB_ROOTS', '').split(os.pathsep) if root]
+job_store = jobs.JobStore(JOBS_DB or None)
 
-def load_model():
-    """Function to load the model and tokenizer."""
-    global model, tokenizer, device
-    MODEL_PATH = os.path.join(os.path.dirname(__file__), 'codet5_commenter_final')
+# --- Metrics, served in Prometheus text format on /metrics ---
+REQUESTS = metrics.Counter('docucode_requests_total', "HTTP requests by endpoint and status.",
+                           ('endpoint', 'status'))
+REQUEST_SECONDS = metrics.Histogram('docucode_request_seconds', "HTTP request latency by endpoint.",
+                                    ('endpoint',))
+STAGE_SECONDS = metrics.Histogram('docucode_stage_seconds',
+                                  "Time per model call spent in each inference stage.", ('stage',))
+BATCH_SIZE = metrics.Histogram('docucode_batch_size', "Blocks per model call.",
+                               buckets=(1, 2, 4, 8, 16, 32, 64))
+INPUT_TOKENS = metrics.Histogram('docucode_input_tokens', "Input tokens per block after truncation.",
+                                 buckets=metrics.TOKEN_BUCKETS)
+OUTPUT_TOKENS = metrics.Histogram('docucode_output_tokens', "Generated tokens per block.",
+                                  buckets=metrics.TOKEN_BUCKETS)
+TRUNCATED_INPUTS = metrics.Counter('docucode_truncated_inputs_total',
+                                   f"Blocks cut off at MAX_INPUT_LENGTH ({MAX_INPUT_LENGTH}) tokens.")
+FIRST_TOKEN_SECONDS = metrics.Histogram('docucode_stream_first_token_seconds',
+                                        "Time to the first streamed token.")
+COMPACTION_TOKENS_SAVED = metrics.Counter('docucode_compaction_tokens_saved_total',
+                                          "Input tokens removed by compaction before tokenization.")
+COMPACTION_TRUNCATED = metrics.Counter('docucode_compaction_truncated_total',
+                                       "Blocks shortened by the compaction truncation strategy.")
+COALESCED = metrics.Counter('docucode_coalesced_requests_total',
+                            "Blocks that joined an identical generation already in flight.")
+POLICY_BATCHES = metrics.Counter('docucode_policy_batches_total', "Model calls by decoding policy.",
+                                 ('policy',))
+DEADLINE_HITS = metrics.Counter('docucode_deadline_hits_total',
+                                "Blocks whose decoding was stopped by their latency budget.")
+BATCH_INPUT_TOKENS = metrics.Counter('docucode_batch_input_tokens_total',
+                                     "Input tokens fed to the encoder by length bucket; kind is real or padded.",
+                                     ('bucket', 'kind'))
+PADDING_EFFICIENCY = metrics.Gauge('docucode_padding_efficiency',
+                                   "Real over padded input tokens so far, by length bucket.", ('bucket',))
+metrics.Gauge('docucode_queue_depth', "Blocks waiting for a batch slot.",
+              callback=lambda: batcher.pending())
+metrics.Gauge('docucode_in_flight_generations', "Distinct blocks being generated right now.",
+              callback=lambda: in_flight.pending())
+metrics.Gauge('docucode_jobs_running', "Jobs being worked on by this process.",
+              callback=lambda: int(job_runner.busy))
+metrics.Gauge('docucode_cache_hit_ratio', "Fraction of comment lookups served from the cache.",
+              callback=lambda: comment_cache.stats()['hit_rate'])
+metrics.Gauge('docucode_cache_memory_entries', "Comments held in the in-memory cache tier.",
+              callback=lambda: comment_cache.stats()['memory_entries'])
+metrics.Gauge('docucode_process_resident_memory_bytes', "Resident memory of the server process.",
+              callback=metrics.process_rss_bytes)
+metrics.Gauge('docucode_model_ready', "1 once the model has loaded.",
+              callback=lambda: 1 if model is not None else 0)
+
+def _report(stage, progress, on_progress=None):
+    load_state["stage"] = stage
+    load_state["progress"] = progress
+    if progress < 1.0:
+        logger.info("%s...", stage)
+    if on_progress:
+        on_progress(stage, progress)
+
+def load_model(on_progress=None):
+    """Function to load the model and tokenizer.
+
+    ``on_progress(stage, fraction)`` is called as each loading stage starts.
+    """
+    global model, tokenizer, device, model_id
+    MODEL_PATH = snapshot.ADAPTER_DIR
 
     try:
-        print("Loading base model...")
-        base_model = AutoModelForSeq2SeqLM.from_pretrained("Salesforce/codet5-small")
-        
-        print("Loading tokenizer from local files...")
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-        
-        print("Loading LoRA adapters...")
-        model = PeftModel.from_pretrained(base_model, MODEL_PATH)
-        model = model.merge_and_unload()
-        
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        model = model.to(device)
-        model.eval()
-        print("Model and tokenizer loaded successfully!")
+        _report("Importing libraries", 0.05, on_progress)
+        import torch
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+        from peft import PeftModel
+
+        fingerprint = snapshot.adapter_fingerprint(MODEL_PATH)
+        model_id = f"{BASE_MODEL_NAME}+{fingerprint[:16]}"
+
+        if snapshot.snapshot_is_fresh(BASE_MODEL_NAME, MODEL_PATH, fingerprint=fingerprint):
+            _report("Loading pre-merged model snapshot", 0.3, on_progress)
+            loaded_model, loaded_tokenizer = snapshot.load_snapshot()
+        else:
+            _report("Loading base model", 0.2, on_progress)
+            base_model = AutoModelForSeq2SeqLM.from_pretrained(BASE_MODEL_NAME)
+
+            _report("Loading tokenizer from local files", 0.5, on_progress)
+            loaded_tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
+
+            _report("Loading LoRA adapters", 0.6, on_progress)
+            loaded_model = PeftModel.from_pretrained(base_model, MODEL_PATH)
+            loaded_model = loaded_model.merge_and_unload()
+            logger.info("Tip: run 'python snapshot.py' once to skip this merge on later starts.")
+
+        # The quantized and ONNX backends only run on the CPU.
+        use_cuda = torch.cuda.is_available() and BACKEND == 'torch'
+        device = torch.device('cuda' if use_cuda else 'cpu')
+        loaded_model = loaded_model.to(device)
+        loaded_model.eval()
+
+        if BACKEND != 'torch':
+            _report(f"Preparing {BACKEND} backend", 0.8, on_progress)
+            loaded_model = prepare_backend(BACKEND, loaded_model, loaded_tokenizer, model_id)
+            model_id = f"{model_id}+{BACKEND}"
+
+        # Publish the model only once it is fully prepared.
+        model, tokenizer = loaded_model, loaded_tokenizer
+        load_state["error"] = None
+        _report("Model ready", 1.0, on_progress)
+        model_ready.set()
+        logger.info("Model and tokenizer loaded successfully!")
     except Exception as e:
-        print(f"Error loading model or tokenizer: {e}")
+        logger.exception("Error loading model or tokenizer: %s", e)
         model = None
         tokenizer = None
+        load_state["error"] = str(e)
+        _report("Failed", 1.0, on_progress)
+        # Wake up queued requests so they fail instead of waiting out the timeout.
+        model_ready.set()
+
+_loader_thread = None
+
+def start_background_load(on_progress=None):
+    """Loads the model on a daemon thread; calling it again while loading is a no-op."""
+    global _loader_thread
+    with _load_lock:
+        if _loader_thread is None or not _loader_thread.is_alive():
+            if model is None:
+                model_ready.clear()
+                _loader_thread = threading.Thread(target=load_model, args=(on_progress,),
+                                                  name="model-loader", daemon=True)
+                _loader_thread.start()
+    return _loader_thread
+
+def wait_for_model(timeout=None):
+    """
+    Blocks until the model has loaded (or failed to); True if it is usable.
+
+    Waits on ``model_ready`` even if no load has started yet, so requests
+    that arrive before the entry point starts loading are not turned away.
+    """
+    if model is None:
+        model_ready.wait(MODEL_WAIT_SECONDS if timeout is None else timeout)
+    return model is not None and tokenizer is not None
+
+def generate_comments(codes, using=None, profile=None, policy=FULL, max_time=None):
+    """Generate one comment per code block with a single padded model call.
+
+    ``using`` overrides the loaded model, e.g. with another backend. If
+    ``profile`` is a dict it is filled with the seconds spent per stage.
+    ``policy`` sets the decoding settings and ``max_time`` (seconds) stops
+    decoding early when a deadline would otherwise be missed.
+    """
+    import torch
+
+    generator = using or model
+    kwargs = generation_kwargs(policy)
+    if max_time is not None:
+        kwargs['max_time'] = max_time
+    start = time.perf_counter()
+    input_texts = [f"summarize: {code}" for code in codes]
+    # Backends passed as ``using`` may live on another device than the loaded model (int8 is CPU-only).
+    inputs = tokenizer(input_texts, return_tensors="pt", max_length=MAX_INPUT_LENGTH,
+                       truncation=True, padding=True).to(getattr(generator, 'device', device))
+    tokenized = time.perf_counter()
+
+    with torch.no_grad():
+        if isinstance(generator, torch.nn.Module) and hasattr(generator, 'get_encoder'):
+            # Run the encoder up front so its cost is measured apart from the decode loop.
+            encoder_outputs = generator.get_encoder()(input_ids=inputs.input_ids,
+                                                      attention_mask=inputs.attention_mask)
+            encoded = time.perf_counter()
+            outputs = generator.generate(
+                encoder_outputs=encoder_outputs,
+                attention_mask=inputs.attention_mask,
+                **kwargs
+            )
+        else:
+            encoded = tokenized
+            outputs = generator.generate(
+                inputs.input_ids,
+                attention_mask=inputs.attention_mask,
+                **kwargs
+            )
+    generated = time.perf_counter()
+
+    comments = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+    done = time.perf_counter()
+
+    stages = {
+        'tokenize': tokenized - start,
+        'encode': encoded - tokenized,
+        'decode': generated - encoded,
+        'detokenize': done - generated,
+    }
+    for stage, seconds in stages.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    BATCH_SIZE.observe(len(codes))
+    lengths = inputs.attention_mask.sum(dim=1).tolist()
+    for length in lengths:
+        INPUT_TOKENS.observe(length)
+        if length >= MAX_INPUT_LENGTH:
+            TRUNCATED_INPUTS.inc()
+    bucket = bucket_label(bucket_of(max(lengths), LENGTH_BUCKETS), LENGTH_BUCKETS)
+    BATCH_INPUT_TOKENS.inc(sum(lengths), bucket=bucket, kind='real')
+    BATCH_INPUT_TOKENS.inc(inputs.attention_mask.numel(), bucket=bucket, kind='padded')
+    PADDING_EFFICIENCY.set(BATCH_INPUT_TOKENS.value(bucket=bucket, kind='real')
+                           / BATCH_INPUT_TOKENS.value(bucket=bucket, kind='padded'), bucket=bucket)
+    for length in (outputs != tokenizer.pad_token_id).sum(dim=1).tolist():
+        OUTPUT_TOKENS.observe(length)
+    POLICY_BATCHES.inc(policy=policy.name)
+    if using is None:
+        decoding_policy.observe(policy, outputs.shape[1] - 1, stages['decode'], len(codes))
+    if profile is not None:
+        profile.update(stages, batch_size=len(codes))
+        # max_time stops every sequence at once, so hitting it shows up as the
+        # decode loop running for (nearly) the whole allowance.
+        profile['deadline_hit'] = max_time is not None and stages['decode'] >= max_time * 0.95
+    return comments
+
+def _process_batch(items):
+    """Runs a batch of (code, policy, deadline) items that share one policy."""
+    policy = items[0][1]
+    deadlines = [deadline for _, _, deadline in items if deadline is not None]
+    max_time = None
+    if deadlines:
+        # Always leave a sliver of time so even a late batch returns something.
+        max_time = max(0.01, min(deadlines) - time.monotonic())
+    profile = {}
+    comments = generate_comments([code for code, _, _ in items], profile=profile, policy=policy,
+                                 max_time=max_time)
+    return [(comment, profile) for comment in comments]
+
+batcher = MicroBatcher(_process_batch, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT_MS / 1000.0,
+                       bucket_bounds=LENGTH_BUCKETS, max_batch_tokens=MAX_BATCH_TOKENS)
+
+# Room for the "summarize: " prompt and the special tokens.
+PROMPT_TOKENS = 8
+
+def count_tokens(texts):
+    """Token counts of ``texts`` without special tokens."""
+    return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids']]
+
+compactor = Compactor([step for step in COMPACTION.split(',') if step.strip() not in ('', 'none')],
+                      TRUNCATION, max_tokens=MAX_INPUT_LENGTH - PROMPT_TOKENS, count_tokens=count_tokens)
+
+def compact_inputs(codes, using=None):
+    """Compacts each block before tokenization and records the tokens saved."""
+    compacted = (using or compactor).fit_many(codes)
+    for result in compacted:
+        COMPACTION_TOKENS_SAVED.inc(max(0, result.original_tokens - result.tokens))
+        if result.truncated:
+            COMPACTION_TRUNCATED.inc()
+    return compacted
+
+# Parents in the hierarchical mode carry their children's summaries as
+# docstrings, which have to survive compaction.
+summary_compactor = Compactor([step for step in compactor.steps if step not in ('docstrings', 'nested')],
+                              TRUNCATION, max_tokens=compactor.max_tokens, count_tokens=count_tokens)
+
+in_flight = SingleFlight()
+
+def start_generations(blocks, policy, deadline):
+    """
+    Queues blocks that share ``policy`` for the model in one step and caches their comments.
+
+    ``blocks`` are (key, text, tokens, future) tuples: ``tokens`` is the
+    block's input length, which picks its length bucket, and ``future`` is
+    the in-flight entry for ``key``, which gets (comment, stages). The
+    comment is cached before that future resolves, so it is in the cache
+    by the time the in-flight entry goes away.
+    """
+    queued = batcher.submit_many([(text, policy, deadline) for _, text, _, _ in blocks],
+                                 key=(policy.name, deadline is not None),
+                                 tokens=[tokens for _, _, tokens, _ in blocks])
+    for (key, _, _, future), done in zip(blocks, queued):
+        done.add_done_callback(lambda done, key=key, future=future: _finish_generation(key, done, future))
+
+def _finish_generation(key, done, future):
+    if done.cancelled():
+        future.cancel()
+        return
+    if done.exception() is not None:
+        future.set_exception(done.exception())
+        return
+    comment, stages = done.result()
+    # Comments cut short by a deadline are not cached.
+    if stages.get('deadline_hit'):
+        DEADLINE_HITS.inc()
+    else:
+        comment_cache.put(key, comment)
+    future.set_result((comment, stages))
+
+def comment_namespace():
+    """
+    Hash of the model and every setting that shapes a batch comment.
+
+    Clients that keep comments themselves (the GUI's project index) file
+    them under it, so a different model or configuration starts afresh.
+    """
+    settings = dict(max_input_length=MAX_INPUT_LENGTH, adaptive=decoding_policy.adaptive,
+                    policies={name: generation_kwargs(policy) for name, policy in POLICIES_BY_NAME.items()},
+                    **compactor.settings())
+    payload = json.dumps([model_id, settings], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def comments_for(codes, profiles=None, budget_ms=None, policy_name=None, input_compactor=None):
+    """Comments for a list of blocks, served from the cache where possible.
+
+    Each block gets a decoding policy from its size, ``budget_ms`` (a latency
+    budget from now) and ``policy_name`` (to force one). If ``profiles`` is a
+    list, one breakdown per block, including the policy used, is appended.
+    ``input_compactor`` replaces the default Compactor.
+
+    The cache is looked up before anything is compacted or tokenized: a
+    block's comment is keyed by its normalized source and the settings, with
+    the policy left as "by size" unless one is forced, so only misses are
+    tokenized to pick their policy.
+    """
+    input_compactor = input_compactor or compactor
+    submitted = time.perf_counter()
+    deadline = time.monotonic() + budget_ms / 1000.0 if budget_ms is not None else None
+    settings = dict(max_input_length=MAX_INPUT_LENGTH, **input_compactor.settings())
+    by_size = dict(settings, policy='by-size', adaptive=decoding_policy.adaptive)
+    normalized = [normalize_code(code) for code in codes]
+
+    def key_for(i, policy):
+        return normalized_key(normalized[i], model_id,
+                              dict(settings, **generation_kwargs(policy)) if policy else by_size)
+
+    forced = decoding_policy.choose(0, name=policy_name) if policy_name else None
+    keys = [key_for(i, forced) for i in range(len(codes))]
+    comments = [comment_cache.get(key) for key in keys]
+    breakdowns = [dict(cache='hit', policy=policy_name) if comment is not None else None for comment in comments]
+    misses = [i for i, comment in enumerate(comments) if comment is None]
+
+    compacted = dict(zip(misses, compact_inputs([codes[i] for i in misses], input_compactor)))
+    # The blocks will most likely share a batch with each other and with what is already queued.
+    batch_size = min(MAX_BATCH_SIZE, len(misses) + batcher.pending())
+    policies = {i: decoding_policy.choose(compacted[i].tokens, budget_ms, policy_name, batch_size) for i in misses}
+    inputs = {i: {'input_tokens': result.tokens, 'tokens_saved': result.original_tokens - result.tokens}
+              for i, result in compacted.items()}
+    if forced is None and budget_ms is not None:
+        # A budget can call for a narrower policy than the size alone would;
+        # those comments are kept under that policy rather than "by size".
+        for i in misses:
+            if policies[i] != decoding_policy.choose(compacted[i].tokens):
+                keys[i] = key_for(i, policies[i])
+                comments[i] = comment_cache.get(keys[i])
+                if comments[i] is not None:
+                    breakdowns[i] = dict(inputs[i], cache='hit', policy=policies[i].name)
+        misses = [i for i in misses if comments[i] is None]
+    # Lengths as the encoder will see them, with the prompt and special tokens.
+    input_lengths = {i: min(MAX_INPUT_LENGTH, result.tokens + PROMPT_TOKENS) for i, result in compacted.items()}
+
+    finished = {}
+    futures = []
+    shared = []
+    started = {}
+    for i in misses:
+        # Identical blocks requested concurrently (here or by other requests)
+        # share one generation. Budgeted and unbudgeted ones are kept apart,
+        # as a budgeted result may be cut short.
+        future, joined = in_flight.submit((keys[i], deadline is not None), Future)
+        if joined:
+            COALESCED.inc()
+        else:
+            started.setdefault(policies[i], []).append((keys[i], compacted[i].text, input_lengths[i], future))
+        futures.append(future)
+        shared.append(joined)
+        future.add_done_callback(lambda _, i=i: finished.__setitem__(i, time.perf_counter()))
+    # Each policy's new blocks are queued together, so they are batched together.
+    for policy, blocks in started.items():
+        start_generations(blocks, policy, deadline)
+    for i, future, joined in zip(misses, futures, shared):
+        comments[i], stages = future.result()
+        # Whatever the model stages don't account for was spent waiting in the queue.
+        waited = finished.get(i, time.perf_counter()) - submitted
+        model_seconds = sum(stages[stage] for stage in ('tokenize', 'encode', 'decode', 'detokenize'))
+        breakdowns[i] = dict(stages, cache='coalesced' if joined else 'miss', policy=policies[i].name,
+                             **inputs[i], queue=max(0.0, waited - model_seconds))
+
+    if profiles is not None:
+        profiles.extend(breakdowns)
+    return comments
+
+def hierarchical_comments(files, budget_ms=None, policy_name=None):
+    """
+    Comments for the blocks of whole files, methods before their classes.
+
+    ``files`` is a list of Block lists, one per file, in ``find_blocks``
+    order; one comment list per file is returned. See hierarchy.py.
+    """
+    def generate(codes, summarized):
+        return comments_for(codes, budget_ms=budget_ms, policy_name=policy_name,
+                            input_compactor=summary_compactor if summarized else None)
+    return hierarchy.summarize_files(files, generate)
+
+def job_items(spec):
+    """The blocks of every .py file under a job's ``path``, as job items."""
+    from cli import iter_python_files
+    from code_blocks import extract_files
+
+    items = []
+    for path, blocks, error in extract_files(iter_python_files(spec['path'])):
+        if error:
+            logger.warning("Job skips %s: %s", path, error)
+        items.extend({'path': path, 'qualname': block.qualname, 'lineno': block.lineno,
+                      'end_lineno': block.end_lineno, 'code': block.source} for block in blocks)
+    return items
+
+def job_comments(codes, spec):
+    if not wait_for_model():
+        raise RuntimeError("Model not loaded")
+    return comments_for(codes, policy_name=spec.get('policy'))
+
+def job_path_allowed(path):
+    """True if ``path`` resolves (symlinks included) to somewhere inside one of JOB_ROOTS."""
+    path = os.path.realpath(path)
+    return any(os.path.commonpath([root, path]) == root for root in JOB_ROOTS)
+
+job_runner = jobs.JobRunner(job_store, job_comments, job_items, chunk_size=JOB_CHUNK_SIZE)
+
+def start_job_runner():
+    """
+    Starts working on stored jobs in this process; unfinished ones from a previous run resume.
+
+    At exit the runner finishes its current chunk and puts its job back in the queue.
+    """
+    job_runner.start()
+    atexit.unregister(job_runner.stop)
+    atexit.register(job_runner.stop, timeout=JOB_STOP_SECONDS)
+
+def stream_comment(code, budget_ms=None):
+    """Yields the comment for one block piece by piece as it is decoded.
+
+    With ``budget_ms``, decoding stops once the budget has been spent. A
+    request for a block that is already being streamed joins that stream
+    and gets its whole comment as one piece when it is done.
+    """
+    settings = dict(STREAM_GENERATION_KWARGS, max_input_length=MAX_INPUT_LENGTH, **compactor.settings())
+    key = cache_key(code, model_id, settings)
+    cached = comment_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    future, joined = in_flight.submit(('stream', key, budget_ms is not None), Future)
+    if joined:
+        COALESCED.inc()
+        yield future.result()
+        return
+
+    pieces = []
+    try:
+        for piece in _decode_stream(code, budget_ms, key):
+            pieces.append(piece)
+            yield piece
+    except GeneratorExit:
+        future.set_exception(RuntimeError("The stream this request joined was abandoned"))
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    future.set_result("".join(pieces).strip())
+
+def _decode_stream(code, budget_ms, key):
+    """Runs the model on one block, yielding decoded pieces; caches the comment unless the budget ran out."""
+    import torch
+    from transformers import TextIteratorStreamer
+
+    text = compact_inputs([code])[0].text
+    inputs = tokenizer(f"summarize: {text}", return_tensors="pt", max_length=MAX_INPUT_LENGTH,
+                       truncation=True).to(device)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    kwargs = dict(STREAM_GENERATION_KWARGS)
+    if budget_ms is not None:
+        kwargs['max_time'] = max(0.01, budget_ms / 1000.0)
+    errors = []
+
+    def run():
+        try:
+            with torch.no_grad():
+                model.generate(inputs.input_ids, attention_mask=inputs.attention_mask,
+                               streamer=streamer, **kwargs)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    started = time.perf_counter()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    pieces = []
+    for piece in streamer:
+        if piece:
+            if not pieces:
+                FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+            pieces.append(piece)
+            yield piece
+    thread.join()
+    if errors:
+        raise errors[0]
+    if budget_ms is None or time.perf_counter() - started < budget_ms / 1000.0:
+        comment_cache.put(key, "".join(pieces).strip())
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+def decoding_options(data):
+    """
+    The latency budget (ms) and forced policy name a request asks for.
+
+    Clients send either ``budget_ms`` or ``deadline`` (Unix time in seconds),
+    and optionally ``policy``. Raises ValueError for malformed values.
+    """
+    budget_ms = data.get('budget_ms')
+    if data.get('deadline') is not None:
+        budget_ms = (float(data['deadline']) - time.time()) * 1000.0
+    if budget_ms is not None:
+        budget_ms = max(0.0, float(budget_ms))
+    policy_name = data.get('policy')
+    if policy_name is not None:
+        decoding_policy.choose(0, name=policy_name)
+    return budget_ms, policy_name
+
+def policy_report(profile):
+    """The decoding policy a block was served with, as returned to clients (None if served from the cache)."""
+    if profile['policy'] is None:
+        return None
+    policy = POLICIES_BY_NAME[profile['policy']]
+    return {"name": policy.name, "num_beams": policy.num_beams, "max_length": policy.max_length,
+            "deadline_hit": bool(profile.get('deadline_hit', False))}
+
+def profiling_requested():
+    """Clients opt into a per-request stage breakdown with an ``X-Profile: 1`` header."""
+    return request.headers.get('X-Profile', '').lower() in ('1', 'true', 'yes')
+
+def server_timing(profile):
+    """Formats a stage breakdown as a Server-Timing header value (milliseconds)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in profile.items()
+                     if isinstance(seconds, float))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    if 'request_started' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+    return response
 
 @app.route('/status', methods=['GET'])
 def status():
+    # queue_depth and in_flight tell background clients whether anyone is waiting on the model.
+    details = {"stage": load_state["stage"], "progress": load_state["progress"],
+               "queue_depth": batcher.pending(), "in_flight": in_flight.pending()}
     if model and tokenizer:
-        return jsonify({"status": "ready"}), 200
+        return jsonify(dict(details, status="ready", namespace=comment_namespace())), 200
+    elif load_state["error"]:
+        return jsonify(dict(details, status="failed", error=load_state["error"])), 503
     else:
-        return jsonify({"status": "loading"}), 503
+        return jsonify(dict(details, status="loading")), 503
 
 @app.route('/generate-comment', methods=['POST'])
 def generate_comment():
-    if not model or not tokenizer:
+    if not wait_for_model():
         return jsonify({"error": "Model not loaded"}), 503
-    
+
     data = request.get_json()
     if not data or 'code' not in data:
         return jsonify({"error": "No code provided"}), 400
-    
+
     try:
-        input_text = f"summarize: {data['code']}"
-        inputs = tokenizer(input_text, return_tensors="pt", max_length=512, truncation=True).to(device)
-        
-        with torch.no_grad():
-            outputs = model.generate(
-                inputs.input_ids,
-                # Increased max_length to get more detailed comments
-                max_length=256,
-                # Increased num_beams for more diverse and detailed output
-                num_beams=6,
-                # Set early_stopping to False to encourage longer comments
-                early_stopping=False,
-                num_return_sequences=1
-            )
-        
-        generated_comment = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        return jsonify({"comment": generated_comment})
-    
+        budget_ms, policy_name = decoding_options(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        profiles = []
+        generated_comment = comments_for([data['code']], profiles, budget_ms, policy_name)[0]
+        result = {"comment": generated_comment, "policy": policy_report(profiles[0])}
+        if not profiling_requested():
+            return jsonify(result)
+        response = jsonify(dict(result, profile=profiles[0]))
+        response.headers['Server-Timing'] = server_timing(profiles[0])
+        return response
+
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/generate-comments', methods=['POST'])
+def generate_comments_batch():
+    if not wait_for_model():
+        return jsonify({"error": "Model not loaded"}), 503
+
+    data = request.get_json()
+    codes = data.get('codes') if data else None
+    if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+        return jsonify({"error": "'codes' must be a list of strings"}), 400
+
+    try:
+        budget_ms, policy_name = decoding_options(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        profiles = []
+        comments = comments_for(codes, profiles, budget_ms, policy_name)
+        result = {"comments": comments, "policies": [policy_report(profile) for profile in profiles]}
+        if profiling_requested():
+            return jsonify(dict(result, profiles=profiles))
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/generate-file-comments', methods=['POST'])
+def generate_file_comments():
+    """Comments for every block of a file's ``source``, hierarchical unless ``"hierarchical": false``."""
+    if not wait_for_model():
+        return jsonify({"error": "Model not loaded"}), 503
+
+    data = request.get_json()
+    source = data.get('source') if data else None
+    if not isinstance(source, str):
+        return jsonify({"error": "'source' must be a string"}), 400
+
+    try:
+        budget_ms, policy_name = decoding_options(data)
+        blocks = find_blocks(source)
+    except (TypeError, ValueError, SyntaxError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        if data.get('hierarchical', True):
+            comments = hierarchical_comments([blocks], budget_ms, policy_name)[0]
+        else:
+            comments = comments_for([block.source for block in blocks], budget_ms=budget_ms,
+                                    policy_name=policy_name)
+        return jsonify({"blocks": [{"qualname": block.qualname, "lineno": block.lineno,
+                                    "end_lineno": block.end_lineno, "comment": comment}
+                                   for block, comment in zip(blocks, comments)]})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/generate-comment/stream', methods=['POST'])
+def generate_comment_stream():
+    """Server-sent events: one {"token"} event per decoded piece, then {"comment", "done"}."""
+    if not wait_for_model():
+        return jsonify({"error": "Model not loaded"}), 503
+
+    data = request.get_json()
+    if not data or 'code' not in data:
+        return jsonify({"error": "No code provided"}), 400
+
+    try:
+        budget_ms, _ = decoding_options(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    def events():
+        pieces = []
+        try:
+            for piece in stream_comment(data['code'], budget_ms):
+                pieces.append(piece)
+                yield sse_event({"token": piece})
+            yield sse_event({"comment": "".join(pieces).strip(), "done": True})
+        except Exception as e:
+            yield sse_event({"error": str(e)})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queues a job for ``{"codes": [...]}`` or ``{"path": "some/folder"}`` and returns its id at once.
+
+    Progress is at /jobs/<id> (or streamed from /jobs/<id>/events) and the
+    comments at /jobs/<id>/results.
+    """
+    data = request.get_json()
+    codes = data.get('codes') if data else None
+    path = data.get('path') if data else None
+    if codes is not None:
+        if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+            return jsonify({"error": "'codes' must be a list of strings"}), 400
+    elif not isinstance(path, str):
+        return jsonify({"error": "Provide 'codes' or the 'path' of an existing file or folder"}), 400
+    elif not job_path_allowed(path):
+        return jsonify({"error": "'path' is outside the folders listed in DOCUCODE_JOB_ROOTS"}), 403
+    elif not os.path.exists(path):
+        return jsonify({"error": "Provide 'codes' or the 'path' of an existing file or folder"}), 400
+
+    try:
+        _, policy_name = decoding_options(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    spec = {"policy": policy_name}
+    if codes is not None:
+        job_id = job_store.create(spec, [{'code': code} for code in codes])
+    else:
+        job_id = job_store.create(dict(spec, path=os.path.realpath(path)))
+    start_job_runner()
+    job_runner.wake()
+    return jsonify(job_store.get(job_id)), 202
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({"jobs": job_store.list(request.args.get('limit', 50, type=int))})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "No such job"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if job_store.get(job_id) is None:
+        return jsonify({"error": "No such job"}), 404
+    job_store.cancel(job_id)
+    return jsonify(job_store.get(job_id))
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """A page of a job's blocks (``offset``, ``limit``); ``comment`` is null until a block is done."""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "No such job"}), 404
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(1000, max(1, request.args.get('limit', 100, type=int)))
+    results = job_store.results(job_id, offset, limit)
+    end = offset + len(results)
+    return jsonify({"status": job['status'], "results": results,
+                    "next_offset": end if job['total'] is not None and end < job['total'] else None})
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events: the job's status whenever its progress changes, until it finishes."""
+    if job_store.get(job_id) is None:
+        return jsonify({"error": "No such job"}), 404
+
+    def events():
+        last = None
+        while True:
+            job = job_store.get(job_id)
+            state = (job['status'], job['done'], job['total'])
+            if state != last:
+                last = state
+                yield sse_event(job)
+            if job['status'] in jobs.FINISHED:
+                return
+            time.sleep(0.5)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify(comment_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
+    configure_logging()
     load_model()
-    app.run(debug=False, use_reloader=False)
+    start_job_runner()
+    app.run(debug=False, use_reloader=False, threaded=True)
@@ -0,0 +1,170 @@
+"""
+CPU inference backends for the merged CodeT5 model.
+
+    torch  - the merged model as loaded (fp32 PyTorch)
+    int8   - PyTorch with dynamic int8 quantization of every Linear layer
+    onnx   - ONNX Runtime export of the encoder and merged decoder, with KV cache
+             (needs ``pip install optimum[onnxruntime]``)
+
+The server picks one with DOCUCODE_BACKEND. Run ``python backends.py`` to
+compare the backends' latency, memory and output parity on a sample corpus.
+"""
+import argparse
+import copy
+import difflib
+import gc
+import json
+import logging
+import os
+import sys
+import time
+
+from metrics import process_rss_bytes
+
+logger = logging.getLogger('docucode.backends')
+
+BACKENDS = ('torch', 'int8', 'onnx')
+ONNX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'codet5_commenter_onnx')
+
+
+def prepare_backend(name, model, tokenizer, model_id):
+    """
+    Returns an object with a Hugging Face ``generate`` method for the backend.
+
+    ``model`` is the merged, eval-mode PyTorch model. The int8 backend returns
+    a quantized copy; the onnx backend exports once into ONNX_DIR and reuses
+    the export for as long as ``model_id`` matches.
+    """
+    if name == 'torch':
+        return model
+    if name == 'int8':
+        import torch
+        # Quantize a CPU copy: moving ``model`` itself would pull it off the GPU for everyone else.
+        return torch.quantization.quantize_dynamic(copy.deepcopy(model).to('cpu'), {torch.nn.Linear},
+                                                   dtype=torch.qint8, inplace=True)
+    if name == 'onnx':
+        return _load_onnx(model, tokenizer, model_id)
+    raise ValueError(f"Unknown backend '{name}'; expected one of {', '.join(BACKENDS)}")
+
+
+def _load_onnx(model, tokenizer, model_id):
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError:
+        raise RuntimeError("The onnx backend needs optimum: pip install optimum[onnxruntime]")
+
+    stamp_path = os.path.join(ONNX_DIR, 'model_id.txt')
+    stamp = None
+    if os.path.exists(stamp_path):
+        with open(stamp_path, 'r', encoding='utf-8') as f:
+            stamp = f.read().strip()
+
+    if stamp != model_id:
+        import tempfile
+        logger.info("Exporting merged model to ONNX...")
+        with tempfile.TemporaryDirectory() as merged_dir:
+            model.save_pretrained(merged_dir, safe_serialization=True)
+            tokenizer.save_pretrained(merged_dir)
+            ort_model = ORTModelForSeq2SeqLM.from_pretrained(merged_dir, export=True, use_cache=True,
+                                                             use_merged=True)
+            ort_model.save_pretrained(ONNX_DIR)
+        tokenizer.save_pretrained(ONNX_DIR)
+        with open(stamp_path, 'w', encoding='utf-8') as f:
+            f.write(model_id)
+
+    return ORTModelForSeq2SeqLM.from_pretrained(ONNX_DIR, use_cache=True, use_merged=True)
+
+
+def sample_corpus(root, limit):
+    """Up to ``limit`` function/class blocks from the .py files under ``root``."""
+    from cli import iter_python_files
+    from code_blocks import extract_file
+    codes = []
+    for path in iter_python_files(root):
+        _, blocks, _ = extract_file(path)
+        codes.extend(block.source for block in blocks)
+        if len(codes) >= limit:
+            break
+    return codes[:limit]
+
+
+def parity_report(names, codes):
+    """
+    Runs every backend over ``codes`` and compares their output to the first one.
+
+    Returns one dict per backend with load time, resident memory growth,
+    per-block latency and exact/fuzzy agreement with the reference backend.
+    """
+    import app
+    app.load_model()
+    if app.model is None:
+        raise RuntimeError("The model could not be loaded")
+    base_model = app.model
+
+    report = []
+    reference = None
+    for name in names:
+        gc.collect()
+        rss_before = process_rss_bytes()
+        load_start = time.perf_counter()
+        backend_model = prepare_backend(name, base_model, app.tokenizer, app.model_id)
+        load_seconds = time.perf_counter() - load_start
+
+        latencies = []
+        outputs = []
+        for code in codes:
+            start = time.perf_counter()
+            outputs.extend(app.generate_comments([code], using=backend_model))
+            latencies.append(time.perf_counter() - start)
+
+        if reference is None:
+            reference = outputs
+        latencies.sort()
+        report.append({
+            "backend": name,
+            "load_seconds": round(load_seconds, 3),
+            "rss_growth_mb": round((process_rss_bytes() - rss_before) / (1024 * 1024), 1),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+            "exact_match": sum(a == b for a, b in zip(outputs, reference)) / len(codes),
+            "similarity": sum(difflib.SequenceMatcher(None, a, b).ratio()
+                              for a, b in zip(outputs, reference)) / len(codes),
+        })
+        if backend_model is not base_model:
+            del backend_model
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare inference backends on a sample corpus.")
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help="comma-separated backends; the first is the reference (default: %(default)s)")
+    parser.add_argument('--corpus', default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory of .py files to sample blocks from (default: this project)")
+    parser.add_argument('--limit', type=int, default=32, help="number of blocks to compare")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    names = [name.strip() for name in args.backends.split(',') if name.strip()]
+    codes = sample_corpus(args.corpus, args.limit)
+    if not codes:
+        print(f"No code blocks found under {args.corpus}", file=sys.stderr)
+        return 1
+
+    os.environ['DOCUCODE_BACKEND'] = 'torch'
+    report = parity_report(names, codes)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    print(f"{len(codes)} blocks, reference backend: {names[0]}")
+    print(f"{'backend':<8} {'load s':>8} {'RSS +MB':>8} {'p50 ms':>8} {'p95 ms':>8} {'exact':>7} {'similar':>8}")
+    for row in report:
+        print(f"{row['backend']:<8} {row['load_seconds']:>8} {row['rss_growth_mb']:>8} {row['p50_ms']:>8} "
+              f"{row['p95_ms']:>8} {row['exact_match']:>7.2%} {row['similarity']:>8.2%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
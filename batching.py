@@ -0,0 +1,218 @@
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+
+def bucket_of(tokens, bounds):
+    """Index of the length bucket for ``tokens``: the first bound it does not exceed (len(bounds) past the last)."""
+    if tokens is None or not bounds:
+        return 0
+    return bisect.bisect_left(bounds, tokens)
+
+
+def bucket_label(bucket, bounds):
+    """Readable name of a bucket, e.g. '65-128' or '>256'."""
+    if not bounds:
+        return 'all'
+    if bucket >= len(bounds):
+        return f">{bounds[-1]}"
+    return f"{bounds[bucket - 1] + 1 if bucket else 1}-{bounds[bucket]}"
+
+
+def fitting(lengths, max_batch_size, max_batch_tokens=None):
+    """
+    How many of ``lengths``, taken in order, fit in one batch.
+
+    A padded batch costs its size times its longest input, which must stay
+    within ``max_batch_tokens``; at least one item always fits.
+    """
+    longest = 0
+    count = 0
+    for length in lengths:
+        if count == max_batch_size:
+            break
+        longest = max(longest, length or 0)
+        if count and max_batch_tokens and (count + 1) * longest > max_batch_tokens:
+            break
+        count += 1
+    return count
+
+
+def plan_batches(lengths, bounds=(), max_batch_size=8, max_batch_tokens=None):
+    """
+    Groups item indices into batches the way MicroBatcher would for items queued together.
+
+    Items are split into length buckets (``bounds`` are the inclusive upper
+    bounds) and each bucket is cut into batches in arrival order. With no
+    bounds and no token budget this is plain fixed-size batching.
+    """
+    buckets = OrderedDict()
+    for i, length in enumerate(lengths):
+        buckets.setdefault(bucket_of(length, bounds), []).append(i)
+    batches = []
+    for indices in buckets.values():
+        while indices:
+            count = fitting([lengths[i] for i in indices], max_batch_size, max_batch_tokens)
+            batches.append(indices[:count])
+            indices = indices[count:]
+    return batches
+
+
+def padding_efficiency(batches, lengths):
+    """Real tokens over padded tokens for ``batches`` of indices into ``lengths``."""
+    real = sum(lengths[i] for batch in batches for i in batch)
+    padded = sum(len(batch) * max(lengths[i] for i in batch) for batch in batches if batch)
+    return real / padded if padded else 1.0
+
+
+class MicroBatcher:
+    """
+    Merges concurrent generation requests into micro-batches.
+
+    Callers submit one item at a time and get a Future back. A single
+    background thread drains the queue, waiting at most ``max_wait`` seconds
+    after the oldest pending item arrived for up to ``max_batch_size`` items,
+    and hands them to ``process_batch`` in one call. ``process_batch`` must
+    return one result per item, in order.
+
+    Items submitted with different ``key`` values (e.g. decoding settings)
+    are never mixed in one batch; the key whose oldest item has waited
+    longest is served first.
+
+    Items submitted with their input length in ``tokens`` are also kept
+    apart by length bucket (``bucket_bounds``, inclusive upper bounds), so
+    short blocks are not padded to the length of long ones. With
+    ``max_batch_tokens`` a batch is closed once one more item would push its
+    padded size (items times longest input) over the budget, so batches of
+    short blocks grow larger than batches of long ones.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait=0.01, bucket_bounds=(), max_batch_tokens=None):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait))
+        self.bucket_bounds = tuple(sorted(bucket_bounds or ()))
+        self.max_batch_tokens = max_batch_tokens or None
+        self._lock = threading.Lock()
+        self._reset()
+        self._thread = None
+        self._pid = None
+
+    def _reset(self):
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()
+        self._size = 0
+
+    def submit(self, item, key=None, tokens=None):
+        """Queue one item for the next batch and return a Future for its result."""
+        return self.submit_many([item], key, [tokens])[0]
+
+    def submit_many(self, items, key=None, tokens=None):
+        """
+        Queue several items in one step and return a Future for each.
+
+        They are queued under one lock, so the worker never closes a batch
+        after seeing only some of them. ``tokens`` gives each item's length.
+        """
+        tokens = list(tokens) if tokens is not None else [None] * len(items)
+        futures = [Future() for _ in items]
+        self._ensure_started()
+        arrived = time.monotonic()
+        with self._cond:
+            for item, future, length in zip(items, futures, tokens):
+                queue_key = (key, bucket_of(length, self.bucket_bounds))
+                self._queues.setdefault(queue_key, deque()).append((item, future, arrived, length))
+            self._size += len(futures)
+            self._cond.notify()
+        return futures
+
+    def pending(self):
+        """Number of items waiting for a batch slot."""
+        return self._size
+
+    def _ensure_started(self):
+        # The worker thread is started lazily, and restarted after a fork, so a
+        # batcher created at import time also works in forked server workers.
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                if self._pid is not None and self._pid != os.getpid():
+                    self._reset()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        with self._cond:
+            while self._size == 0:
+                self._cond.wait()
+            key = min(self._queues, key=lambda k: self._queues[k][0][2])
+            queue = self._queues[key]
+            deadline = queue[0][2] + self.max_wait
+            while self._fitting(queue) == len(queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [queue.popleft() for _ in range(self._fitting(queue))]
+            if not queue:
+                del self._queues[key]
+            self._size -= len(batch)
+            return batch
+
+    def _fitting(self, queue):
+        return fitting((tokens for *_, tokens in queue), self.max_batch_size, self.max_batch_tokens)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Skip work whose caller has already given up.
+            batch = [(item, future) for item, future, _, _ in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.process_batch([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"Batch returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class SingleFlight:
+    """
+    Lets concurrent callers asking for the same key share one Future.
+
+    The first caller's ``start()`` creates the Future; everyone who asks for
+    the key while it is pending gets that Future too. The key is forgotten
+    once the Future completes, so later callers start afresh (by then the
+    result is normally in a cache).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def submit(self, key, start):
+        """Returns ``(future, shared)``; ``shared`` is True if another caller started it."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future, True
+            future = self._in_flight[key] = start()
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future, False
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def pending(self):
+        """Number of keys with a generation in flight."""
+        return len(self._in_flight)
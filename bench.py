@@ -0,0 +1,404 @@
+"""
+Latency and throughput benchmarks for the comment pipeline.
+
+    python bench.py --tiny                          # offline, randomly initialised tiny T5
+    python bench.py --repo path/to/repo --output run.json
+    python bench.py --tiny --baseline run.json      # exit 1 on regressions
+
+Drivers:
+    route      POST /generate-comment through Flask's test client
+    inprocess  app.generate_comments in batches, no HTTP
+    extract         code_blocks.find_blocks over the corpus files
+    extract_legacy  the original per-node ``splitlines`` extractor, for comparison
+    highlight       highlighting.scan_line over a --highlight-lines line module
+    highlight_qt    a full CodeHighlighter.rehighlight of the same module in a
+                    QTextDocument (offscreen; skipped without PyQt5)
+    padding         padding efficiency (real over padded input tokens) of the
+                    corpus batched in fixed-size batches and by length bucket
+                    (--buckets, --max-batch-tokens); needs only the tokenizer
+
+The extract drivers also parse one large synthetic module (--extract-functions).
+
+Each driver reports p50/p95 latency, blocks/sec and tokens/sec; the run
+also records peak RSS. The report is JSON so runs can be compared.
+"""
+import argparse
+import ast
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+# Benchmarks measure the model, not the comment cache.
+os.environ.setdefault('DOCUCODE_CACHE_DIR', '')
+
+from batching import padding_efficiency, plan_batches
+from code_blocks import find_blocks
+
+# Metrics where a larger value is better; every other metric is a latency or size.
+HIGHER_IS_BETTER = {'blocks_per_sec', 'tokens_per_sec', 'files_per_sec', 'lines_per_sec',
+                    'fixed_efficiency', 'bucketed_efficiency'}
+
+
+def synthetic_file(num_functions, seed=0):
+    """A module of functions and classes with bodies of varying length."""
+    rng = random.Random(seed)
+    parts = ["import os\n"]
+    for i in range(num_functions):
+        body_lines = rng.choice([1, 4, 16, 64])
+        body = "\n".join(f"    value_{j} = value_{j - 1} * {rng.randint(1, 9)} + len(str(arg_{j % 3}))"
+                         for j in range(1, body_lines + 1))
+        parts.append(f"def function_{i}(arg_0, arg_1, arg_2):\n"
+                     f"    value_0 = arg_0\n{body}\n    return value_{body_lines}\n")
+        if i % 5 == 4:
+            parts.append(f"class Helper{i}:\n"
+                         f"    def __init__(self, path):\n        self.path = path\n\n"
+                         f"    def exists(self):\n        return os.path.exists(self.path)\n")
+    return "\n".join(parts)
+
+
+def highlight_text(num_lines):
+    """About ``num_lines`` lines of code with strings, comments and multi-line docstrings."""
+    documented = ('def documented_{i}(path, mode="r"):\n'
+                  '    """\n    Opens {{path}} and returns its lines.\n\n    Raises OSError on failure.\n    """\n'
+                  "    with open(path, mode) as f:  # mode {i}\n"
+                  "        return [line.rstrip('\\n') for line in f if line.strip() != ''] + [0x{i:x}, {i}.5]\n")
+    parts, lines, i = [], 0, 0
+    while lines < num_lines:
+        part = synthetic_file(5, seed=i) + "\n" + documented.format(i=i)
+        parts.append(part)
+        lines += part.count("\n") + 1
+        i += 1
+    return "\n".join("\n".join(parts).split("\n")[:num_lines])
+
+
+def build_corpus(repo=None, synthetic=64, limit=None):
+    """Returns (files, blocks): source texts and the code blocks extracted from them."""
+    files = [synthetic_file(synthetic)] if synthetic else []
+    if repo:
+        from cli import iter_python_files
+        for path in iter_python_files(repo):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    files.append(f.read())
+            except (OSError, UnicodeDecodeError):
+                pass
+    blocks = []
+    for source in files:
+        try:
+            blocks.extend(block.source for block in find_blocks(source))
+        except SyntaxError:
+            pass
+    if limit:
+        blocks = blocks[:limit]
+    return files, blocks
+
+
+def load_tiny_model(app):
+    """
+    Installs a randomly initialised tiny T5 with the project tokenizer into ``app``.
+
+    Needs no network access; it exercises the same code paths as the real
+    model at a fraction of the cost, which is what regression tracking needs.
+    """
+    import torch
+    from transformers import AutoTokenizer, T5Config, T5ForConditionalGeneration
+
+    torch.manual_seed(0)
+    tokenizer = AutoTokenizer.from_pretrained(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'codet5_commenter_final'))
+    config = T5Config(vocab_size=len(tokenizer), d_model=64, d_kv=16, d_ff=128, num_layers=2,
+                      num_decoder_layers=2, num_heads=4, pad_token_id=tokenizer.pad_token_id,
+                      eos_token_id=tokenizer.eos_token_id, decoder_start_token_id=tokenizer.pad_token_id)
+    model = T5ForConditionalGeneration(config).eval()
+
+    app.tokenizer = tokenizer
+    app.model = model
+    app.device = torch.device('cpu')
+    app.model_id = 'tiny-random-t5'
+    app.load_state.update(stage="Model ready", progress=1.0, error=None)
+    app.model_ready.set()
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+        return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+    except ImportError:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+
+
+def summarize(latencies, elapsed, blocks, tokens=None):
+    latencies = sorted(latencies)
+    result = {
+        'count': blocks,
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3),
+        'blocks_per_sec': round(blocks / elapsed, 2),
+    }
+    if tokens is not None:
+        result['tokens_per_sec'] = round(tokens / elapsed, 2)
+    return result
+
+
+def count_tokens(tokenizer, texts):
+    return sum(len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids'])
+
+
+def bench_route(app, blocks):
+    client = app.app.test_client()
+    latencies, comments = [], []
+    start = time.perf_counter()
+    for code in blocks:
+        t0 = time.perf_counter()
+        response = client.post('/generate-comment', json={'code': code})
+        latencies.append(time.perf_counter() - t0)
+        if response.status_code != 200:
+            raise RuntimeError(f"/generate-comment returned {response.status_code}: {response.get_json()}")
+        comments.append(response.get_json()['comment'])
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed, len(blocks), count_tokens(app.tokenizer, comments))
+
+
+def bench_inprocess(app, blocks, batch_size):
+    latencies, comments = [], []
+    start = time.perf_counter()
+    for i in range(0, len(blocks), batch_size):
+        t0 = time.perf_counter()
+        comments.extend(app.generate_comments(blocks[i:i + batch_size]))
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    result = summarize(latencies, elapsed, len(blocks), count_tokens(app.tokenizer, comments))
+    result['batch_size'] = batch_size
+    return result
+
+
+def legacy_extract(code):
+    """The extractor the GUI started out with: splits the file again per node."""
+    blocks = []
+    tree = ast.parse(code)
+
+    def visit(node):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start_line = node.lineno - 1
+            end_line = getattr(node, 'end_lineno', len(code.splitlines()))
+            blocks.append("\n".join(code.splitlines()[start_line:end_line]))
+        for child in ast.iter_child_nodes(node):
+            visit(child)
+
+    visit(tree)
+    return blocks
+
+
+def bench_extract(files, extract=find_blocks, repeat=3):
+    latencies, blocks = [], 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for source in files:
+            t0 = time.perf_counter()
+            try:
+                blocks += len(extract(source))
+            except SyntaxError:
+                pass
+            latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    result = summarize(latencies, elapsed, blocks)
+    result['files_per_sec'] = round(len(files) * repeat / elapsed, 2)
+    return result
+
+
+def bench_highlight(text, repeat=3):
+    """Times scanning every line of ``text``, threading the multi-line string state."""
+    from highlighting import scan_lines
+    lines = text.split("\n")
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in scan_lines(lines):
+            pass
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    return highlight_result(latencies, elapsed, len(lines) * repeat)
+
+
+def bench_highlight_qt(text, repeat=3):
+    """Times a full rehighlight of ``text`` by the editor's highlighter, or None without PyQt5."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtGui import QTextDocument
+        from PyQt5.QtWidgets import QApplication
+        from main_gui import CodeHighlighter
+    except ImportError:
+        return None
+    qt_app = QApplication.instance() or QApplication([])
+    document = QTextDocument()
+    document.setPlainText(text)
+    highlighter = CodeHighlighter(document)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        highlighter.rehighlight()
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    return highlight_result(latencies, elapsed, document.blockCount() * repeat)
+
+
+def highlight_result(latencies, elapsed, lines):
+    latencies = sorted(latencies)
+    return {
+        'count': lines,
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'lines_per_sec': round(lines / elapsed, 2),
+    }
+
+
+def bench_padding(tokenizer, blocks, batch_size, bounds, max_batch_size, max_batch_tokens):
+    """Padding efficiency of the corpus in fixed batches of ``batch_size`` versus length-bucketed batches."""
+    lengths = [len(ids) for ids in tokenizer([f"summarize: {code}" for code in blocks], max_length=512,
+                                             truncation=True)['input_ids']]
+    fixed = plan_batches(lengths, (), batch_size)
+    bucketed = plan_batches(lengths, bounds, max_batch_size, max_batch_tokens)
+    return {
+        'count': len(blocks),
+        'buckets': ",".join(map(str, bounds)),
+        'fixed_batches': len(fixed),
+        'fixed_efficiency': round(padding_efficiency(fixed, lengths), 4),
+        'bucketed_batches': len(bucketed),
+        'bucketed_efficiency': round(padding_efficiency(bucketed, lengths), 4),
+    }
+
+
+def compare(report, baseline, threshold):
+    """Lists the metrics that got worse than ``baseline`` by more than ``threshold``."""
+    regressions = []
+    for driver, metrics in report['results'].items():
+        for name, value in metrics.items():
+            old = baseline.get('results', {}).get(driver, {}).get(name)
+            if not isinstance(value, (int, float)) or not old or name in ('count', 'batch_size'):
+                continue
+            change = (value - old) / old
+            worse = -change if name in HIGHER_IS_BETTER else change
+            if worse > threshold:
+                regressions.append(f"{driver}.{name}: {old} -> {value} ({change:+.1%})")
+    old_rss = baseline.get('peak_rss_mb')
+    if old_rss and (report['peak_rss_mb'] - old_rss) / old_rss > threshold:
+        regressions.append(f"peak_rss_mb: {old_rss} -> {report['peak_rss_mb']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the comment pipeline.")
+    parser.add_argument('--drivers', default='route,inprocess,extract,extract_legacy,highlight,highlight_qt,padding',
+                        help="comma-separated drivers to run (default: %(default)s)")
+    parser.add_argument('--tiny', action='store_true',
+                        help="use a randomly initialised tiny T5 instead of the real model (offline)")
+    parser.add_argument('--repo', help="add the .py files under this directory to the corpus")
+    parser.add_argument('--synthetic', type=int, default=32,
+                        help="number of synthetic functions in the corpus (default: %(default)s)")
+    parser.add_argument('--extract-functions', type=int, default=500,
+                        help="functions in the large module added for the extract drivers (default: %(default)s)")
+    parser.add_argument('--highlight-lines', type=int, default=10000,
+                        help="lines in the module the highlight drivers rehighlight (default: %(default)s)")
+    parser.add_argument('--limit', type=int, default=64, help="maximum number of blocks sent to the model")
+    parser.add_argument('--batch-size', type=int, default=8,
+                        help="batch size for the in-process driver and the padding driver's fixed batches")
+    parser.add_argument('--buckets', default='32,64,128,256',
+                        help="length bucket upper bounds in tokens for the padding driver (default: %(default)s)")
+    parser.add_argument('--max-batch-size', type=int, default=32,
+                        help="most blocks per bucketed batch in the padding driver (default: %(default)s)")
+    parser.add_argument('--max-batch-tokens', type=int, default=4096,
+                        help="padded token budget per bucketed batch in the padding driver (default: %(default)s)")
+    parser.add_argument('--output', help="write the JSON report to this file")
+    parser.add_argument('--baseline', help="compare against a previous JSON report")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="relative change that counts as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    drivers = [name.strip() for name in args.drivers.split(',') if name.strip()]
+    files, blocks = build_corpus(args.repo, args.synthetic, args.limit)
+    if not blocks:
+        print("The corpus has no code blocks.", file=sys.stderr)
+        return 1
+
+    results = {}
+    extract_files = files + ([synthetic_file(args.extract_functions, seed=1)] if args.extract_functions else [])
+    if 'extract' in drivers:
+        results['extract'] = bench_extract(extract_files)
+    if 'extract_legacy' in drivers:
+        results['extract_legacy'] = bench_extract(extract_files, legacy_extract)
+    if 'highlight' in drivers or 'highlight_qt' in drivers:
+        text = highlight_text(args.highlight_lines)
+        if 'highlight' in drivers:
+            results['highlight'] = bench_highlight(text)
+        if 'highlight_qt' in drivers:
+            result = bench_highlight_qt(text)
+            if result is None:
+                print("Skipping highlight_qt: PyQt5 is not installed.", file=sys.stderr)
+            else:
+                results['highlight_qt'] = result
+
+    if 'padding' in drivers:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                               'codet5_commenter_final'))
+        bounds = tuple(int(bound) for bound in args.buckets.split(',') if bound.strip())
+        results['padding'] = bench_padding(tokenizer, blocks, args.batch_size, bounds, args.max_batch_size,
+                                           args.max_batch_tokens)
+
+    model_drivers = [name for name in drivers if name in ('route', 'inprocess')]
+    if model_drivers:
+        import app
+        app.configure_logging()
+        from comment_cache import CommentCache
+        app.comment_cache = CommentCache(None, max_memory_entries=0)
+        if args.tiny:
+            load_tiny_model(app)
+        else:
+            app.load_model()
+            if app.model is None:
+                print("Error: the model could not be loaded.", file=sys.stderr)
+                return 1
+        # Warm up so one-off initialisation is not counted.
+        app.generate_comments(blocks[:1])
+        if 'route' in model_drivers:
+            results['route'] = bench_route(app, blocks)
+        if 'inprocess' in model_drivers:
+            results['inprocess'] = bench_inprocess(app, blocks, args.batch_size)
+
+    report = {
+        'config': {
+            'model': 'tiny' if args.tiny else 'codet5',
+            'blocks': len(blocks),
+            'files': len(files),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'peak_rss_mb': peak_rss_mb(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
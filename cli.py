@@ -0,0 +1,182 @@
+"""
+Headless batch mode: comments every function and class under a directory.
+
+    python cli.py path/to/repo --output comments.jsonl
+    python cli.py path/to/repo --apply
+    python cli.py path/to/repo -o comments.jsonl --apply --dry-run > docstrings.diff
+    python cli.py path/to/repo --hierarchical --output comments.jsonl
+
+Files are parsed in parallel across processes and the blocks are fed to the
+in-process model (no Flask server and no PyQt5 needed).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from code_blocks import extract_file
+from docstring_writer import Edit, apply_files, report
+
+SKIP_DIRS = {'.git', '.hg', '.svn', '.tox', '.nox', '.venv', 'venv', '__pycache__',
+             'node_modules', 'build', 'dist', '.mypy_cache', '.pytest_cache'}
+
+
+def _walk(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS and not d.startswith('.'))
+        yield dirpath, filenames
+
+
+def iter_python_files(root):
+    """Yields every .py file under ``root`` (or ``root`` itself if it is a file)."""
+    if os.path.isfile(root):
+        yield root
+        return
+    for dirpath, filenames in _walk(root):
+        for filename in sorted(filenames):
+            if filename.endswith('.py'):
+                yield os.path.join(dirpath, filename)
+
+
+def iter_source_dirs(root):
+    """Yields ``root`` and every directory below it that ``iter_python_files`` looks into."""
+    for dirpath, _ in _walk(root):
+        yield dirpath
+
+
+def chunk_by_blocks(parsed, chunk_size):
+    """Groups (path, blocks) pairs into runs of whole files holding about ``chunk_size`` blocks."""
+    chunk, size = [], 0
+    for path, blocks in parsed:
+        chunk.append((path, blocks))
+        size += len(blocks)
+        if size >= chunk_size:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+class Progress:
+    """Single-line progress report on stderr."""
+
+    def __init__(self, total_files, enabled=True):
+        self.total_files = total_files
+        self.enabled = enabled
+        self.files = 0
+        self.blocks_found = 0
+        self.blocks_done = 0
+
+    def update(self, files=0, blocks_found=0, blocks_done=0):
+        self.files += files
+        self.blocks_found += blocks_found
+        self.blocks_done += blocks_done
+        if self.enabled:
+            sys.stderr.write(f"\r[files {self.files}/{self.total_files}] "
+                             f"[blocks {self.blocks_done}/{self.blocks_found}]")
+            sys.stderr.flush()
+
+    def close(self):
+        if self.enabled:
+            sys.stderr.write("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate comments for every function and class in a directory.")
+    parser.add_argument('path', help="directory (or single .py file) to comment")
+    parser.add_argument('-o', '--output', help="write results as JSONL to this file (default: stdout)")
+    parser.add_argument('--apply', action='store_true',
+                        help="insert the generated comments into the source files as docstrings")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="with --apply and -o, print a unified diff instead of changing any file")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="number of parser processes (default: all cores)")
+    parser.add_argument('--chunk-size', type=int, default=64,
+                        help="number of blocks queued for the model at a time")
+    parser.add_argument('--batch-size', type=int, default=16,
+                        help="maximum number of blocks per model call")
+    parser.add_argument('--hierarchical', action='store_true',
+                        help="summarize methods first and each class from its method summaries")
+    parser.add_argument('-q', '--quiet', action='store_true', help="disable progress output")
+    args = parser.parse_args(argv)
+    if args.dry_run and not args.apply:
+        parser.error("--dry-run only applies to --apply")
+    if args.dry_run and not args.output:
+        # The diff goes to stdout, so the JSONL records need a file of their own.
+        parser.error("--apply --dry-run needs -o/--output for the comments")
+
+    paths = list(iter_python_files(args.path))
+    if not paths:
+        print(f"No Python files found under {args.path}", file=sys.stderr)
+        return 1
+
+    start_time = time.perf_counter()
+    progress = Progress(len(paths), enabled=not args.quiet)
+
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = [pool.submit(extract_file, path) for path in paths]
+
+        # The model loads while the workers are parsing.
+        import app
+        app.configure_logging()
+        app.load_model()
+        if app.model is None:
+            print("Error: the model could not be loaded.", file=sys.stderr)
+            return 1
+        app.batcher.max_batch_size = max(1, args.batch_size)
+
+        parsed = []
+        for future in as_completed(futures):
+            path, blocks, error = future.result()
+            if error:
+                print(f"\nSkipping {path}: {error}", file=sys.stderr)
+            if blocks:
+                parsed.append((path, blocks))
+            progress.update(files=1, blocks_found=len(blocks))
+    # Workers finish in any order; keep the output stable from run to run.
+    parsed.sort(key=lambda item: item[0])
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    results = {}
+    total_blocks = 0
+    for chunk_files in chunk_by_blocks(parsed, args.chunk_size):
+        chunk = [(path, block) for path, blocks in chunk_files for block in blocks]
+        if args.hierarchical:
+            # Whole files go into a chunk, so each class sees all of its methods.
+            comments = [comment for file_comments in
+                        app.hierarchical_comments([blocks for _, blocks in chunk_files])
+                        for comment in file_comments]
+        else:
+            comments = app.comments_for([block.source for _, block in chunk])
+        for (path, block), comment in zip(chunk, comments):
+            results.setdefault(path, []).append((block, comment))
+            output.write(json.dumps({
+                "path": path,
+                "qualname": block.qualname,
+                "lineno": block.lineno,
+                "end_lineno": block.end_lineno,
+                "comment": comment,
+            }) + "\n")
+        progress.update(blocks_done=len(chunk))
+        total_blocks += len(chunk)
+
+    if args.apply:
+        edits_by_path = {path: [Edit(block.qualname, block.lineno, block.end_lineno, comment)
+                                for block, comment in items] for path, items in results.items()}
+        report(apply_files(edits_by_path, args.jobs, args.dry_run), args.dry_run)
+
+    progress.close()
+    if output is not sys.stdout:
+        output.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Commented {total_blocks} blocks in {len(paths)} files in {elapsed:.1f}s "
+          f"({len(paths) / elapsed:.1f} files/sec, {total_blocks / elapsed:.1f} blocks/sec)",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
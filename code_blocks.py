@@ -0,0 +1,185 @@
+import ast
+import hashlib
+import textwrap
+
+from parallel import map_files
+
+
+class Block:
+    """
+    One function or class found in a source file.
+
+    Line numbers are 1-based and inclusive, as reported by ``ast``. Records
+    are small: ``source`` is sliced from the file text on access (all blocks
+    of a file share one copy of it), and ``digest`` is computed on first use.
+    """
+    __slots__ = ('path', 'qualname', 'lineno', 'end_lineno', '_text', '_start', '_end', '_digest')
+
+    def __init__(self, qualname, lineno, end_lineno, text, start=0, end=None, path=None):
+        self.path = path
+        self.qualname = qualname
+        self.lineno = lineno
+        self.end_lineno = end_lineno
+        self._text = text
+        self._start = start
+        self._end = len(text) if end is None else end
+        self._digest = None
+
+    @property
+    def source(self):
+        return self._text[self._start:self._end]
+
+    @property
+    def digest(self):
+        """Short hash of the block's normalized AST (see ``block_digest``)."""
+        if self._digest is None:
+            self._digest = block_digest(self.source)
+        return self._digest
+
+    def __getstate__(self):
+        # Pickle only this block's text, so blocks sent back from a worker
+        # process don't each carry (or share, by luck of the memo) the file.
+        return (self.path, self.qualname, self.lineno, self.end_lineno, self.source, self._digest)
+
+    def __setstate__(self, state):
+        self.path, self.qualname, self.lineno, self.end_lineno, self._text, self._digest = state
+        self._start, self._end = 0, len(self._text)
+
+    def __repr__(self):
+        return f"Block({self.qualname!r}, {self.lineno}, {self.end_lineno})"
+
+
+def line_offsets(code):
+    """Character offset at which each line of ``code`` starts, plus one for the end."""
+    offsets = [0]
+    position = code.find("\n")
+    while position != -1:
+        offsets.append(position + 1)
+        position = code.find("\n", position + 1)
+    offsets.append(len(code) + 1)
+    return offsets
+
+
+_STATEMENT_LISTS = {'body', 'orelse', 'finalbody', 'handlers', 'cases'}
+_fields_cache = {}
+
+
+def _statement_fields(node_type):
+    """The fields of ``node_type`` that hold statements (or handlers/cases), in ``_fields`` order."""
+    fields = _fields_cache.get(node_type)
+    if fields is None:
+        fields = _fields_cache[node_type] = tuple(f for f in node_type._fields if f in _STATEMENT_LISTS)
+    return fields
+
+
+def find_blocks(code, path=None):
+    """
+    Returns every function and class in ``code`` as a Block, outermost first.
+
+    Nested definitions are reported after their parent, in the same order as
+    the GUI's original extractor (``bench.legacy_extract``) produced them.
+    Qualified names are made unique with a ``#n`` suffix (e.g. property
+    setters). Raises SyntaxError if ``code`` does not parse.
+
+    Line start offsets are computed once, so each block is a slice of the
+    text and extraction is linear in the size of the file.
+    """
+    if "\r" in code:
+        # ast counts \r\n and \r as line breaks too; slice with plain \n.
+        code = code.replace("\r\n", "\n").replace("\r", "\n")
+    tree = ast.parse(code)
+    offsets = line_offsets(code)
+    last_line = len(offsets) - (2 if code.endswith("\n") else 1)
+    blocks = []
+    seen = {}
+    scopes = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+    # An explicit stack instead of recursion: deeply nested generated code
+    # must not hit the recursion limit. Children are pushed in reverse so
+    # they are visited in source order (pre-order, as before). Definitions
+    # are statements, so only statement lists are walked, not expressions.
+    stack = [(tree, "")]
+    while stack:
+        node, prefix = stack.pop()
+        if isinstance(node, scopes):
+            qualname = f"{prefix}.{node.name}" if prefix else node.name
+            seen[qualname] = seen.get(qualname, 0) + 1
+            if seen[qualname] > 1:
+                qualname = f"{qualname}#{seen[qualname]}"
+            end_lineno = min(getattr(node, 'end_lineno', None) or last_line, last_line)
+            # Like "\n".join(lines[start:end]): no newline after the last line.
+            end = max(offsets[node.lineno - 1], offsets[end_lineno] - 1)
+            blocks.append(Block(qualname, node.lineno, end_lineno, code, offsets[node.lineno - 1], end, path))
+            prefix = qualname
+        children = []
+        for field in _statement_fields(type(node)):
+            children.extend(getattr(node, field))
+        stack.extend((child, prefix) for child in reversed(children))
+    return blocks
+
+
+def extract_source(code, path=None):
+    """
+    ``find_blocks`` with every block's digest computed up front.
+
+    Meant to run in a worker process, so the hashing happens there too.
+    """
+    blocks = find_blocks(code, path)
+    for block in blocks:
+        block.digest  # cached on the record and pickled with it
+    return blocks
+
+
+def extract_file(path):
+    """
+    Reads and extracts one file: returns ``(path, blocks, error)``.
+
+    Digests are computed here (see ``extract_source``). Never raises, so it
+    can be mapped over many files in a process pool.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return path, extract_source(f.read(), path), None
+    except (OSError, UnicodeDecodeError, SyntaxError, ValueError, RecursionError) as e:
+        return path, [], str(e)
+
+
+def extract_files(paths, jobs=None, chunksize=8):
+    """Extracts many files with ``jobs`` processes (see ``map_files``), yielding ``extract_file`` results in order."""
+    return map_files(extract_file, paths, jobs, chunksize)
+
+
+def normalize_code(code):
+    """
+    Returns a canonical form of a code block.
+
+    The block is dedented and parsed, and the ``ast`` dump is used, so
+    whitespace, formatting and ``#`` comments do not change it. Blocks that
+    do not parse fall back to their whitespace-collapsed text.
+    """
+    try:
+        return ast.dump(ast.parse(textwrap.dedent(code)))
+    except (SyntaxError, ValueError):
+        return " ".join(code.split())
+
+
+def block_digest(source):
+    """Short hash of a block's normalized AST."""
+    return hashlib.sha1(normalize_code(source).encode('utf-8')).hexdigest()
+
+
+def diff_blocks(snapshot, blocks):
+    """
+    Compares freshly extracted blocks against a snapshot.
+
+    ``snapshot`` maps qualified names to the digest each block had when its
+    comment was generated. Returns ``(changed, deleted)``: the Blocks that are
+    new or whose AST differs, and the qualified names that no longer exist.
+    """
+    current = set()
+    changed = []
+    for block in blocks:
+        current.add(block.qualname)
+        if snapshot.get(block.qualname) != block.digest:
+            changed.append(block)
+    deleted = [qualname for qualname in snapshot if qualname not in current]
+    return changed, deleted
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from code_blocks import normalize_code
+from sqlite_db import LazyConnection
+
+
+def cache_key(code, model_id, settings):
+    """Hash of the normalized block together with the model and decoding settings."""
+    return normalized_key(normalize_code(code), model_id, settings)
+
+
+def normalized_key(normalized, model_id, settings):
+    """``cache_key`` for a block already passed through ``normalize_code``."""
+    payload = json.dumps([normalized, model_id, settings], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS comments ("
+    " key TEXT PRIMARY KEY,"
+    " comment TEXT NOT NULL,"
+    " size INTEGER NOT NULL,"
+    " last_access REAL NOT NULL);"
+    "CREATE INDEX IF NOT EXISTS comments_last_access ON comments (last_access);"
+)
+
+
+class CommentCache:
+    """
+    Two-tier cache of generated comments.
+
+    Lookups go to an in-memory LRU first and then to an SQLite file on disk;
+    disk hits are promoted into memory. The disk tier is evicted least
+    recently used first once its payload exceeds ``max_disk_bytes``.
+    """
+
+    def __init__(self, path=None, max_memory_entries=4096, max_disk_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = LazyConnection(path, _SCHEMA, on_open=self._count_disk_bytes) if path else None
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _db(self):
+        return self._conn() if self._conn is not None else None
+
+    def _count_disk_bytes(self, conn):
+        self._disk_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM comments").fetchone()[0]
+
+    def get(self, key):
+        """Returns the cached comment for ``key``, or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+            conn = self._db()
+            if conn is not None:
+                row = conn.execute("SELECT comment FROM comments WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE comments SET last_access = ? WHERE key = ?", (time.time(), key))
+                    conn.commit()
+                    self._remember(key, row[0])
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, comment):
+        """Stores ``comment`` in both tiers."""
+        with self._lock:
+            self._remember(key, comment)
+            conn = self._db()
+            if conn is None:
+                return
+            size = len(key) + len(comment.encode('utf-8'))
+            row = conn.execute("SELECT size FROM comments WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO comments (key, comment, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, comment, size, time.time()),
+            )
+            self._disk_bytes += size - (row[0] if row else 0)
+            self._evict_disk(conn)
+            conn.commit()
+
+    def _remember(self, key, comment):
+        self._memory[key] = comment
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, conn):
+        while self._disk_bytes > self.max_disk_bytes:
+            rows = conn.execute(
+                "SELECT key, size FROM comments ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            for key, size in rows:
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+                conn.execute("DELETE FROM comments WHERE key = ?", (key,))
+                self._disk_bytes -= size
+                self.evictions += 1
+
+    def clear(self):
+        """Drops every cached comment from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            conn = self._db()
+            if conn is not None:
+                conn.execute("DELETE FROM comments")
+                conn.commit()
+                self._disk_bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and tier sizes."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
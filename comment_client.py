@@ -0,0 +1,196 @@
+import json
+import queue
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_SERVER = 'http://127.0.0.1:5000'
+# (connect, read) timeouts; the first request may wait for the model to finish loading.
+REQUEST_TIMEOUT = (5, 300)
+
+
+class Cancelled(Exception):
+    """Raised when a request is abandoned because the caller cancelled the run."""
+
+
+class CommentClient:
+    """
+    HTTP client for the comment server.
+
+    One pooled keep-alive session is shared by up to ``max_in_flight``
+    concurrent requests. Failed blocks are retried with backoff on connection
+    errors and 5xx responses, and every wait checks ``cancel_event`` so a run
+    can be stopped cooperatively.
+    """
+
+    def __init__(self, base_url=DEFAULT_SERVER, max_in_flight=4, retries=2, timeout=REQUEST_TIMEOUT,
+                 cancel_event=None):
+        self.base_url = base_url.rstrip('/')
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.retries = retries
+        self.timeout = timeout
+        self.cancel_event = cancel_event or threading.Event()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def close(self):
+        self.session.close()
+
+    def _check_cancelled(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def status(self):
+        """The server's /status answer (also while it is loading or failed)."""
+        return self.session.get(f"{self.base_url}/status", timeout=5).json()
+
+    def wait_until_reachable(self, timeout=30):
+        """
+        Polls /status until the server answers and returns its state.
+
+        The server queues requests while the model is still loading, so a
+        'loading' answer is good enough. Raises RuntimeError if the model failed
+        to load or the server never answers.
+        """
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            self._check_cancelled()
+            try:
+                state = self.status()
+                if state.get('status') == 'failed':
+                    raise RuntimeError(f"Model failed to load: {state.get('error')}")
+                return state
+            except (requests.exceptions.RequestException, ValueError):
+                pass
+            self.cancel_event.wait(1)
+        raise RuntimeError("Local server is not ready. Please ensure app.py is running.")
+
+    def _with_retries(self, request):
+        for attempt in range(self.retries + 1):
+            self._check_cancelled()
+            try:
+                return request()
+            except requests.exceptions.HTTPError as e:
+                # Client errors will not go away on retry.
+                if (e.response is not None and e.response.status_code < 500) or attempt == self.retries:
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.retries:
+                    raise
+            self.cancel_event.wait(0.5 * 2 ** attempt)
+
+    def generate(self, code):
+        """Comment for one block via /generate-comment."""
+        def request():
+            response = self.session.post(f"{self.base_url}/generate-comment", json={'code': code},
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()['comment']
+        return self._with_retries(request)
+
+    def generate_batch(self, codes):
+        """Comments for several blocks in one /generate-comments call."""
+        def request():
+            response = self.session.post(f"{self.base_url}/generate-comments", json={'codes': codes},
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()['comments']
+        return self._with_retries(request)
+
+    def stream(self, code, on_partial=None):
+        """Comment for one block via the streaming endpoint, reporting the text as it grows."""
+        def request():
+            text = ""
+            with self.session.post(f"{self.base_url}/generate-comment/stream", json={'code': code},
+                                   stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    self._check_cancelled()
+                    if not line or not line.startswith('data: '):
+                        continue
+                    event = json.loads(line[len('data: '):])
+                    if 'error' in event:
+                        raise RuntimeError(event['error'])
+                    if event.get('done'):
+                        return event['comment']
+                    text += event.get('token', '')
+                    if on_partial:
+                        on_partial(text.strip())
+            return text.strip()
+        return self._with_retries(request)
+
+    def generate_many(self, codes, on_result, on_partial=None, stream=False, batch_size=8):
+        """
+        Generates comments for ``codes`` with up to ``max_in_flight`` requests at once.
+
+        ``on_result(index, comment)`` is called from a pool thread as each block
+        completes, so results can arrive out of order. Blocks are sent through
+        the batch API ``batch_size`` at a time, where the server batches them
+        with other clients' work and merges duplicates. With ``stream`` the
+        first block is streamed instead, with ``on_partial(index, text)``
+        reporting progress, so something shows up while the rest are batched.
+        The first error cancels the remaining blocks and is re-raised.
+
+        Requests run on daemon threads and a cancelled run returns at once,
+        without waiting for requests already sent; their answers are dropped.
+        """
+        def stream_task(start):
+            partial = (lambda text: on_partial(start, text)) if on_partial else None
+            on_result(start, self.stream(codes[start], partial))
+
+        def batch_task(start):
+            for offset, comment in enumerate(self.generate_batch(codes[start:start + batch_size])):
+                on_result(start + offset, comment)
+
+        first = 1 if stream and codes else 0
+        tasks = [(stream_task, 0)] if first else []
+        tasks.extend((batch_task, start) for start in range(first, len(codes), max(1, batch_size)))
+
+        todo = queue.Queue()
+        for task in tasks:
+            todo.put(task)
+        lock = threading.Lock()
+        errors = []
+        remaining = [len(tasks)]
+        done = threading.Event()
+        if not tasks:
+            done.set()
+
+        def work():
+            while not self.cancelled:
+                try:
+                    task, start = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    task(start)
+                except BaseException as e:
+                    with lock:
+                        errors.append(e)
+                    self.cancel()
+                with lock:
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        done.set()
+
+        # Not a ThreadPoolExecutor: its threads are joined at interpreter exit,
+        # so a request stuck on a slow server would keep a closed app alive.
+        for _ in range(min(self.max_in_flight, len(tasks))):
+            threading.Thread(target=work, name="comment-request", daemon=True).start()
+        while not done.wait(0.05):
+            if self.cancelled:
+                break
+        if errors:
+            raise errors[0]
+        self._check_cancelled()
@@ -0,0 +1,335 @@
+"""
+Input compaction: shrinks a code block before it is tokenized.
+
+The model only sees the first MAX_INPUT_LENGTH tokens of a block, and every
+token it does see costs encoder time and cross-attention at each decode
+step. Compaction removes what carries little signal for a summary:
+
+    comments    - ``#`` comments
+    docstrings  - existing docstrings (the thing being generated anyway)
+    whitespace  - blank lines, trailing spaces; one space per indent level
+    nested      - bodies of functions defined inside the block, which keep
+                  only their signature and ``...``
+
+Blocks still over the token budget are truncated with a strategy that keeps
+the signature instead of cutting off the tail:
+
+    head-tail   - the first two thirds and the last third of the budget,
+                  joined by a ``...`` line
+    signature   - the signature plus an outline of the body (the first line
+                  of each statement, down to the deepest level that fits)
+    cut         - nothing; the tokenizer truncates as before
+
+Run ``python compaction.py some/dir`` to see how many tokens it saves.
+"""
+import argparse
+import ast
+import io
+import os
+import re
+import sys
+import textwrap
+import tokenize
+from collections import namedtuple
+
+STEPS = ('comments', 'docstrings', 'whitespace', 'nested')
+TRUNCATIONS = ('head-tail', 'signature', 'cut')
+
+# ``text`` is what gets tokenized; token counts exclude the prompt prefix.
+Compacted = namedtuple('Compacted', ['text', 'original_tokens', 'tokens', 'truncated'])
+
+_DEFS = (ast.FunctionDef, ast.AsyncFunctionDef)
+_SCOPES = _DEFS + (ast.ClassDef,)
+
+
+def approximate_token_counts(texts):
+    """Rough token counts (words and punctuation) for when no tokenizer is at hand."""
+    return [len(re.findall(r"\w+|[^\w\s]", text)) for text in texts]
+
+
+def _first_line(node):
+    """1-based first line of a statement, including its decorators."""
+    decorators = getattr(node, 'decorator_list', None)
+    if decorators:
+        return min(decorator.lineno for decorator in decorators)
+    return node.lineno
+
+
+def _indent(line):
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _docstring_node(node):
+    body = getattr(node, 'body', None)
+    if (body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant)
+            and isinstance(body[0].value.value, str)):
+        return body[0]
+    return None
+
+
+def _edit_tree(lines, tree, steps):
+    """
+    Applies the AST-based steps to ``lines`` (a list, modified in place).
+
+    Lines to remove become None; elided bodies collapse into one ``...`` line.
+    """
+    replace = {}
+
+    def drop(start, end, placeholder=None):
+        for lineno in range(start, end + 1):
+            lines[lineno - 1] = None
+        if placeholder is not None:
+            replace[start] = placeholder
+
+    def visit(node, depth):
+        if isinstance(node, _DEFS) and depth > 0 and 'nested' in steps:
+            first = _first_line(node.body[0])
+            if first > node.lineno:
+                drop(first, node.end_lineno, _indent(lines[first - 1] or "") + "...")
+                return
+        if 'docstrings' in steps and isinstance(node, (ast.Module,) + _SCOPES):
+            doc = _docstring_node(node)
+            if doc is not None:
+                head = lines[doc.lineno - 1]
+                tail = lines[doc.end_lineno - 1]
+                # Only docstrings on lines of their own; ``def f(): "doc"`` stays.
+                if (head is not None and tail is not None and not head[:doc.col_offset].strip()
+                        and tail[doc.end_col_offset:].strip()[:1] in ('', '#')):
+                    placeholder = _indent(head) + "..." if len(node.body) == 1 else None
+                    drop(doc.lineno, doc.end_lineno, placeholder)
+        for child in ast.iter_child_nodes(node):
+            visit(child, depth + 1 if isinstance(node, _SCOPES) else depth)
+
+    for statement in tree.body:
+        visit(statement, 0)
+    for lineno, placeholder in replace.items():
+        lines[lineno - 1] = placeholder
+
+
+def _strip_comments(text):
+    lines = text.split("\n")
+    try:
+        comments = [token.start for token in tokenize.generate_tokens(io.StringIO(text).readline)
+                    if token.type == tokenize.COMMENT]
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return "\n".join(line for line in lines if not line.lstrip().startswith('#'))
+    for row, col in comments:
+        stripped = lines[row - 1][:col].rstrip()
+        # Lines that held nothing but a comment go away entirely.
+        lines[row - 1] = stripped if stripped else None
+    return "\n".join(line for line in lines if line is not None)
+
+
+def _normalize_whitespace(text):
+    out = []
+    widths = [0]
+    for line in text.split("\n"):
+        if not line.strip():
+            continue
+        line = line.rstrip()
+        width = len(line) - len(line.lstrip())
+        while width < widths[-1]:
+            widths.pop()
+        if width > widths[-1]:
+            widths.append(width)
+        out.append(" " * (len(widths) - 1) + line.lstrip())
+    return "\n".join(out)
+
+
+def _statement_children(node):
+    for field in ('body', 'orelse', 'finalbody', 'handlers', 'cases'):
+        for child in getattr(node, field, None) or ():
+            yield child
+
+
+def _outline_lines(node, depth, keep):
+    """Collects the first line of every statement under ``node`` down to ``depth`` levels."""
+    if depth == 0:
+        return
+    for child in _statement_children(node):
+        if isinstance(child, ast.match_case):
+            keep.add(child.pattern.lineno)
+        else:
+            # Decorators belong to the outline of a definition.
+            keep.update(range(_first_line(child), child.lineno + 1))
+        _outline_lines(child, depth - 1, keep)
+
+
+class Compactor:
+    """
+    Compacts blocks and fits them into ``max_tokens``.
+
+    ``count_tokens`` takes a list of strings and returns their token counts
+    (the server passes the model's tokenizer); without it counts are
+    approximate. ``steps`` is any subset of STEPS and ``truncation`` one of
+    TRUNCATIONS.
+    """
+
+    def __init__(self, steps=STEPS, truncation='head-tail', max_tokens=None, count_tokens=None):
+        unknown = set(steps) - set(STEPS)
+        if unknown:
+            raise ValueError(f"Unknown compaction steps {sorted(unknown)}; expected some of {', '.join(STEPS)}")
+        if truncation not in TRUNCATIONS:
+            raise ValueError(f"Unknown truncation '{truncation}'; expected one of {', '.join(TRUNCATIONS)}")
+        self.steps = tuple(step for step in STEPS if step in steps)
+        self.truncation = truncation
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens or approximate_token_counts
+
+    def settings(self):
+        """What changes the compacted text, for cache keys."""
+        return {'compaction': list(self.steps), 'truncation': self.truncation, 'max_tokens': self.max_tokens}
+
+    def compact(self, code):
+        """``code`` with the configured steps applied (no truncation)."""
+        if not self.steps:
+            return code
+        text = textwrap.dedent(code).strip("\n")
+        if 'docstrings' in self.steps or 'nested' in self.steps:
+            try:
+                tree = ast.parse(text)
+            except (SyntaxError, ValueError):
+                tree = None
+            if tree is not None:
+                lines = text.split("\n")
+                _edit_tree(lines, tree, self.steps)
+                text = "\n".join(line for line in lines if line is not None)
+        if 'comments' in self.steps:
+            text = _strip_comments(text)
+        if 'whitespace' in self.steps:
+            text = _normalize_whitespace(text)
+        return text
+
+    def fit_many(self, codes):
+        """Compacts and, where needed, truncates each block. Returns Compacted records."""
+        texts = [self.compact(code) for code in codes]
+        original = self.count_tokens(codes) if codes else []
+        counts = self.count_tokens(texts) if texts else []
+        results = []
+        for text, before, after in zip(texts, original, counts):
+            truncated = False
+            if self.max_tokens is not None and after > self.max_tokens and self.truncation != 'cut':
+                text = self.truncate(text)
+                after = self.count_tokens([text])[0]
+                truncated = True
+            results.append(Compacted(text, before, after, truncated))
+        return results
+
+    def fit(self, code):
+        return self.fit_many([code])[0]
+
+    def truncate(self, text):
+        """Shortens ``text`` to about ``max_tokens`` with the configured strategy."""
+        if self.truncation == 'signature':
+            return self._signature_outline(text)
+        return self._head_tail(text.split("\n"))
+
+    def _head_tail(self, lines):
+        text = "\n".join(lines)
+        if self.count_tokens([text])[0] <= self.max_tokens:
+            return text
+        counts = self.count_tokens([line + "\n" for line in lines])
+        # Leave room for the "..." marker. Lines counted one by one can add
+        # up differently from the joined text, so the result is counted
+        # again and the budget tightened until it really fits.
+        budget = self.max_tokens - self.count_tokens(["...\n"])[0]
+        while budget > 0:
+            head_budget = budget * 2 // 3
+            head, used = 0, 0
+            while head < len(lines) and used + counts[head] <= head_budget:
+                used += counts[head]
+                head += 1
+            if head == 0:
+                break
+            tail = len(lines)
+            while tail > head and used + counts[tail - 1] <= budget:
+                tail -= 1
+                used += counts[tail]
+            marker = _indent(lines[tail] if tail < len(lines) else lines[head - 1]) + "..."
+            text = "\n".join(lines[:head] + [marker] + lines[tail:])
+            if self.count_tokens([text])[0] <= self.max_tokens:
+                return text
+            budget -= 1
+        # A single huge first line: keep what fits of it rather than nothing.
+        return self._prefix(lines[0])
+
+    def _prefix(self, line):
+        """The longest prefix of ``line`` that fits in ``max_tokens``."""
+        low, high = 0, len(line)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens([line[:middle]])[0] <= self.max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return line[:low]
+
+    def _signature_outline(self, text):
+        try:
+            tree = ast.parse(text)
+        except (SyntaxError, ValueError):
+            tree = None
+        if tree is None or len(tree.body) != 1 or not isinstance(tree.body[0], _SCOPES):
+            return self._head_tail(text.split("\n"))
+        root = tree.body[0]
+        lines = text.split("\n")
+        signature = set(range(_first_line(root), _first_line(root.body[0])))
+        outline = lines
+        for depth in (3, 2, 1):
+            keep = set(signature)
+            _outline_lines(root, depth, keep)
+            outline = [lines[lineno - 1] for lineno in sorted(keep)]
+            if sum(self.count_tokens(["\n".join(outline)])) <= self.max_tokens:
+                return "\n".join(outline)
+        return self._head_tail(outline)
+
+
+def main(argv=None):
+    from cli import iter_python_files
+    from code_blocks import extract_file
+
+    parser = argparse.ArgumentParser(description="Report how many input tokens compaction saves.")
+    parser.add_argument('path', help="a .py file or a directory")
+    parser.add_argument('--steps', default=','.join(STEPS), help="comma-separated steps (default: %(default)s)")
+    parser.add_argument('--truncation', choices=TRUNCATIONS, default='head-tail')
+    parser.add_argument('--max-tokens', type=int, default=500)
+    parser.add_argument('--tokenizer', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            'codet5_commenter_final'),
+                        help="tokenizer to count with; approximate counts are used if it cannot be loaded")
+    parser.add_argument('--show', action='store_true', help="print every compacted block")
+    args = parser.parse_args(argv)
+
+    count_tokens = None
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+        count_tokens = lambda texts: [len(ids) for ids in
+                                      tokenizer(texts, add_special_tokens=False)['input_ids']]
+    except Exception as e:
+        print(f"Counting approximately ({e})", file=sys.stderr)
+
+    compactor = Compactor([step for step in args.steps.split(',') if step], args.truncation,
+                          args.max_tokens, count_tokens)
+    before = after = blocks = truncated = 0
+    for path in iter_python_files(args.path):
+        _, found, _ = extract_file(path)
+        for block, result in zip(found, compactor.fit_many([block.source for block in found])):
+            blocks += 1
+            before += result.original_tokens
+            after += result.tokens
+            truncated += result.truncated
+            if args.show:
+                print(f"# {path}:{block.lineno} {block.qualname} "
+                      f"({result.original_tokens} -> {result.tokens} tokens)\n{result.text}\n")
+
+    if not blocks:
+        print(f"No code blocks found under {args.path}", file=sys.stderr)
+        return 1
+    saved = before - after
+    print(f"{blocks} blocks: {before} -> {after} tokens ({saved / max(1, before):.1%} saved), "
+          f"{truncated} truncated")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Adaptive decoding policies.
+
+A two-line getter does not need a six-beam, 256-token search. The policy
+picks greedy or a beam width, and a max length, from the input's token
+count. When the client gives a latency budget it also drops to narrower
+policies whose estimated cost fits. The cost estimate is calibrated from
+the decode times actually observed on this machine.
+"""
+import threading
+from collections import namedtuple
+
+Policy = namedtuple('Policy', ['name', 'num_beams', 'max_length', 'early_stopping'])
+
+# Widest first. Each policy is used for inputs of up to ``max_input_tokens``.
+# 'full' matches the fixed settings the server used before policies existed.
+FULL = Policy('full', num_beams=6, max_length=256, early_stopping=False)
+POLICIES = (
+    (Policy('greedy', num_beams=1, max_length=64, early_stopping=False), 48),
+    (Policy('beam2', num_beams=2, max_length=128, early_stopping=True), 160),
+    (Policy('beam4', num_beams=4, max_length=192, early_stopping=True), 320),
+    (FULL, None),
+)
+POLICIES_BY_NAME = {policy.name: policy for policy, _ in POLICIES}
+
+
+def generation_kwargs(policy):
+    """Arguments for ``model.generate`` under ``policy``."""
+    return {
+        'num_beams': policy.num_beams,
+        'max_length': policy.max_length,
+        'early_stopping': policy.early_stopping,
+        'num_return_sequences': 1,
+    }
+
+
+def size_class(batch_size):
+    """The power of two ``batch_size`` rounds up to; estimates are kept per class."""
+    return 1 << max(0, int(batch_size) - 1).bit_length()
+
+
+class DecodingPolicy:
+    """
+    Chooses a Policy per block.
+
+    A batch decodes all of its blocks together, so a block's latency depends
+    on how many blocks share its batch. The cost of one decode step per beam
+    is therefore kept per batch size class (see ``size_class``), each an
+    exponential moving average of what ``observe`` reports; ``step_ms`` is
+    the starting estimate for classes not observed yet.
+    """
+
+    def __init__(self, adaptive=True, step_ms=4.0, smoothing=0.2):
+        self.adaptive = adaptive
+        self.step_ms = step_ms
+        self.smoothing = smoothing
+        self.step_ms_by_size = {}
+        self._lock = threading.Lock()
+
+    def step_estimate(self, batch_size=1):
+        """Estimated ms per decode step and beam for a batch of ``batch_size`` blocks."""
+        size = size_class(batch_size)
+        known = self.step_ms_by_size
+        if size in known:
+            return known[size]
+        if not known:
+            return self.step_ms
+        # Borrow the nearest observed class, scaled as if cost grew linearly with size.
+        nearest = min(known, key=lambda other: abs(other.bit_length() - size.bit_length()))
+        return known[nearest] * size / nearest if nearest < size else known[nearest]
+
+    def estimate_ms(self, policy, batch_size=1):
+        """Worst-case decode time for a block in a batch of ``batch_size``: every beam runs to max_length."""
+        return self.step_estimate(batch_size) * policy.max_length * policy.num_beams
+
+    def choose(self, input_tokens, budget_ms=None, name=None, batch_size=1):
+        """
+        The policy for a block of ``input_tokens`` tokens.
+
+        ``name`` forces a specific policy. Otherwise the size tier sets the
+        widest allowed policy, and with a ``budget_ms`` narrower policies are
+        tried until one is estimated to fit in a batch of ``batch_size``;
+        greedy is the last resort.
+        """
+        if name:
+            try:
+                return POLICIES_BY_NAME[name]
+            except KeyError:
+                raise ValueError(f"Unknown decoding policy '{name}'; expected one of "
+                                 f"{', '.join(POLICIES_BY_NAME)}")
+        if not self.adaptive:
+            return FULL
+
+        candidates = []
+        for policy, max_input_tokens in POLICIES:
+            candidates.append(policy)
+            if max_input_tokens is not None and input_tokens <= max_input_tokens:
+                break
+        if budget_ms is not None:
+            for policy in reversed(candidates):
+                if self.estimate_ms(policy, batch_size) <= budget_ms:
+                    return policy
+            return candidates[0]
+        return candidates[-1]
+
+    def observe(self, policy, steps, decode_seconds, batch_size=1):
+        """Feeds back the measured decode time of a batch of ``batch_size`` blocks that ran ``steps`` steps."""
+        if steps <= 0:
+            return
+        sample = decode_seconds * 1000.0 / (steps * policy.num_beams)
+        size = size_class(batch_size)
+        with self._lock:
+            current = self.step_ms_by_size.get(size)
+            self.step_ms_by_size[size] = sample if current is None else current + self.smoothing * (sample - current)
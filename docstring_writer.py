@@ -0,0 +1,213 @@
+"""
+Writes generated comments back into source files as docstrings.
+
+    python docstring_writer.py comments.jsonl             # as written by cli.py --output
+    python docstring_writer.py comments.jsonl --dry-run   # print a unified diff instead
+
+Each comment carries the qualified name and line span of its block. The
+file is parsed again and a comment is only placed if a function or class
+with that name still spans those lines, so stale results are skipped
+rather than put in the wrong place. Blocks that already have a docstring,
+or whose body starts on the ``def`` line, are left alone.
+
+All of a file's docstrings are inserted in one pass from the bottom up, and
+the file is replaced atomically (a temporary file in the same directory,
+then a rename), keeping its encoding and line endings. Many files are
+written in parallel across processes.
+"""
+import argparse
+import ast
+import difflib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import textwrap
+import tokenize
+from collections import namedtuple
+
+from parallel import map_files
+
+# ``comment`` goes into the block ``qualname`` that spans ``lineno``..``end_lineno``.
+Edit = namedtuple('Edit', ['qualname', 'lineno', 'end_lineno', 'comment'])
+# ``skipped`` maps each reason ('documented', 'one-line', 'stale', 'empty') to a count.
+FileResult = namedtuple('FileResult', ['path', 'inserted', 'skipped', 'diff', 'error'])
+
+MAX_LINE = 88
+_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+# Python's own line breaks, which ast counts lines by (str.splitlines also splits on \f, \x1c, ...).
+_LINE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+$")
+
+
+def split_lines(text):
+    """``text`` as lines with their line breaks, numbered the way ast numbers them."""
+    return _LINE.findall(text)
+
+
+def format_docstring(comment, indent, newline="\n"):
+    """The lines of a docstring holding ``comment`` at ``indent``; one line if it fits."""
+    text = " ".join(comment.split()).replace("\\", "\\\\").replace('"""', '\\"\\"\\"')
+    single = f'{indent}"""{text}"""'
+    if len(single) <= MAX_LINE and not text.endswith('"'):
+        return [single + newline]
+    wrapped = textwrap.wrap(text, max(20, MAX_LINE - len(indent)), break_long_words=False,
+                            break_on_hyphens=False)
+    return [line + newline for line in [f'{indent}"""'] + [indent + line for line in wrapped] + [f'{indent}"""']]
+
+
+def _short_name(qualname):
+    return qualname.rsplit('.', 1)[-1].split('#', 1)[0]
+
+
+def insert_docstrings(code, edits):
+    """
+    Returns ``(new_code, inserted, skipped)`` for ``code`` with ``edits`` applied.
+
+    ``edits`` are Edit records; ``skipped`` counts the ones left out by
+    reason. Each edit is matched against a fresh parse of ``code``, so
+    ``code`` has to be valid Python (a SyntaxError propagates).
+    """
+    tree = ast.parse(code)
+    nodes = {(node.lineno, node.end_lineno): node for node in ast.walk(tree) if isinstance(node, _SCOPES)}
+    lines = split_lines(code)
+    newline = "\r\n" if lines and lines[0].endswith("\r\n") else "\n"
+    skipped = {}
+    inserts = {}
+    for edit in edits:
+        node = nodes.get((edit.lineno, edit.end_lineno))
+        if not edit.comment or not edit.comment.strip():
+            reason = 'empty'
+        elif node is None or node.name != _short_name(edit.qualname):
+            reason = 'stale'
+        elif ast.get_docstring(node, clean=False) is not None or node.lineno in inserts:
+            reason = 'documented'
+        else:
+            first = node.body[0]
+            start = min([d.lineno for d in getattr(first, 'decorator_list', ())] + [first.lineno])
+            body_line = lines[start - 1]
+            if body_line[:first.col_offset].strip():
+                # ``def f(): return 1``: the body shares a line with the signature.
+                reason = 'one-line'
+            else:
+                indent = body_line[:len(body_line) - len(body_line.lstrip())]
+                inserts[node.lineno] = (start, format_docstring(edit.comment, indent, newline))
+                continue
+        skipped[reason] = skipped.get(reason, 0) + 1
+
+    # Splice from the bottom so the line numbers of the edits still to come stay valid.
+    for start, docstring in sorted(inserts.values(), reverse=True):
+        lines[start - 1:start - 1] = docstring
+    return "".join(lines), len(inserts), skipped
+
+
+def read_source(path):
+    """``(text, encoding)`` of a Python file, honouring its coding cookie and BOM; line endings are kept."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+    return data.decode(encoding), encoding
+
+
+def write_atomic(path, text, encoding='utf-8'):
+    """Replaces ``path`` with ``text`` so readers see either the old or the new file, never a partial one."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(text.encode(encoding))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        except OSError:
+            pass
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def apply_file(path, edits, dry_run=False):
+    """
+    Inserts ``edits`` into the file at ``path`` and returns a FileResult.
+
+    With ``dry_run`` the file is left as it is and ``diff`` holds the
+    unified diff of what would change. A file that can't be read, decoded,
+    parsed or replaced comes back with ``error`` set and is left untouched,
+    so one bad file doesn't stop the others from being written.
+    """
+    try:
+        code, encoding = read_source(path)
+        new_code, inserted, skipped = insert_docstrings(code, edits)
+        diff = None
+        if dry_run:
+            diff = "".join(difflib.unified_diff(split_lines(code), split_lines(new_code), path, path))
+        elif inserted:
+            write_atomic(path, new_code, encoding)
+        return FileResult(path, inserted, skipped, diff, None)
+    except (OSError, UnicodeError, SyntaxError, ValueError, RecursionError) as e:
+        return FileResult(path, 0, {}, None, str(e))
+
+
+def _apply_item(item):
+    path, edits, dry_run = item
+    return apply_file(path, edits, dry_run)
+
+
+def apply_files(edits_by_path, jobs=None, dry_run=False):
+    """
+    Applies ``{path: [Edit, ...]}``, yielding a FileResult per path in the order given.
+
+    Each file is rewritten independently, so the files are spread over
+    ``jobs`` processes (see ``map_files``).
+    """
+    items = [(path, list(edits), dry_run) for path, edits in edits_by_path.items()]
+    return map_files(_apply_item, items, jobs)
+
+
+def report(results, dry_run=False, out=sys.stderr):
+    """Prints dry-run diffs to stdout and a summary to ``out``; returns the number of files that failed."""
+    files = inserted = failed = 0
+    skipped = {}
+    for result in results:
+        if result.diff:
+            sys.stdout.write(result.diff)
+        if result.error:
+            failed += 1
+            print(f"Skipping {result.path}: {result.error}", file=out)
+            continue
+        files += bool(result.inserted)
+        inserted += result.inserted
+        for reason, count in result.skipped.items():
+            skipped[reason] = skipped.get(reason, 0) + count
+    details = ", ".join(f"{count} {reason}" for reason, count in sorted(skipped.items()))
+    print(f"{'Would insert' if dry_run else 'Inserted'} {inserted} docstrings in {files} files"
+          + (f"; skipped {details}" if details else ""), file=out)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Insert generated comments into source files as docstrings.")
+    parser.add_argument('comments', help="JSONL with path, qualname, lineno, end_lineno and comment per line")
+    parser.add_argument('--dry-run', action='store_true', help="print a unified diff instead of writing files")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="number of processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    edits_by_path = {}
+    with open(args.comments, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                edits_by_path.setdefault(record['path'], []).append(
+                    Edit(record['qualname'], record['lineno'], record['end_lineno'], record['comment']))
+    return 1 if report(apply_files(edits_by_path, args.jobs, args.dry_run), args.dry_run) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
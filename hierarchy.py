@@ -0,0 +1,147 @@
+"""
+Hierarchical summarization of the blocks of a file.
+
+``find_blocks`` reports a class and then every one of its methods, so in the
+flat mode each method body is encoded once for itself and again as part of
+the class (and big classes hit the input limit). In the hierarchical mode a
+block is summarized only after its children: each direct child's body is
+replaced with its generated summary as a docstring, so the class is
+summarized from its signature, attributes and method summaries::
+
+    class Cache:
+        max_size = 128
+        def get(self, key):
+            "Returns the cached value for key or None."
+        def put(self, key, value):
+            "Stores value under key, evicting the oldest entry."
+
+Blocks are scheduled by height in the tree: all leaves of all files first,
+in as few batched calls as possible, then their parents, and so on.
+"""
+import ast
+import textwrap
+
+from code_blocks import _statement_fields
+
+_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+def block_tree(blocks):
+    """
+    The parent of each block, as an index into ``blocks`` (None at the top).
+
+    ``blocks`` must be in the pre-order ``find_blocks`` returns them in.
+    """
+    parents = []
+    stack = []
+    for i, block in enumerate(blocks):
+        while stack and blocks[stack[-1]].end_lineno < block.lineno:
+            stack.pop()
+        parents.append(stack[-1] if stack else None)
+        stack.append(i)
+    return parents
+
+
+def levels(blocks, parents):
+    """Block indices grouped by height: leaves first, each block after all of its children."""
+    height = [0] * len(blocks)
+    # Children come after their parent in pre-order, so walking backwards
+    # finishes every child before its parent is read.
+    for i in range(len(blocks) - 1, -1, -1):
+        if parents[i] is not None:
+            height[parents[i]] = max(height[parents[i]], height[i] + 1)
+    grouped = [[] for _ in range(max(height, default=-1) + 1)]
+    for i, h in enumerate(height):
+        grouped[h].append(i)
+    return grouped
+
+
+def nested_scopes(node):
+    """
+    The functions and classes directly inside ``node``, in source order.
+
+    Statements such as ``if``, ``try`` and ``with`` are looked into, the
+    bodies of the definitions found are not.
+    """
+    found = []
+    stack = [child for field in reversed(_statement_fields(type(node))) for child in reversed(getattr(node, field))]
+    while stack:
+        child = stack.pop()
+        if isinstance(child, _SCOPES):
+            found.append(child)
+            continue
+        for field in reversed(_statement_fields(type(child))):
+            stack.extend(reversed(getattr(child, field)))
+    return found
+
+
+def summary_source(block, children):
+    """
+    The source of ``block`` with each child's body replaced by its summary.
+
+    ``children`` is a list of (child Block, summary). The block's own
+    docstring is dropped as well. Returns the unchanged source if it does
+    not parse.
+    """
+    code = textwrap.dedent(block.source)
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return block.source
+    if not tree.body or not isinstance(tree.body[0], _SCOPES):
+        return block.source
+    root = tree.body[0]
+    lines = code.split("\n")
+    summaries = {child.lineno - block.lineno + 1: summary for child, summary in children}
+
+    edits = []
+    doc = root.body[0]
+    if (isinstance(doc, ast.Expr) and isinstance(doc.value, ast.Constant) and isinstance(doc.value.value, str)
+            and doc.lineno > root.lineno and len(root.body) > 1):
+        edits.append((doc.lineno, doc.end_lineno, None))
+    for node in nested_scopes(root):
+        if node.lineno in summaries:
+            first = node.body[0]
+            start = min([d.lineno for d in getattr(first, 'decorator_list', ())] + [first.lineno])
+            if start > node.lineno:
+                edits.append((start, node.end_lineno, repr(summaries[node.lineno].strip() or "...")))
+
+    # Apply from the bottom so earlier line numbers stay valid.
+    for start, end, summary in sorted(edits, reverse=True):
+        indent = lines[start - 1][:len(lines[start - 1]) - len(lines[start - 1].lstrip())]
+        lines[start - 1:end] = [indent + summary] if summary is not None else []
+    return "\n".join(lines)
+
+
+def summarize_files(files, generate):
+    """
+    Comments for the blocks of several files, children before parents.
+
+    ``files`` is a list of Block lists, one per file, each in ``find_blocks``
+    order. ``generate(codes, summarized)`` returns one comment per code; it
+    is called once per level, with leaf blocks as they are
+    (``summarized=False``) and then with parents as their ``summary_source``
+    (``summarized=True``). Returns one comment list per file, matching
+    ``files``.
+    """
+    trees = [block_tree(blocks) for blocks in files]
+    per_file = [levels(blocks, parents) for blocks, parents in zip(files, trees)]
+    comments = [[None] * len(blocks) for blocks in files]
+    children = [[[] for _ in blocks] for blocks in files]
+    for f, parents in enumerate(trees):
+        for i, parent in enumerate(parents):
+            if parent is not None:
+                children[f][parent].append(i)
+
+    for height in range(max((len(grouped) for grouped in per_file), default=0)):
+        work = [(f, i) for f, grouped in enumerate(per_file) if height < len(grouped) for i in grouped[height]]
+        codes = []
+        for f, i in work:
+            kids = children[f][i]
+            if not kids:
+                codes.append(files[f][i].source)
+            else:
+                codes.append(summary_source(files[f][i], [(files[f][k], comments[f][k]) for k in kids]))
+        for (f, i), comment in zip(work, generate(codes, height > 0)):
+            comments[f][i] = comment
+    return comments
@@ -0,0 +1,81 @@
+"""
+Python syntax scanning for the editor's highlighter.
+
+``scan_line`` tokenizes one line with a single precompiled regular
+expression (one left-to-right pass, whatever the number of keywords) and
+returns the spans to colour. Triple-quoted strings that stay open at the
+end of a line are reported through the returned state, which the Qt
+highlighter stores as the block state, so the next line continues the
+string and edits only rehighlight lines whose incoming state changed.
+
+It has no Qt dependency, so ``bench.py`` can time it on its own.
+"""
+import keyword
+import re
+
+# Block states: 0 is plain code; the others are open triple-quoted strings.
+NORMAL, IN_SINGLE_TRIPLE, IN_DOUBLE_TRIPLE = 0, 1, 2
+_TRIPLE_STATE = {"'''": IN_SINGLE_TRIPLE, '"""': IN_DOUBLE_TRIPLE}
+_STATE_DELIMITER = {state: delimiter for delimiter, state in _TRIPLE_STATE.items()}
+
+# Longest first, so 'import' is tried before 'in' and fewer alternatives fail at \b.
+KEYWORDS = sorted(keyword.kwlist, key=len, reverse=True)
+
+_PREFIX = r"(?:[rR][bBfF]?|[bBfF][rR]?|[uU])?"
+TOKEN = re.compile("|".join([
+    rf"(?P<triple>{_PREFIX}(?:'''|\"\"\"))",
+    r"(?P<comment>#.*)",
+    rf"(?P<string>{_PREFIX}(?:'[^'\\\n]*(?:\\.[^'\\\n]*)*'?|\"[^\"\\\n]*(?:\\.[^\"\\\n]*)*\"?))",
+    r"(?P<number>\b(?:0[xX][0-9a-fA-F_]+|0[bB][01_]+|0[oO][0-7_]+"
+    r"|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][+-]?\d[\d_]*)?[jJ]?)\b)",
+    rf"(?P<keyword>\b(?:{'|'.join(KEYWORDS)})\b)",
+]))
+# End of an open triple-quoted string, skipping escaped characters.
+_TRIPLE_END = {delimiter: re.compile(r"(?:[^\\]|\\.)*?" + re.escape(delimiter), re.S)
+               for delimiter in _TRIPLE_STATE}
+
+
+def scan_line(text, state=NORMAL):
+    """
+    Returns ``(spans, state)`` for one line.
+
+    ``spans`` are ``(start, length, kind)`` with kind one of 'keyword',
+    'string', 'number', 'comment' or 'docstring' (triple-quoted strings);
+    ``state`` is the state to pass in for the next line.
+    """
+    spans = []
+    position = 0
+    if state != NORMAL:
+        match = _TRIPLE_END[_STATE_DELIMITER[state]].match(text)
+        if match is None:
+            if text:
+                spans.append((0, len(text), 'docstring'))
+            return spans, state
+        spans.append((0, match.end(), 'docstring'))
+        position = match.end()
+
+    for match in TOKEN.finditer(text, position):
+        kind = match.lastgroup
+        start = match.start()
+        if kind != 'triple':
+            spans.append((start, match.end() - start, kind))
+            continue
+        delimiter = match.group()[-3:]
+        end = _TRIPLE_END[delimiter].match(text, match.end())
+        if end is None:
+            spans.append((start, len(text) - start, 'docstring'))
+            return spans, _TRIPLE_STATE[delimiter]
+        spans.append((start, end.end() - start, 'docstring'))
+        # finditer can't be moved forward, so scan the rest of the line anew.
+        rest, state = scan_line(text[end.end():])
+        spans.extend((s + end.end(), length, k) for s, length, k in rest)
+        return spans, state
+    return spans, NORMAL
+
+
+def scan_lines(lines):
+    """Scans consecutive lines, threading the state through; yields each line's spans."""
+    state = NORMAL
+    for line in lines:
+        spans, state = scan_line(line, state)
+        yield spans
@@ -0,0 +1,264 @@
+"""
+Background indexing of an opened folder.
+
+``ProjectIndexer`` walks the .py files of a folder, extracts their blocks
+and asks the server for comments on every block it has not seen before,
+storing them in an ``IndexStore`` keyed by the block's normalized-AST
+digest and the server's namespace (a hash of its model and settings, from
+/status). Opening a file then looks its blocks up in the store instead of
+waiting for the model.
+
+It works one small batch at a time, nearest files to the current selection
+first. Before each batch it waits until the server reports nothing queued
+or in flight, and it stops between batches while paused, so a foreground
+request never waits behind more than one background batch.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+
+from code_blocks import extract_file
+from comment_client import DEFAULT_SERVER, Cancelled, CommentClient
+from sqlite_db import LazyConnection
+
+# How often to ask a busy server whether it has become idle.
+IDLE_POLL_SECONDS = 1.0
+
+
+def default_store_path():
+    cache_dir = os.environ.get('DOCUCODE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'docucode'))
+    return os.environ.get('DOCUCODE_INDEX_DB', os.path.join(cache_dir, 'index.sqlite3') if cache_dir else '')
+
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS block_comments ("
+    " namespace TEXT NOT NULL,"
+    " digest TEXT NOT NULL,"
+    " comment TEXT NOT NULL,"
+    " created REAL NOT NULL,"
+    " PRIMARY KEY (namespace, digest));"
+    "CREATE TABLE IF NOT EXISTS indexed_files ("
+    " namespace TEXT NOT NULL,"
+    " path TEXT NOT NULL,"
+    " size INTEGER NOT NULL,"
+    " mtime REAL NOT NULL,"
+    " PRIMARY KEY (namespace, path));"
+)
+
+
+class IndexStore:
+    """
+    Comments by block digest, plus the size and mtime of each indexed file.
+
+    Everything is kept per ``namespace``, the server's hash of its model and
+    settings, so comments from another model or configuration are never
+    reused. Until the namespace is known (the indexer sets it once the
+    server is ready) lookups find nothing and nothing is stored.
+    """
+
+    def __init__(self, path=None, namespace=None):
+        self.path = path
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._db = LazyConnection(path, _SCHEMA)
+
+    def get_many(self, digests):
+        """The stored comments for ``digests``, as a dict (missing ones are left out)."""
+        namespace = self.namespace
+        digests = list(set(digests))
+        found = {}
+        if namespace is None:
+            return found
+        with self._lock:
+            conn = self._db()
+            # Stay under SQLite's limit on bound parameters.
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                found.update(conn.execute(
+                    "SELECT digest, comment FROM block_comments"
+                    f" WHERE namespace = ? AND digest IN ({','.join('?' * len(chunk))})",
+                    [namespace] + chunk).fetchall())
+        return found
+
+    def put_many(self, comments):
+        """Stores (digest, comment) pairs."""
+        namespace = self.namespace
+        if namespace is None:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.executemany(
+                "INSERT OR REPLACE INTO block_comments (namespace, digest, comment, created) VALUES (?, ?, ?, ?)",
+                ((namespace, digest, comment, now) for digest, comment in comments))
+            conn.commit()
+
+    def is_indexed(self, path, size, mtime):
+        """True if ``path`` was fully indexed when it had this size and mtime."""
+        with self._lock:
+            row = self._db().execute("SELECT size, mtime FROM indexed_files WHERE namespace = ? AND path = ?",
+                                     (self.namespace, path)).fetchone()
+        return row is not None and row[0] == size and row[1] == mtime
+
+    def mark_indexed(self, path, size, mtime):
+        namespace = self.namespace
+        if namespace is None:
+            return
+        with self._lock:
+            conn = self._db()
+            conn.execute("INSERT OR REPLACE INTO indexed_files (namespace, path, size, mtime) VALUES (?, ?, ?, ?)",
+                         (namespace, path, size, mtime))
+            conn.commit()
+
+
+def distance(path, focus):
+    """How far ``path`` is from the file ``focus`` in the tree: 0 for the file itself, 1 for its directory, ..."""
+    if focus is None or path == focus:
+        return 0
+    here = os.path.dirname(path).split(os.sep)
+    there = os.path.dirname(focus).split(os.sep)
+    common = len(os.path.commonprefix([here, there]))
+    return 1 + (len(here) - common) + (len(there) - common)
+
+
+class ProjectIndexer:
+    """
+    Pre-generates comments for every block under ``root`` on a background thread.
+
+    ``on_file_indexed(path)`` is called after each file's comments are
+    stored and ``on_progress(done, total)`` after each file; both run on the
+    indexer thread.
+    """
+
+    def __init__(self, root, store, base_url=DEFAULT_SERVER, batch_size=8, on_file_indexed=None, on_progress=None):
+        self.root = root
+        self.store = store
+        self.batch_size = batch_size
+        self.on_file_indexed = on_file_indexed
+        self.on_progress = on_progress
+        self.client = CommentClient(base_url, max_in_flight=1)
+        # Filled in by the indexer thread; ``add`` may queue files before that.
+        self._files = []
+        self._total = 0
+        self._focus = None
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._running.set()
+        self._added = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="project-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the indexer; an in-flight request is abandoned."""
+        self.client.cancel()
+        self._running.set()
+        self._added.set()
+
+    def pause(self):
+        """Holds off after the current batch, e.g. while the user is waiting on a foreground request."""
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def focus(self, path):
+        """Indexes the files nearest ``path`` next."""
+        with self._lock:
+            self._focus = path
+
+    def add(self, path):
+        """Queues a file that appeared or changed in the folder."""
+        with self._lock:
+            if path not in self._files:
+                self._files.append(path)
+                self._total += 1
+        self._added.set()
+
+    def _next_file(self):
+        with self._lock:
+            if not self._files:
+                return None
+            focus = self._focus
+            nearest = min(range(len(self._files)), key=lambda i: (distance(self._files[i], focus), i))
+            return self._files.pop(nearest)
+
+    def _wait_until_running(self):
+        self._running.wait()
+        if self.client.cancelled:
+            raise Cancelled()
+
+    def _wait_until_idle(self):
+        """Waits while paused or while the server has other work, and learns the server's namespace."""
+        while True:
+            self._wait_until_running()
+            state = self.client.status()
+            if state.get('status') == 'ready':
+                self.store.namespace = state.get('namespace')
+                if not state.get('queue_depth') and not state.get('in_flight'):
+                    return
+            self.client.cancel_event.wait(IDLE_POLL_SECONDS)
+
+    def _run(self):
+        from cli import iter_python_files
+
+        found = list(iter_python_files(self.root))
+        with self._lock:
+            seen = set(found)
+            self._files = found + [path for path in self._files if path not in seen]
+            self._total = len(self._files)
+        # ast.parse holds the GIL for a whole file, so parse in another process to keep the UI
+        # responsive; spawned rather than forked, since this process runs Qt and other threads.
+        pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            self.client.wait_until_reachable(timeout=300)
+            self._wait_until_idle()
+            done = 0
+            while True:
+                self._wait_until_running()
+                path = self._next_file()
+                if path is None:
+                    # Everything is indexed; wait for files to change.
+                    self._added.wait()
+                    self._added.clear()
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    stat = None
+                if stat is not None and not self.store.is_indexed(path, stat.st_size, stat.st_mtime):
+                    self._index(pool, path, stat)
+                done += 1
+                if self.on_progress:
+                    self.on_progress(done, self._total)
+        except (Cancelled, RuntimeError, OSError, ValueError, requests.exceptions.RequestException):
+            # Indexing is best effort; the foreground path reports server problems.
+            pass
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.client.close()
+
+    def _index(self, pool, path, stat):
+        _, blocks, error = pool.submit(extract_file, path).result()
+        if error:
+            return
+        known = self.store.get_many(block.digest for block in blocks)
+        missing = {}
+        for block in blocks:
+            if block.digest not in known:
+                missing.setdefault(block.digest, block.source)
+        missing = list(missing.items())
+        for i in range(0, len(missing), self.batch_size):
+            self._wait_until_idle()
+            chunk = missing[i:i + self.batch_size]
+            comments = self.client.generate_batch([source for _, source in chunk])
+            self.store.put_many((digest, comment) for (digest, _), comment in zip(chunk, comments))
+        self.store.mark_indexed(path, stat.st_size, stat.st_mtime)
+        if self.on_file_indexed:
+            self.on_file_indexed(path)
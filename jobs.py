@@ -0,0 +1,322 @@
+"""
+Durable background jobs for commenting whole folders or long block lists.
+
+A job is stored in SQLite together with one row per block; each finished
+chunk of comments is committed with the job's progress, so a server that
+stops mid-job picks it up at the first block without a comment instead of
+starting over.
+
+Jobs are claimed with a lease, so several server processes sharing the
+database never work on the same job. A lease held by a process that no
+longer exists on this host is taken over immediately; otherwise it has to
+expire first. Where the platform tells (Linux), a process is identified by
+its pid together with the boot id and its start time, so a pid reused after
+a restart or a reboot doesn't keep a dead holder's lease alive.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from sqlite_db import LazyConnection
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # Exists but isn't ours, or the platform can't tell.
+        return True
+    return True
+
+
+def process_identity(pid):
+    """``"<boot id>/<start time>"`` of a process, unique across pid reuse and reboots; '' where unknown."""
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            boot_id = f.read().strip()
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name can contain spaces and parentheses; the fields after it can't.
+            fields = f.read().rsplit(')', 1)[1].split()
+        return f"{boot_id}/{fields[19]}"
+    except (OSError, IndexError):
+        return ''
+
+
+def _holder_alive(pid, identity):
+    if not _process_alive(pid):
+        return False
+    return not identity or process_identity(pid) == identity
+
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS jobs ("
+    " id TEXT PRIMARY KEY,"
+    " status TEXT NOT NULL,"
+    " spec TEXT NOT NULL,"
+    " total INTEGER,"
+    " done INTEGER NOT NULL DEFAULT 0,"
+    " error TEXT,"
+    " owner TEXT,"
+    " lease_until REAL,"
+    " created REAL NOT NULL,"
+    " updated REAL NOT NULL);"
+    "CREATE TABLE IF NOT EXISTS job_items ("
+    " job_id TEXT NOT NULL,"
+    " seq INTEGER NOT NULL,"
+    " path TEXT,"
+    " qualname TEXT,"
+    " lineno INTEGER,"
+    " end_lineno INTEGER,"
+    " code TEXT NOT NULL,"
+    " comment TEXT,"
+    " PRIMARY KEY (job_id, seq));"
+    "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);"
+)
+
+
+class JobStore:
+    """SQLite persistence for jobs and their per-block results."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = LazyConnection(path, _SCHEMA, timeout=30, row_factory=sqlite3.Row)
+
+    def create(self, spec, items=None):
+        """
+        Stores a new queued job and returns its id.
+
+        ``spec`` is a JSON-serializable description (e.g. a folder path and
+        options). ``items`` can give the blocks right away as dicts with
+        ``code`` and optionally ``path``, ``qualname``, ``lineno``, ``end_lineno``.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute("INSERT INTO jobs (id, status, spec, created, updated) VALUES (?, ?, ?, ?, ?)",
+                         (job_id, QUEUED, json.dumps(spec), now, now))
+            if items is not None:
+                self._insert_items(conn, job_id, items)
+            conn.commit()
+        return job_id
+
+    def _insert_items(self, conn, job_id, items):
+        conn.executemany(
+            "INSERT INTO job_items (job_id, seq, path, qualname, lineno, end_lineno, code)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((job_id, seq, item.get('path'), item.get('qualname'), item.get('lineno'),
+              item.get('end_lineno'), item['code']) for seq, item in enumerate(items)))
+        conn.execute("UPDATE jobs SET total = ?, updated = ? WHERE id = ?", (len(items), time.time(), job_id))
+
+    def set_items(self, job_id, items):
+        """Records the blocks of a job whose spec had to be expanded first (e.g. a folder)."""
+        with self._lock:
+            conn = self._db()
+            conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+            self._insert_items(conn, job_id, items)
+            conn.commit()
+
+    def get(self, job_id):
+        """The job as a dict, or None."""
+        with self._lock:
+            row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def list(self, limit=50):
+        with self._lock:
+            rows = self._db().execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [self._job(row) for row in rows]
+
+    @staticmethod
+    def _job(row):
+        return {
+            "id": row['id'],
+            "status": row['status'],
+            "spec": json.loads(row['spec']),
+            "total": row['total'],
+            "done": row['done'],
+            "progress": row['done'] / row['total'] if row['total'] else (1.0 if row['status'] == DONE else 0.0),
+            "error": row['error'],
+            "created": row['created'],
+            "updated": row['updated'],
+        }
+
+    def claim(self, owner, lease_seconds):
+        """
+        Takes the oldest unfinished job that nobody else holds and returns its id, or None.
+
+        ``owner`` is ``"host:pid:identity:token"`` (see ``process_identity``);
+        leases of dead processes on this host are taken over without waiting
+        for them to expire.
+        """
+        host = owner.split(':', 1)[0]
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            rows = conn.execute("SELECT id, owner, lease_until FROM jobs WHERE status IN (?, ?) ORDER BY created",
+                                (QUEUED, RUNNING)).fetchall()
+            for row in rows:
+                holder = row['owner']
+                if holder and holder != owner and (row['lease_until'] or 0) > now:
+                    holder_host, holder_pid, identity = holder.split(':')[:3]
+                    if holder_host != host or _holder_alive(int(holder_pid), identity):
+                        continue
+                # Compare-and-swap on the previous holder, in case another process got there first.
+                claimed = conn.execute(
+                    "UPDATE jobs SET status = ?, owner = ?, lease_until = ?, updated = ?"
+                    " WHERE id = ? AND owner IS ? AND status IN (?, ?)",
+                    (RUNNING, owner, now + lease_seconds, now, row['id'], holder, QUEUED, RUNNING)).rowcount
+                conn.commit()
+                if claimed:
+                    return row['id']
+        return None
+
+    def pending_items(self, job_id, limit):
+        """Up to ``limit`` (seq, code) pairs that have no comment yet, in order."""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT seq, code FROM job_items WHERE job_id = ? AND comment IS NULL ORDER BY seq LIMIT ?",
+                (job_id, limit)).fetchall()
+        return [(row['seq'], row['code']) for row in rows]
+
+    def record(self, job_id, owner, results, lease_seconds):
+        """
+        Stores (seq, comment) pairs and renews the lease in one transaction.
+
+        Returns False, storing nothing, if ``owner`` no longer holds the job
+        (it was cancelled or taken over).
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            renewed = conn.execute(
+                "UPDATE jobs SET done = done + ?, lease_until = ?, updated = ? WHERE id = ? AND owner = ? AND status = ?",
+                (len(results), now + lease_seconds, now, job_id, owner, RUNNING)).rowcount
+            if not renewed:
+                conn.rollback()
+                return False
+            conn.executemany("UPDATE job_items SET comment = ? WHERE job_id = ? AND seq = ?",
+                             ((comment, job_id, seq) for seq, comment in results))
+            conn.commit()
+            return True
+
+    def finish(self, job_id, owner, status, error=None):
+        with self._lock:
+            conn = self._db()
+            conn.execute("UPDATE jobs SET status = ?, error = ?, owner = NULL, lease_until = NULL, updated = ?"
+                         " WHERE id = ? AND owner = ? AND status = ?",
+                         (status, error, time.time(), job_id, owner, RUNNING))
+            conn.commit()
+
+    def cancel(self, job_id):
+        """Cancels an unfinished job; returns False if it was already finished or doesn't exist."""
+        with self._lock:
+            conn = self._db()
+            changed = conn.execute("UPDATE jobs SET status = ?, owner = NULL, updated = ? WHERE id = ? AND status IN (?, ?)",
+                                   (CANCELLED, time.time(), job_id, QUEUED, RUNNING)).rowcount
+            conn.commit()
+        return bool(changed)
+
+    def results(self, job_id, offset=0, limit=100):
+        """A page of the job's blocks, in order; ``comment`` is None for blocks not done yet."""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT seq, path, qualname, lineno, end_lineno, comment FROM job_items"
+                " WHERE job_id = ? ORDER BY seq LIMIT ? OFFSET ?", (job_id, limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+
+class JobRunner:
+    """
+    Works through stored jobs on a background thread.
+
+    ``expand(spec)`` turns a job spec without items into a list of item
+    dicts (see ``JobStore.create``); ``generate(codes, spec)`` returns one
+    comment per code. Each chunk of ``chunk_size`` comments is committed
+    before the next one starts. ``stop()`` ends the thread after the
+    current chunk and puts an unfinished job back in the queue.
+    """
+
+    def __init__(self, store, generate, expand, chunk_size=16, lease_seconds=300, poll_seconds=2.0):
+        self.store = store
+        self.generate = generate
+        self.expand = expand
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.owner = None
+        self.busy = False
+
+    def start(self):
+        """Starts the runner thread in this process, if it isn't running yet (also after a fork)."""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self.owner = f"{socket.gethostname()}:{self._pid}:{process_identity(self._pid)}:{uuid.uuid4().hex[:8]}"
+            self._wake = threading.Event()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """Checks for new jobs now instead of at the next poll."""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Stops the runner thread and waits up to ``timeout`` seconds for it to finish its chunk."""
+        with self._lock:
+            thread = self._thread
+            self._stop.set()
+            self._wake.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            job_id = self.store.claim(self.owner, self.lease_seconds)
+            if job_id is None:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                continue
+            self.busy = True
+            try:
+                self._work(job_id)
+            finally:
+                self.busy = False
+
+    def _work(self, job_id):
+        job = self.store.get(job_id)
+        try:
+            if job['total'] is None:
+                self.store.set_items(job_id, self.expand(job['spec']))
+            while True:
+                chunk = self.store.pending_items(job_id, self.chunk_size)
+                if not chunk:
+                    break
+                if self._stop.is_set():
+                    self.store.finish(job_id, self.owner, QUEUED)
+                    return
+                comments = self.generate([code for _, code in chunk], job['spec'])
+                if not self.store.record(job_id, self.owner, [(seq, comment) for (seq, _), comment
+                                                              in zip(chunk, comments)], self.lease_seconds):
+                    return
+        except Exception as e:
+            self.store.finish(job_id, self.owner, FAILED, str(e))
+            return
+        self.store.finish(job_id, self.owner, DONE)
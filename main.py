@@ -1,12 +1,9 @@
 import sys
 import threading
-import subprocess
-import time
-import requests
 import os
 from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QThread, pyqtSignal
 from main_gui import MainWindow
-from app import load_model, app
 
 # --- FIX: Set environment variable to prevent TensorFlow import ---
 # This is required because some dependencies in transformers attempt to import TensorFlow,
@@ -15,42 +12,39 @@ os.environ['TRANSFORMERS_USE_TF'] = '0'
 
 def run_flask_app():
     """Function to run the Flask app. This will be targeted by the thread."""
+    from app import app
     app.run(debug=False, use_reloader=False, port=5000)
 
-def health_check(url, timeout=30):
+class ModelLoader(QThread):
     """
-    Pings the Flask server's status endpoint to ensure it's ready.
+    Starts the server and loads the model after the window is already up.
+
+    The load starts before the Flask server, which comes up right after it,
+    so requests made while the model is still loading are accepted and wait
+    for it instead of failing.
     """
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            response = requests.get(url)
-            if response.status_code == 200 and response.json().get('status') == 'ready':
-                print("Flask server is ready!")
-                return True
-        except requests.exceptions.ConnectionError:
-            pass
-        print("Waiting for Flask server to start...")
-        time.sleep(2)
-    return False
+    progress = pyqtSignal(str, float)
+
+    def run(self):
+        # Deferred so the heavy imports happen off the GUI thread.
+        import app
+        app.configure_logging()
+        loader_thread = app.start_background_load(on_progress=self.progress.emit)
+        flask_thread = threading.Thread(target=run_flask_app, daemon=True)
+        flask_thread.start()
+        app.start_job_runner()
+        loader_thread.join()
 
 def main():
-    # Load the model directly in the main thread before starting the server
-    load_model()
-    
-    # Start Flask server in a separate thread
-    flask_thread = threading.Thread(target=run_flask_app, daemon=True)
-    flask_thread.start()
-    
-    # Perform a health check to wait for the server to be ready
-    if not health_check('http://127.0.0.1:5000/status'):
-        print("Error: Flask server did not start within the timeout period.")
-        sys.exit(1)
-        
-    # Start the PyQt5 application
+    # Show the window immediately; the model warms up in the background
     qt_app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
+
+    loader = ModelLoader()
+    loader.progress.connect(window.on_model_progress)
+    loader.start()
+
     sys.exit(qt_app.exec_())
 
 if __name__ == "__main__":
@@ -2,75 +2,145 @@ import sys
 import json
 import requests
 import os
-import ast
+import multiprocessing
 import threading
+from concurrent.futures import ProcessPoolExecutor
 from PyQt5.QtWidgets import (QMainWindow, QApplication, QWidget, QVBoxLayout, QHBoxLayout,
                              QTextEdit, QPushButton, QFileDialog, QLabel, QMessageBox,
                              QSplitter, QStatusBar, QAction, QTreeView, QFileSystemModel)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QObject, QModelIndex
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QObject, QModelIndex, QFileSystemWatcher, QTimer
 from PyQt5.QtGui import QFont, QTextCharFormat, QColor, QSyntaxHighlighter, QTextCursor, QTextDocument, QTextOption
-import time
+
+from code_blocks import diff_blocks, extract_source
+from comment_client import Cancelled, CommentClient
+from highlighting import NORMAL, scan_line
+from docstring_writer import Edit, insert_docstrings, write_atomic
+from indexer import IndexStore, ProjectIndexer, default_store_path
+from results_view import DONE, PARTIAL, PENDING, ResultRow, ResultsView, signature_line
+
+# Number of blocks the GUI keeps in flight against the server at once.
+MAX_IN_FLIGHT = int(os.environ.get('DOCUCODE_MAX_IN_FLIGHT', '4'))
 
 # --- 1. The Worker Thread for API Calls ---
 class CommentGeneratorWorker(QObject):
-    finished_one = pyqtSignal(str, str)
+    # (index into code_blocks, code, comment); results arrive in completion order
+    finished_one = pyqtSignal(int, str, str)
+    partial = pyqtSignal(int, str, str)
     finished_all = pyqtSignal()
     error = pyqtSignal(str)
+    # Always emitted last, whether the run finished, failed or was cancelled.
+    stopped = pyqtSignal()
     
-    def __init__(self, code_blocks, parent=None):
+    def __init__(self, code_blocks, stream=True, max_in_flight=MAX_IN_FLIGHT, parent=None):
         super().__init__(parent)
         self.code_blocks = code_blocks
+        self.stream = stream
+        self.client = CommentClient(max_in_flight=max_in_flight)
+
+    def cancel(self):
+        """Stops the run; requests already sent are abandoned rather than waited for."""
+        self.client.cancel()
 
     def run(self):
         try:
-            status_url = 'http://127.0.0.1:5000/status'
-            start_time = time.time()
-            server_ready = False
-            while time.time() - start_time < 30:
-                try:
-                    response = requests.get(status_url, timeout=5)
-                    if response.status_code == 200 and response.json().get('status') == 'ready':
-                        server_ready = True
-                        break
-                except requests.exceptions.RequestException:
-                    pass
-                time.sleep(1)
-            
-            if not server_ready:
-                self.error.emit("Local server is not ready. Please ensure app.py is running.")
-                return
-
-            api_url = 'http://127.0.0.1:5000/generate-comment'
-            headers = {'Content-Type': 'application/json'}
-            
-            for code_snippet in self.code_blocks:
-                data = {'code': code_snippet}
-                response = requests.post(api_url, json=data, headers=headers, timeout=60)
-                response.raise_for_status()
-                comments = response.json()
-                if "comment" in comments:
-                    self.finished_one.emit(code_snippet, comments['comment'])
-                else:
-                    self.error.emit(comments.get('error', 'Unknown API error'))
-            
+            self.client.wait_until_reachable()
+            self.client.generate_many(
+                self.code_blocks,
+                on_result=lambda index, comment: self.finished_one.emit(index, self.code_blocks[index], comment),
+                on_partial=lambda index, text: self.partial.emit(index, self.code_blocks[index], text),
+                stream=self.stream,
+            )
             self.finished_all.emit()
 
+        except Cancelled:
+            pass
         except requests.exceptions.RequestException as e:
             self.error.emit(f"Failed to connect to local server: {e}")
+        except (RuntimeError, KeyError, ValueError) as e:
+            self.error.emit(str(e))
+        finally:
+            self.client.close()
+            self.stopped.emit()
+
+class BlockExtractor(QObject):
+    """
+    Extracts code blocks off the UI thread.
+
+    ``ast.parse`` holds the GIL for the whole parse, so a thread would still
+    freeze the UI on a very large file; parsing runs in a single-worker
+    process pool instead. Only the result of the latest request is delivered.
+    """
+    # (request number, blocks, error message or "")
+    extracted = pyqtSignal(int, object, str)
+    _completed = pyqtSignal(int, object, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pool = None
+        self._latest = 0
+        # Emitted from the pool's thread; the connection queues it onto the UI thread.
+        self._completed.connect(self._deliver)
+
+    def request(self, code, path=None):
+        """Starts extracting ``code`` and returns the request number."""
+        self._latest += 1
+        number = self._latest
+        if self._pool is None:
+            # Forking a process that runs Qt threads can deadlock the child.
+            self._pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        future = self._pool.submit(extract_source, code, path)
+        future.add_done_callback(lambda f: self._completed.emit(number, *self._outcome(f)))
+        return number
+
+    def _outcome(self, future):
+        try:
+            return future.result(), ""
+        except SyntaxError as e:
+            return [], str(e)
+        except Exception as e:
+            # A crashed worker (e.g. a recursion limit in the parser) breaks the pool.
+            self._pool = None
+            return [], f"Failed to parse code: {e}"
+
+    def _deliver(self, number, blocks, error):
+        if number == self._latest:
+            self.extracted.emit(number, blocks, error)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+class IndexerSignals(QObject):
+    """Carries the project indexer's callbacks from its thread onto the UI thread."""
+    file_indexed = pyqtSignal(str)
+    progress = pyqtSignal(int, int)
 
 # --- 2. Syntax Highlighter for Code Editor ---
 class CodeHighlighter(QSyntaxHighlighter):
-    """Syntax highlighter for a Python code editor."""
+    """
+    Syntax highlighter for a Python code editor.
+
+    Each line is tokenized in one pass by ``highlighting.scan_line``; open
+    triple-quoted strings are carried to the next line as the block state,
+    so Qt only rehighlights the lines an edit can actually affect.
+    """
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.highlight_rules = []
         self.keyword_format = QTextCharFormat()
         self.string_format = QTextCharFormat()
         self.number_format = QTextCharFormat()
         self.comment_format = QTextCharFormat()
 
         self.setup_formats()
-        self.setup_rules()
+        self.formats = {
+            'keyword': self.keyword_format,
+            'string': self.string_format,
+            'number': self.number_format,
+            'comment': self.comment_format,
+            # Triple-quoted strings keep the docstring look they always had.
+            'docstring': self.comment_format,
+        }
 
     def setup_formats(self):
         self.keyword_format.setForeground(QColor('#569cd6'))
@@ -80,50 +150,17 @@ class CodeHighlighter(QSyntaxHighlighter):
         self.comment_format.setForeground(QColor('#6a9955'))
         self.comment_format.setFontItalic(True)
 
-    def setup_rules(self):
-        keywords = ['class', 'def', 'return', 'if', 'else', 'elif', 'for', 'while', 'in',
-                    'import', 'from', 'as', 'try', 'except', 'finally', 'with', 'as', 'None',
-                    'True', 'False', 'and', 'or', 'not', 'is', 'lambda', 'yield', 'async', 'await']
-        
-        for word in keywords:
-            pattern = fr'\b{word}\b'
-            self.highlight_rules.append((pattern, self.keyword_format))
-
-        self.highlight_rules.append((r'"[^"\\]*(\\.[^"\\]*)*"', self.string_format))
-        self.highlight_rules.append((r"'[^'\\]*(\\.[^'\\]*)*'", self.string_format))
-        self.highlight_rules.append((r'\b\d+(\.\d+)?\b', self.number_format))
-        self.highlight_rules.append((r'#[^\n]*', self.comment_format))
-
     def highlightBlock(self, text):
-        for pattern, format in self.highlight_rules:
-            expression = pattern
-            index = text.find(expression)
-            while index >= 0:
-                length = len(expression)
-                self.setFormat(index, length, format)
-                index = text.find(expression, index + length)
-        
-        self.setCurrentBlockState(0)
-        start = 0
-        while start < len(text):
-            triple_quote_start = text.find('"""', start)
-            if triple_quote_start == -1:
-                triple_quote_start = text.find("'''", start)
-                if triple_quote_start == -1:
-                    break
-            
-            triple_quote_end = text.find(text[triple_quote_start:triple_quote_start+3], triple_quote_start + 3)
-            
-            if triple_quote_end == -1:
-                self.setFormat(triple_quote_start, len(text) - triple_quote_start, self.comment_format)
-                self.setCurrentBlockState(1)
-                break
-            else:
-                self.setFormat(triple_quote_start, triple_quote_end - triple_quote_start + 3, self.comment_format)
-                start = triple_quote_end + 3
-        
-        if self.currentBlockState() == 1:
-            self.setFormat(0, len(text), self.comment_format)
+        spans, state = scan_line(text, max(self.previousBlockState(), NORMAL))
+        if spans and not text.isascii() and any(ord(char) > 0xFFFF for char in text):
+            # Qt positions count UTF-16 code units; characters outside the BMP take two.
+            units = [0]
+            for char in text:
+                units.append(units[-1] + (2 if ord(char) > 0xFFFF else 1))
+            spans = [(units[start], units[start + length] - units[start], kind) for start, length, kind in spans]
+        for start, length, kind in spans:
+            self.setFormat(start, length, self.formats[kind])
+        self.setCurrentBlockState(state)
 
 # --- 3. The Main PyQt5 GUI ---
 class MainWindow(QMainWindow):
@@ -170,15 +207,14 @@ class MainWindow(QMainWindow):
         self.highlighter = CodeHighlighter(self.code_editor.document())
         self.code_editor.setWordWrapMode(QTextOption.NoWrap)
         
-        # Panel 3: Generated Comment Display
-        self.comment_display = QTextEdit()
-        self.comment_display.setReadOnly(True)
-        self.comment_display.setFont(QFont('Consolas', 10))
-        self.comment_display.setWordWrapMode(QTextOption.NoWrap)
+        # Panel 3: Generated comments, one row per block; clicking a row selects the block
+        self.results_view = ResultsView(QFont('Consolas', 10))
+        self.results_model = self.results_view.model
+        self.results_view.block_activated.connect(self.highlight_lines)
         
         self.splitter.addWidget(self.file_view)
         self.splitter.addWidget(self.code_editor)
-        self.splitter.addWidget(self.comment_display)
+        self.splitter.addWidget(self.results_view)
         self.splitter.setSizes([300, 500, 600])
         
         self.button_layout = QHBoxLayout()
@@ -186,11 +222,14 @@ class MainWindow(QMainWindow):
         self.save_btn = QPushButton("Save Comment")
         self.generate_btn = QPushButton("Generate Comment")
         self.clear_btn = QPushButton("Clear All")
+        self.stop_btn = QPushButton("Stop")
+        self.stop_btn.setEnabled(False)
         
         self.button_layout.addWidget(self.open_btn)
         self.button_layout.addWidget(self.save_btn)
         self.button_layout.addWidget(self.generate_btn)
         self.button_layout.addWidget(self.clear_btn)
+        self.button_layout.addWidget(self.stop_btn)
         
         self.layout.addWidget(self.splitter)
         self.layout.addLayout(self.button_layout)
@@ -199,7 +238,48 @@ class MainWindow(QMainWindow):
         self.save_btn.clicked.connect(self.save_comment)
         self.generate_btn.clicked.connect(self.generate_comment)
         self.clear_btn.clicked.connect(self.clear_all)
+        self.stop_btn.clicked.connect(self.cancel_generation)
         
+        self.model_status = QLabel("Model: starting...")
+        self.statusBar().addPermanentWidget(self.model_status)
+        self.index_status = QLabel("")
+        self.statusBar().addPermanentWidget(self.index_status)
+
+        # Per-file snapshot of generated comments: path -> {qualname: (digest, code, comment)}.
+        # The digest is the block's normalized AST hash when its comment was generated,
+        # so edits only regenerate the blocks whose AST actually changed.
+        self.file_results = {}
+        self.pending_blocks = []
+        self.pending_key = None
+        self.rerun_pending = False
+        # Blocks of the editor text as last extracted, in source order; their
+        # line spans place the result rows.
+        self.current_blocks = []
+        self.extract_auto = False
+        self.generate_after_extract = False
+        self.adopt_after_extract = False
+
+        self.extractor = BlockExtractor(self)
+        self.extractor.extracted.connect(self.on_blocks_extracted)
+
+        # Comments pre-generated for the opened folder, by block digest.
+        self.index_store = IndexStore(default_store_path() or None)
+        self.indexer = None
+        self.indexer_signals = IndexerSignals(self)
+        self.indexer_signals.file_indexed.connect(self.on_file_indexed)
+        self.indexer_signals.progress.connect(self.on_index_progress)
+
+        self.file_watcher = QFileSystemWatcher(self)
+        self.file_watcher.fileChanged.connect(self.on_watched_file_changed)
+        self.file_watcher.directoryChanged.connect(self.on_watched_directory_changed)
+
+        # Editor changes are picked up after a short pause in typing.
+        self.incremental_timer = QTimer(self)
+        self.incremental_timer.setSingleShot(True)
+        self.incremental_timer.setInterval(800)
+        self.incremental_timer.timeout.connect(lambda: self.regenerate_changed_blocks(auto=True))
+        self.code_editor.textChanged.connect(self.on_code_changed)
+
         self.comment_thread = None
         self.update_status("Ready")
 
@@ -217,7 +297,7 @@ class MainWindow(QMainWindow):
 
         # Save Menu
         save_menu = menubar.addMenu('&Save')
-        save_menu.addAction(self.create_action("Save &Inline", self.save_inline_comments, "Ctrl+I", "Save comments directly into the code"))
+        save_menu.addAction(self.create_action("Save &Inline", self.save_inline_comments, "Ctrl+I", "Insert the comments into the file as docstrings"))
         save_menu.addAction(self.create_action("Save &Separate File", self.save_comment, "Ctrl+S", "Save comments to a separate file"))
 
         # Clear Menu
@@ -243,13 +323,27 @@ class MainWindow(QMainWindow):
             self, "Open File", "", "Python Files (*.py);;All Files (*)")
         
         if file_path:
-            self.current_file_path = file_path
-            try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    self.code_editor.setPlainText(file.read())
-                self.update_status(f"Opened file: {file_path}")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to open file: {str(e)}")
+            self.load_file(file_path)
+
+    def load_file(self, file_path):
+        """Opens ``file_path`` in the editor, watches it and shows any comments already generated for it."""
+        self.current_file_path = file_path
+        self.current_blocks = []
+        if self.indexer:
+            self.indexer.focus(file_path)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                self.code_editor.setPlainText(file.read())
+            self.code_editor.document().setModified(False)
+            if file_path not in self.file_watcher.files():
+                self.file_watcher.addPath(file_path)
+            self.render_results()
+            # Parse in the background to place the stored results at their blocks.
+            self.generate_after_extract = False
+            self.extractor.request(self.code_editor.toPlainText(), file_path)
+            self.update_status(f"Opened file: {file_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to open file: {str(e)}")
 
     def create_file(self):
         file_path, _ = QFileDialog.getSaveFileName(
@@ -270,8 +364,79 @@ class MainWindow(QMainWindow):
         if folder_path:
             self.file_model.setRootPath(folder_path)
             self.file_view.setRootIndex(self.file_model.index(folder_path))
+            if self.file_watcher.directories():
+                self.file_watcher.removePaths(self.file_watcher.directories())
+            self.watch_tree(folder_path)
+            self.start_indexer(folder_path)
             self.update_status(f"Opened folder: {folder_path}")
 
+    def watch_tree(self, folder_path):
+        """
+        Watches ``folder_path`` and the directories below it, as QFileSystemWatcher is not recursive.
+
+        Returns the directories that were not watched yet.
+        """
+        from cli import iter_source_dirs
+
+        watched = set(self.file_watcher.directories())
+        new = [path for path in iter_source_dirs(folder_path) if path not in watched]
+        if new:
+            self.file_watcher.addPaths(new)
+        return new
+
+    def start_indexer(self, folder_path):
+        """Starts pre-generating comments for the folder in the background, replacing any previous indexer."""
+        if self.indexer:
+            self.indexer.stop()
+        self.indexer = ProjectIndexer(folder_path, self.index_store,
+                                      on_file_indexed=self.indexer_signals.file_indexed.emit,
+                                      on_progress=self.indexer_signals.progress.emit)
+        if self.current_file_path:
+            self.indexer.focus(self.current_file_path)
+        if self.comment_thread and self.comment_thread.isRunning():
+            self.indexer.pause()
+        self.indexer.start()
+
+    def on_file_indexed(self, path):
+        # Show the new comments if the file is open, unless a generation is filling in rows.
+        if path == self.current_file_path and self.current_blocks \
+                and not (self.comment_thread and self.comment_thread.isRunning()):
+            self.apply_indexed(self.current_blocks)
+            self.render_results()
+
+    def on_index_progress(self, done, total):
+        self.index_status.setText(f"Indexed {done}/{total} files" if done < total else "Index: up to date")
+
+    def apply_indexed(self, blocks):
+        """Takes comments from the index for blocks of the current file that have none for their code."""
+        results = self.file_results.setdefault(self.results_key(), {})
+        missing = [block for block in blocks if results.get(block.qualname, (None,))[0] != block.digest]
+        if not missing:
+            return
+        stored = self.index_store.get_many(block.digest for block in missing)
+        for block in missing:
+            if block.digest in stored:
+                results[block.qualname] = (block.digest, block.source, stored[block.digest])
+
+    def adopt_results(self, blocks):
+        """Moves the current file's comments onto ``blocks`` by name, e.g. after docstrings were inserted."""
+        results = self.file_results.get(self.results_key(), {})
+        adopted = []
+        for block in blocks:
+            if block.qualname in results:
+                comment = results[block.qualname][2]
+                results[block.qualname] = (block.digest, block.source, comment)
+                adopted.append((block.digest, comment))
+        self.index_store.put_many(adopted)
+
+    def pause_indexer(self, paused):
+        """Background indexing yields to generation the user is waiting for."""
+        if self.indexer:
+            if paused:
+                self.indexer.pause()
+            else:
+                self.indexer.resume()
+
     def create_folder(self):
         folder_path = QFileDialog.getExistingDirectory(
             self, "Create Folder In", os.path.expanduser('~'))
@@ -286,36 +451,51 @@ class MainWindow(QMainWindow):
                     QMessageBox.critical(self, "Error", f"Failed to create folder: {str(e)}")
 
     def save_inline_comments(self):
-        code = self.code_editor.toPlainText()
-        comments = self.comment_display.toPlainText()
-        
+        """Writes the comments into the open file as docstrings of their functions and classes."""
         if not self.current_file_path:
             QMessageBox.warning(self, "Warning", "No file is open to save inline comments to.")
             return
 
-        if not comments.strip():
+        results = self.file_results.get(self.results_key(), {})
+        # Only comments generated for the code as it is now; spans come from the latest parse.
+        edits = [Edit(block.qualname, block.lineno, block.end_lineno, results[block.qualname][2])
+                 for block in self.current_blocks
+                 if block.qualname in results and results[block.qualname][0] == block.digest]
+        if not edits:
             QMessageBox.warning(self, "Warning", "No comments to save inline.")
             return
 
-        commented_code = ""
-        # Simplified logic for demonstration: prepend a single comment
-        comment_lines = comments.splitlines()
-        commented_code += "# " + "\n# ".join(comment_lines) + "\n"
-        commented_code += code
-        
         try:
-            with open(self.current_file_path, 'w', encoding='utf-8') as f:
-                f.write(commented_code)
-            self.update_status(f"Inline comments saved to {self.current_file_path}")
+            code, inserted, skipped = insert_docstrings(self.code_editor.toPlainText(), edits)
+            if inserted:
+                write_atomic(self.current_file_path, code)
+        except SyntaxError as e:
+            QMessageBox.critical(self, "Error", f"Failed to parse code: {str(e)}")
+            return
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to save file: {str(e)}")
+            return
+
+        if inserted:
+            self.code_editor.setPlainText(code)
+            self.code_editor.document().setModified(False)
+            # The docstrings change every block's digest; take the comments over
+            # to the new digests instead of regenerating them.
+            self.incremental_timer.stop()
+            self.adopt_after_extract = True
+            self.generate_after_extract = False
+            self.extractor.request(code, self.current_file_path)
+        left_out = sum(skipped.values())
+        self.update_status(f"Inserted {inserted} docstrings into {self.current_file_path}"
+                           + (f" ({left_out} blocks skipped, e.g. already documented)" if left_out else ""))
 
     def clear_program(self):
         self.code_editor.clear()
         self.update_status("Code editor cleared.")
         
     def clear_comments(self):
-        self.comment_display.clear()
+        self.results_model.clear()
+        self.file_results.pop(self.results_key(), None)
         self.update_status("Comments panel cleared.")
     
     def placeholder_action(self):
@@ -323,20 +503,73 @@ class MainWindow(QMainWindow):
 
     def update_status(self, message):
         self.statusBar().showMessage(message)
+
+    def on_model_progress(self, stage, progress):
+        if progress >= 1.0:
+            self.model_status.setText(f"Model: {stage.lower()}")
+        else:
+            self.model_status.setText(f"Model: {stage} ({progress:.0%})")
     
     def on_file_selected(self, index):
         file_path = self.file_model.filePath(index)
         if os.path.isfile(file_path) and file_path.endswith('.py'):
-            self.current_file_path = file_path
+            self.load_file(file_path)
+
+    def on_watched_file_changed(self, path):
+        # Reload the open file when it changes on disk, unless the editor has unsaved edits.
+        # The reload goes through textChanged, which schedules the incremental regeneration.
+        if self.indexer and os.path.isfile(path):
+            self.indexer.add(path)
+        if path == self.current_file_path and os.path.isfile(path) \
+                and not self.code_editor.document().isModified():
             try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    self.code_editor.setPlainText(file.read())
-                self.update_status(f"Opened file: {file_path}")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to open file: {str(e)}")
+                with open(path, 'r', encoding='utf-8') as file:
+                    code = file.read()
+            except (OSError, UnicodeDecodeError) as e:
+                # Deleted or replaced since the check, or no longer UTF-8: keep what the editor shows.
+                self.update_status(f"Could not reload {path}: {e}")
+                return
+            if code != self.code_editor.toPlainText():
+                self.code_editor.setPlainText(code)
+                self.code_editor.document().setModified(False)
+        # Editors that save by replace-and-rename drop the file from the watch list.
+        if os.path.isfile(path) and path not in self.file_watcher.files():
+            self.file_watcher.addPath(path)
+
+    def on_watched_directory_changed(self, path):
+        if self.current_file_path and os.path.dirname(self.current_file_path) == path:
+            self.on_watched_file_changed(self.current_file_path)
+        # New or replaced files; unchanged ones are skipped by their size and mtime.
+        if self.indexer and os.path.isdir(path):
+            try:
+                names = os.listdir(path)
+            except OSError:
+                # Removed again since the check; its parent reports that change.
+                names = []
+            for name in names:
+                if name.endswith('.py'):
+                    self.indexer.add(os.path.join(path, name))
+        # Subdirectories created (or moved in) since the folder was opened, with their files.
+        if os.path.isdir(path):
+            from cli import iter_python_files
+
+            for directory in self.watch_tree(path):
+                if self.indexer and directory != path:
+                    for file_path in iter_python_files(directory):
+                        self.indexer.add(file_path)
+        # Drop snapshots of files that were deleted, also with a whole subdirectory.
+        prefix = os.path.join(path, '')
+        for file_path in list(self.file_results):
+            if file_path.startswith(prefix) and not os.path.exists(file_path):
+                del self.file_results[file_path]
+
+    def on_code_changed(self):
+        # Only files that already have comments are kept up to date automatically.
+        if self.file_results.get(self.results_key()):
+            self.incremental_timer.start()
         
     def save_comment(self):
-        comment = self.comment_display.toPlainText()
+        comment = self.results_model.to_text()
         if not comment.strip():
             QMessageBox.warning(self, "Warning", "No comment to save.")
             return
@@ -352,88 +585,173 @@ class MainWindow(QMainWindow):
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to save file: {str(e)}")
     
+    def results_key(self):
+        return self.current_file_path or "<untitled>"
+
     def generate_comment(self):
-        code_blocks = self.get_code_blocks(self.code_editor.toPlainText())
+        self.regenerate_changed_blocks(auto=False)
+
+    def regenerate_changed_blocks(self, auto=False):
+        """
+        Generates comments only for blocks added or modified since the last run,
+        and drops the results of blocks that were deleted.
+
+        The editor text is parsed in the background; generation continues in
+        ``on_blocks_extracted``.
+        """
+        if self.comment_thread and self.comment_thread.isRunning():
+            self.rerun_pending = True
+            return
+
+        self.extract_auto = auto
+        self.generate_after_extract = True
+        if not auto:
+            self.update_status("Parsing code...")
+        self.extractor.request(self.code_editor.toPlainText(), self.current_file_path)
+
+    def on_blocks_extracted(self, number, blocks, error):
+        auto = self.extract_auto
+        if not error:
+            self.current_blocks = blocks
+            if self.adopt_after_extract:
+                self.adopt_after_extract = False
+                self.adopt_results(blocks)
+            self.apply_indexed(blocks)
+        if not self.generate_after_extract:
+            if not error:
+                self.render_results()
+            return
+        if self.comment_thread and self.comment_thread.isRunning():
+            self.rerun_pending = True
+            return
+        if error:
+            # Half-typed code is expected while editing; only report explicit runs.
+            if not auto:
+                QMessageBox.critical(self, "Error", f"Failed to parse code: {error}")
+            return
 
-        if not code_blocks:
+        if not blocks and not auto:
             QMessageBox.warning(self, "Warning", "No functions or classes found to comment.")
             return
 
+        results = self.file_results.setdefault(self.results_key(), {})
+        snapshot = {qualname: digest for qualname, (digest, _, _) in results.items()}
+        changed, deleted = diff_blocks(snapshot, blocks)
+        for qualname in deleted:
+            del results[qualname]
+
+        if not changed:
+            self.render_results()
+            if not auto:
+                self.update_status("All comments are up to date.")
+            return
+
+        self.pending_blocks = changed
+        self.pending_key = self.results_key()
         self.set_buttons_enabled(False)
-        self.update_status(f"Found {len(code_blocks)} code blocks. Generating comments...")
-        self.comment_display.setPlainText("")
-        
+        self.update_status(f"Found {len(blocks)} code blocks, {len(changed)} new or changed. Generating comments...")
+        self.render_results(pending=changed)
+
+        self.pause_indexer(True)
         self.comment_thread = QThread()
-        self.worker = CommentGeneratorWorker(code_blocks)
+        self.worker = CommentGeneratorWorker([block.source for block in changed])
         self.worker.moveToThread(self.comment_thread)
         self.comment_thread.started.connect(self.worker.run)
         self.worker.finished_one.connect(self.on_comment_generated)
+        self.worker.partial.connect(self.on_comment_partial)
         self.worker.finished_all.connect(self.on_all_comments_generated)
         self.worker.error.connect(self.on_comment_error)
+        self.worker.stopped.connect(self.on_generation_stopped)
         self.comment_thread.start()
 
-    def get_code_blocks(self, code):
-        blocks = []
-        try:
-            tree = ast.parse(code)
-            
-            def find_blocks(node):
-                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-                    start_line = node.lineno - 1
-                    end_line = getattr(node, 'end_lineno', len(code.splitlines()))
-                    block_code = "\n".join(code.splitlines()[start_line:end_line])
-                    blocks.append(block_code)
-                for child in ast.iter_child_nodes(node):
-                    find_blocks(child)
-            
-            find_blocks(tree)
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to parse code: {str(e)}")
-        return blocks
-
-    def on_comment_generated(self, code, comment):
-        html_comment = f"""
-        <div style="background-color: #2b2b2b; padding: 10px; border-radius: 5px; margin-bottom: 15px;">
-            <p style="color: #cccccc; font-weight: bold;">Code Block:</p>
-            <pre style="color: #cccccc; white-space: pre-wrap; font-family: Consolas;">{code}</pre>
-            <p style="color: #569cd6; font-weight: bold;">Comment:</p>
-            <p style="color: #b5cea8;">{comment}</p>
-        </div>
+    def render_results(self, pending=()):
+        """
+        Rebuilds the result rows from the current file's results, in source order.
+
+        ``pending`` blocks get a placeholder row in place of any result they
+        already have; all rows go to the model in one reset.
         """
-        self.comment_display.insertHtml(html_comment)
+        results = self.file_results.get(self.results_key(), {})
+        spans = {block.qualname: (block.lineno, block.end_lineno) for block in self.current_blocks}
+        pending_names = {block.qualname for block in pending}
+        rows = []
+        for qualname, (_, code, comment) in results.items():
+            if qualname in pending_names:
+                continue
+            # Results whose block isn't in the latest parse have no line to jump to.
+            lineno, end_lineno = spans.get(qualname, (0, 0))
+            rows.append(ResultRow(qualname, lineno, end_lineno, signature_line(code), comment))
+        rows.extend(ResultRow(block.qualname, block.lineno, block.end_lineno, signature_line(block.source),
+                              state=PENDING) for block in pending)
+        self.results_model.set_rows(rows)
+
+    def on_comment_partial(self, index, code, partial_comment):
+        if self.pending_key == self.results_key():
+            self.results_model.update_comment(self.pending_blocks[index].qualname, partial_comment, PARTIAL)
+
+    def on_comment_generated(self, index, code, comment):
+        block = self.pending_blocks[index]
+        self.file_results.setdefault(self.pending_key, {})[block.qualname] = (
+            block.digest, code, comment)
+        self.index_store.put_many([(block.digest, comment)])
+        # Results complete out of order; each one only repaints its own row.
+        if self.pending_key == self.results_key():
+            self.results_model.update_comment(block.qualname, comment, DONE)
 
     def on_all_comments_generated(self):
         self.update_status("All comments generated successfully!")
-        self.set_buttons_enabled(True)
+
+    def on_generation_stopped(self):
+        """Cleans up after a run however it ended, then starts the rerun edits asked for meanwhile."""
         self.comment_thread.quit()
         self.comment_thread.wait()
+        self.set_buttons_enabled(True)
+        self.pause_indexer(False)
+        self.render_results()
+        if self.rerun_pending:
+            self.rerun_pending = False
+            self.regenerate_changed_blocks(auto=True)
     
+    def cancel_generation(self):
+        """Stops the running generation; comments already received are kept."""
+        if self.comment_thread and self.comment_thread.isRunning():
+            self.rerun_pending = False
+            # The worker returns without waiting for requests already sent and then
+            # emits ``stopped``; don't block the UI on it.
+            self.worker.cancel()
+            self.stop_btn.setEnabled(False)
+            self.update_status("Comment generation stopped.")
+
     def on_comment_error(self, error_message):
         QMessageBox.critical(self, "Error", error_message)
         self.update_status("Error generating comment")
-        self.set_buttons_enabled(True)
-        self.comment_thread.quit()
-        self.comment_thread.wait()
-    
-    def highlight_code(self, code):
-        cursor = self.code_editor.document().find(code)
-        if not cursor.isNull():
-            extra_selections = []
-            selection = QTextEdit.ExtraSelection()
-            highlight_format = QTextCharFormat()
-            highlight_format.setBackground(QColor(255, 255, 0, 100))
-            selection.format = highlight_format
-            selection.cursor = cursor
-            extra_selections.append(selection)
-            self.code_editor.setExtraSelections(extra_selections)
-            cursor = self.code_editor.textCursor()
-            cursor.setPosition(selection.cursor.selectionStart())
-            cursor.setPosition(selection.cursor.selectionEnd(), QTextCursor.KeepAnchor)
-            self.code_editor.setTextCursor(cursor)
-    
+
+    def highlight_lines(self, lineno, end_lineno):
+        """Selects and scrolls to lines ``lineno``..``end_lineno`` (1-based) of the editor."""
+        document = self.code_editor.document()
+        first = document.findBlockByNumber(lineno - 1)
+        last = document.findBlockByNumber(end_lineno - 1)
+        if not first.isValid():
+            return
+        if not last.isValid():
+            last = document.lastBlock()
+        cursor = QTextCursor(document)
+        cursor.setPosition(first.position())
+        cursor.setPosition(last.position() + last.length() - 1, QTextCursor.KeepAnchor)
+
+        selection = QTextEdit.ExtraSelection()
+        highlight_format = QTextCharFormat()
+        highlight_format.setBackground(QColor(255, 255, 0, 100))
+        selection.format = highlight_format
+        selection.cursor = cursor
+        self.code_editor.setExtraSelections([selection])
+        self.code_editor.setTextCursor(cursor)
+        self.code_editor.ensureCursorVisible()
+
     def clear_all(self):
+        self.file_results.pop(self.results_key(), None)
         self.code_editor.clear()
-        self.comment_display.clear()
+        self.results_model.clear()
         self.update_status("Cleared all content")
     
     def set_buttons_enabled(self, enabled):
@@ -441,6 +759,7 @@ class MainWindow(QMainWindow):
         self.save_btn.setEnabled(enabled)
         self.generate_btn.setEnabled(enabled)
         self.clear_btn.setEnabled(enabled)
+        self.stop_btn.setEnabled(not enabled)
     
     def closeEvent(self, event):
         if self.comment_thread and self.comment_thread.isRunning():
@@ -452,9 +771,18 @@ class MainWindow(QMainWindow):
                 QMessageBox.No
             )
             if reply == QMessageBox.Yes:
-                self.comment_thread.terminate()
+                self.worker.stopped.disconnect(self.on_generation_stopped)
+                self.worker.cancel()
+                # generate_many returns at once on cancel, leaving requests already
+                # sent on daemon threads, so this wait is short.
+                self.comment_thread.quit()
+                self.comment_thread.wait()
                 event.accept()
             else:
                 event.ignore()
         else:
             event.accept()
+        if event.isAccepted():
+            self.extractor.shutdown()
+            if self.indexer:
+                self.indexer.stop()
@@ -0,0 +1,20 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def map_files(func, items, jobs=None, chunksize=4):
+    """
+    Yields ``func(item)`` for each of ``items``, in order, across a process pool.
+
+    ``jobs`` defaults to the number of cores. With one job, or a single
+    item, everything runs in this process and no pool is started. ``func``
+    must be picklable and should report failures in its result rather than
+    raise, or the first error ends the whole map.
+    """
+    items = list(items)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs <= 1 or len(items) <= 1:
+        yield from map(func, items)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(func, items, chunksize=chunksize)
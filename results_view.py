@@ -0,0 +1,228 @@
+"""
+Results panel: one row per block, drawn only when visible.
+
+``ResultsModel`` keeps a compact row per block (qualified name, line span,
+signature line, comment, state) sorted by line, and updates single rows as
+comments arrive or stream in. ``ResultsView`` is a QListView with uniform
+row heights, so Qt lays out and paints only the rows on screen no matter
+how many blocks a file has; a filter box narrows the rows and activating a
+row emits its line span so the editor can jump to the block.
+"""
+import bisect
+
+from PyQt5.QtCore import (QAbstractListModel, QModelIndex, QRect, QSize, QSortFilterProxyModel, Qt,
+                          pyqtSignal)
+from PyQt5.QtGui import QColor, QFont, QFontMetrics
+from PyQt5.QtWidgets import QLineEdit, QListView, QStyle, QStyledItemDelegate, QVBoxLayout, QWidget
+
+PENDING, PARTIAL, DONE = 'pending', 'partial', 'done'
+
+QualnameRole = Qt.UserRole + 1
+SpanRole = Qt.UserRole + 2
+CommentRole = Qt.UserRole + 3
+SignatureRole = Qt.UserRole + 4
+StateRole = Qt.UserRole + 5
+
+
+class ResultRow:
+    __slots__ = ('qualname', 'lineno', 'end_lineno', 'signature', 'comment', 'state')
+
+    def __init__(self, qualname, lineno, end_lineno, signature, comment="", state=DONE):
+        self.qualname = qualname
+        self.lineno = lineno
+        self.end_lineno = end_lineno
+        self.signature = signature
+        self.comment = comment
+        self.state = state
+
+
+def signature_line(source):
+    """First line of a block, as shown in its row."""
+    end = source.find("\n")
+    return (source if end == -1 else source[:end]).strip()
+
+
+class ResultsModel(QAbstractListModel):
+    """Rows of the current file's results, in source order."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = []
+        self._linenos = []
+        self._row_of = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            # Also what the filter matches against.
+            return f"{row.qualname}\n{row.comment}"
+        if role == QualnameRole:
+            return row.qualname
+        if role == SpanRole:
+            return (row.lineno, row.end_lineno)
+        if role == CommentRole:
+            return row.comment
+        if role == SignatureRole:
+            return row.signature
+        if role == StateRole:
+            return row.state
+        if role == Qt.ToolTipRole:
+            return row.comment
+        return None
+
+    def set_rows(self, rows):
+        """Replaces every row; ``rows`` are ResultRow records."""
+        self.beginResetModel()
+        self._rows = sorted(rows, key=lambda row: row.lineno)
+        self._linenos = [row.lineno for row in self._rows]
+        self._row_of = {row.qualname: i for i, row in enumerate(self._rows)}
+        self.endResetModel()
+
+    def upsert(self, row):
+        """
+        Updates the row with ``row.qualname`` in place, or inserts it at its line.
+
+        For a single row; to fill the model with many rows use ``set_rows``.
+        """
+        i = self._row_of.get(row.qualname)
+        if i is not None and self._rows[i].lineno == row.lineno:
+            self._rows[i] = row
+            index = self.index(i)
+            self.dataChanged.emit(index, index)
+            return
+        if i is not None:
+            self.beginRemoveRows(QModelIndex(), i, i)
+            del self._rows[i], self._linenos[i]
+            self._shift(i, -1)
+            self.endRemoveRows()
+        i = bisect.bisect_right(self._linenos, row.lineno)
+        self.beginInsertRows(QModelIndex(), i, i)
+        self._rows.insert(i, row)
+        self._linenos.insert(i, row.lineno)
+        self._shift(i + 1, 1)
+        self._row_of[row.qualname] = i
+        self.endInsertRows()
+
+    def _shift(self, start, delta):
+        """Moves the recorded position of every row from ``start`` on by ``delta``."""
+        for row in self._rows[start:]:
+            self._row_of[row.qualname] += delta
+
+    def update_comment(self, qualname, comment, state=DONE):
+        i = self._row_of.get(qualname)
+        if i is None:
+            return
+        self._rows[i].comment = comment
+        self._rows[i].state = state
+        index = self.index(i)
+        self.dataChanged.emit(index, index)
+
+    def clear(self):
+        self.set_rows([])
+
+    def rows(self):
+        return list(self._rows)
+
+    def to_text(self):
+        """The finished comments as plain text, one block per paragraph."""
+        return "\n\n".join(f"{row.qualname} (line {row.lineno}):\n{row.comment}"
+                           for row in self._rows if row.state == DONE and row.comment)
+
+
+class ResultDelegate(QStyledItemDelegate):
+    """Paints a row as a card: name and line span, signature, then the comment (wrapped, elided)."""
+
+    COMMENT_LINES = 3
+
+    def __init__(self, font, parent=None):
+        super().__init__(parent)
+        self.font = font
+        self.bold = QFont(font)
+        self.bold.setBold(True)
+        self.metrics = QFontMetrics(font)
+        self.line_height = self.metrics.lineSpacing()
+        self.padding = 6
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.line_height * (2 + self.COMMENT_LINES) + 3 * self.padding)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        card = option.rect.adjusted(2, 2, -2, -2)
+        selected = option.state & QStyle.State_Selected
+        painter.fillRect(card, QColor('#3a3d41') if selected else QColor('#2b2b2b'))
+
+        inner = card.adjusted(self.padding, self.padding, -self.padding, -self.padding)
+        lineno, end_lineno = index.data(SpanRole)
+        state = index.data(StateRole)
+
+        painter.setFont(self.bold)
+        painter.setPen(QColor('#569cd6'))
+        header = QRect(inner.left(), inner.top(), inner.width(), self.line_height)
+        span = f"lines {lineno}–{end_lineno}" if lineno else ""
+        painter.drawText(header, Qt.AlignLeft | Qt.AlignVCenter,
+                         self.metrics.elidedText(index.data(QualnameRole), Qt.ElideRight, inner.width() // 2))
+        painter.setFont(self.font)
+        painter.setPen(QColor('#808080'))
+        painter.drawText(header, Qt.AlignRight | Qt.AlignVCenter, span)
+
+        signature = QRect(inner.left(), header.bottom() + 1, inner.width(), self.line_height)
+        painter.drawText(signature, Qt.AlignLeft | Qt.AlignVCenter,
+                         self.metrics.elidedText(index.data(SignatureRole), Qt.ElideRight, inner.width()))
+
+        comment = index.data(CommentRole)
+        if state == PENDING:
+            comment, color = "Generating…", '#808080'
+        elif state == PARTIAL:
+            comment, color = comment + " …", '#b5cea8'
+        else:
+            color = '#b5cea8'
+        body = QRect(inner.left(), signature.bottom() + self.padding, inner.width(),
+                     self.line_height * self.COMMENT_LINES)
+        painter.setPen(QColor(color))
+        painter.setClipRect(body)
+        painter.drawText(body, Qt.AlignLeft | Qt.AlignTop | Qt.TextWordWrap, comment)
+        painter.restore()
+
+
+class ResultsView(QWidget):
+    """Filter box over a virtualized list of results. Emits ``block_activated(lineno, end_lineno)``."""
+
+    block_activated = pyqtSignal(int, int)
+
+    def __init__(self, font, parent=None):
+        super().__init__(parent)
+        self.model = ResultsModel(self)
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText("Filter by name or comment...")
+        self.filter_edit.setClearButtonEnabled(True)
+        self.filter_edit.textChanged.connect(self.proxy.setFilterFixedString)
+
+        self.list_view = QListView()
+        self.list_view.setModel(self.proxy)
+        self.list_view.setItemDelegate(ResultDelegate(font, self.list_view))
+        # Every row has the same height, so only visible rows are ever measured or painted.
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setVerticalScrollMode(QListView.ScrollPerPixel)
+        self.list_view.setSelectionMode(QListView.SingleSelection)
+        self.list_view.clicked.connect(self._activate)
+        self.list_view.activated.connect(self._activate)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.filter_edit)
+        layout.addWidget(self.list_view)
+
+    def _activate(self, index):
+        lineno, end_lineno = index.data(SpanRole)
+        if lineno:
+            self.block_activated.emit(lineno, end_lineno)
@@ -0,0 +1,130 @@
+"""
+Production serving with several pre-forked workers.
+
+    python serve.py --workers 4 --port 5000
+
+The merged model is loaded once in the parent process, which then forks the
+workers; the weights are shared copy-on-write. Each worker gets an equal
+share of the cores for torch's intra-op threads so the workers do not
+oversubscribe the machine. All workers accept connections from one shared
+listening socket, so the kernel hands each new connection to an idle worker.
+Worker processes that die are restarted.
+
+Each worker runs its own micro-batcher and in-memory cache and reports its
+own /metrics. Forking is POSIX-only; on Windows this falls back to a single
+threaded server.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def run_worker(index, sock, threads):
+    """Entry point of a forked worker: size torch's thread pool and serve from the shared socket."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    import torch
+    torch.set_num_threads(threads)
+
+    from werkzeug.serving import make_server
+    import app
+
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app.app, threaded=True, fd=sock.fileno())
+    app.start_job_runner()
+    app.logger.info("Worker %d (pid %d) serving with %d torch threads", index, os.getpid(), threads)
+    server.serve_forever()
+
+
+def spawn(index, sock, threads):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(index, sock, threads)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Serve the comment API with pre-forked workers.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=max(1, cpus // 4),
+                        help="number of worker processes (default: one per 4 cores)")
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help="torch threads per worker (default: cores divided evenly between workers)")
+    args = parser.parse_args(argv)
+
+    import app
+    app.configure_logging()
+
+    if not hasattr(os, 'fork'):
+        app.logger.warning("os.fork is not available; serving from a single process.")
+        app.load_model()
+        app.start_job_runner()
+        app.app.run(host=args.host, port=args.port, debug=False, use_reloader=False, threaded=True)
+        return 0
+
+    workers = max(1, args.workers)
+    threads = args.threads_per_worker or max(1, cpus // workers)
+
+    app.load_model()
+    if app.model is None:
+        app.logger.error("The model could not be loaded; not starting workers.")
+        return 1
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    # Move everything allocated so far out of the collector's reach, so
+    # collections in the workers don't touch (and copy) the shared pages.
+    gc.collect()
+    gc.freeze()
+
+    children = {spawn(index, sock, threads): index for index in range(workers)}
+    app.logger.info("Serving on http://%s:%d with %d workers x %d torch threads",
+                    args.host, args.port, workers, threads)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            app.logger.warning("Worker %d (pid %d) exited with status %d; restarting", index, pid, status)
+            time.sleep(1)
+            children[spawn(index, sock, threads)] = index
+
+    sock.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Pre-merged model snapshot.
+
+Merging the LoRA adapter into ``Salesforce/codet5-small`` on every start is
+slow and briefly holds two copies of the weights. ``python snapshot.py``
+does the merge once and writes the merged weights (safetensors) and the
+tokenizer to SNAPSHOT_DIR. ``load_model`` in app.py memory-maps that
+snapshot when it is present and was built from the current adapter files.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ADAPTER_DIR = os.path.join(BASE_DIR, 'codet5_commenter_final')
+SNAPSHOT_DIR = os.environ.get('DOCUCODE_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'codet5_commenter_merged'))
+ADAPTER_FILES = ('adapter_model.safetensors', 'adapter_config.json')
+MANIFEST = 'snapshot.json'
+
+
+def file_sha256(path):
+    """Hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def adapter_fingerprint(adapter_dir=ADAPTER_DIR):
+    """Hash of the adapter weights and config; changes whenever the adapter is retrained."""
+    digest = hashlib.sha256()
+    for name in ADAPTER_FILES:
+        digest.update(name.encode('utf-8'))
+        digest.update(file_sha256(os.path.join(adapter_dir, name)).encode('ascii'))
+    return digest.hexdigest()
+
+
+def read_manifest(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_is_fresh(base_model_name, adapter_dir=ADAPTER_DIR, snapshot_dir=SNAPSHOT_DIR, fingerprint=None):
+    """True if the snapshot exists and was built from this base model and adapter."""
+    manifest = read_manifest(snapshot_dir)
+    if not manifest:
+        return False
+    fingerprint = fingerprint or adapter_fingerprint(adapter_dir)
+    return (manifest.get('base_model') == base_model_name
+            and manifest.get('adapter_sha256') == fingerprint
+            and os.path.exists(os.path.join(snapshot_dir, 'model.safetensors')))
+
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Loads the merged model and tokenizer from a snapshot.
+
+    The safetensors file is memory-mapped and ``low_cpu_mem_usage`` skips the
+    random initialisation pass, so several processes loading the same
+    snapshot share the page cache.
+    """
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+    model = AutoModelForSeq2SeqLM.from_pretrained(snapshot_dir, low_cpu_mem_usage=True)
+    tokenizer = AutoTokenizer.from_pretrained(snapshot_dir)
+    return model, tokenizer
+
+
+def compile_snapshot(base_model_name, adapter_dir=ADAPTER_DIR, snapshot_dir=SNAPSHOT_DIR):
+    """Merges the adapter into the base model and writes the result to ``snapshot_dir``."""
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+    from peft import PeftModel
+
+    print("Loading base model...")
+    base_model = AutoModelForSeq2SeqLM.from_pretrained(base_model_name)
+    tokenizer = AutoTokenizer.from_pretrained(adapter_dir)
+
+    print("Merging LoRA adapters...")
+    model = PeftModel.from_pretrained(base_model, adapter_dir).merge_and_unload()
+
+    print(f"Writing snapshot to {snapshot_dir}...")
+    os.makedirs(snapshot_dir, exist_ok=True)
+    # Drop the manifest first so a half-written snapshot is never treated as fresh.
+    manifest_path = os.path.join(snapshot_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    model.save_pretrained(snapshot_dir, safe_serialization=True)
+    tokenizer.save_pretrained(snapshot_dir)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'base_model': base_model_name,
+            'adapter_sha256': adapter_fingerprint(adapter_dir),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }, f, indent=2)
+    print("Snapshot written.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a pre-merged model snapshot for fast startup.")
+    parser.add_argument('--base-model', default="Salesforce/codet5-small")
+    parser.add_argument('--force', action='store_true', help="rebuild even if the snapshot is up to date")
+    args = parser.parse_args(argv)
+
+    if not args.force and snapshot_is_fresh(args.base_model):
+        print(f"Snapshot in {SNAPSHOT_DIR} is up to date.")
+        return 0
+    compile_snapshot(args.base_model)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
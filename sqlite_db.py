@@ -0,0 +1,42 @@
+import os
+import sqlite3
+
+
+class LazyConnection:
+    """
+    An SQLite connection in WAL mode with ``schema`` applied, shared by the stores.
+
+    Calling it returns the connection, opening it on first use and again in
+    a forked child, so connections are never shared across a fork. A falsy
+    ``path`` means an in-memory database. ``on_open(conn)`` runs after each
+    open, once the schema is in place. Callers serialize access themselves.
+    """
+
+    def __init__(self, path, schema, timeout=5.0, row_factory=None, on_open=None):
+        self.path = path
+        self.schema = schema
+        self.timeout = timeout
+        self.row_factory = row_factory
+        self.on_open = on_open
+        self._conn = None
+        self._pid = None
+
+    def __call__(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._open()
+        return self._conn
+
+    def _open(self):
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(self.path or ':memory:', check_same_thread=False, timeout=self.timeout)
+        if self.row_factory is not None:
+            self._conn.row_factory = self.row_factory
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.schema)
+        self._conn.commit()
+        if self.on_open is not None:
+            self.on_open(self._conn)
@@ -0,0 +1,131 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from batching import MicroBatcher, SingleFlight, bucket_label, bucket_of, fitting, padding_efficiency, plan_batches
+
+
+def recording_batcher(**kwargs):
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    return MicroBatcher(process, **kwargs), batches
+
+
+def test_results_come_back_to_the_item_that_asked():
+    batcher, batches = recording_batcher(max_batch_size=4, max_wait=0.05)
+    futures = batcher.submit_many(list(range(10)))
+    assert [future.result(timeout=5) for future in futures] == [i * 10 for i in range(10)]
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert [item for batch in batches for item in batch] == list(range(10))
+
+
+def test_submit_many_queues_items_together():
+    busy = threading.Event()
+    gate = threading.Event()
+    batches = []
+
+    def process(items):
+        busy.set()
+        gate.wait(5)
+        batches.append(list(items))
+        return items
+
+    batcher = MicroBatcher(process, max_batch_size=8, max_wait=0)
+    # The first item occupies the worker, so the next ones all wait in the queue.
+    first = batcher.submit('a')
+    assert busy.wait(5)
+    rest = batcher.submit_many(['b', 'c', 'd'])
+    gate.set()
+    assert first.result(timeout=5) == 'a'
+    assert [future.result(timeout=5) for future in rest] == ['b', 'c', 'd']
+    assert batches[-1] == ['b', 'c', 'd']
+
+
+def test_keys_are_never_mixed():
+    batcher, batches = recording_batcher(max_batch_size=8, max_wait=0.05)
+    futures = batcher.submit_many([1, 2], key='greedy') + batcher.submit_many([3, 4], key='full')
+    assert [future.result(timeout=5) for future in futures] == [10, 20, 30, 40]
+    assert sorted(batches) == [[1, 2], [3, 4]]
+
+
+def test_a_failed_batch_fails_each_of_its_items():
+    def process(items):
+        raise ValueError("model exploded")
+
+    batcher = MicroBatcher(process, max_batch_size=4, max_wait=0)
+    future = batcher.submit(1)
+    with pytest.raises(ValueError, match="model exploded"):
+        future.result(timeout=5)
+
+
+def test_a_wrong_number_of_results_is_an_error():
+    batcher = MicroBatcher(lambda items: items[:-1], max_batch_size=4, max_wait=0.05)
+    futures = batcher.submit_many([1, 2])
+    with pytest.raises(RuntimeError, match="1 results for 2 items"):
+        futures[0].result(timeout=5)
+
+
+def test_single_flight_shares_a_pending_future():
+    flights = SingleFlight()
+    first, shared = flights.submit('key', Future)
+    assert not shared
+    second, shared = flights.submit('key', lambda: pytest.fail("started twice"))
+    assert shared and second is first
+    assert flights.pending() == 1
+
+
+def test_single_flight_forgets_a_key_once_done():
+    flights = SingleFlight()
+    first, _ = flights.submit('key', Future)
+    first.set_result('comment')
+    assert flights.pending() == 0
+    again, shared = flights.submit('key', Future)
+    assert not shared and again is not first
+
+
+def test_single_flight_keeps_keys_apart():
+    flights = SingleFlight()
+    one, _ = flights.submit(('key', False), Future)
+    other, shared = flights.submit(('key', True), Future)
+    assert not shared and other is not one
+
+
+def test_bucket_bounds_are_inclusive():
+    bounds = (32, 64)
+    assert [bucket_of(tokens, bounds) for tokens in (1, 32, 33, 64, 65)] == [0, 0, 1, 1, 2]
+    assert bucket_of(None, bounds) == 0
+    assert [bucket_label(bucket, bounds) for bucket in range(3)] == ['1-32', '33-64', '>64']
+    assert bucket_label(0, ()) == 'all'
+
+
+def test_fitting_stays_within_the_token_budget():
+    # 3 items padded to 100 tokens fit in 300; the 4th would make it 400.
+    assert fitting([100, 100, 100, 100], max_batch_size=8, max_batch_tokens=300) == 3
+    # A longer item raises the padded size of everything before it.
+    assert fitting([10, 10, 200], max_batch_size=8, max_batch_tokens=300) == 2
+    # One item always fits, however long.
+    assert fitting([1000], max_batch_size=8, max_batch_tokens=300) == 1
+    assert fitting([10] * 20, max_batch_size=8) == 8
+
+
+def test_plan_batches_by_bucket_and_budget():
+    lengths = [10, 300, 20, 310, 30, 15]
+    assert plan_batches(lengths, max_batch_size=4) == [[0, 1, 2, 3], [4, 5]]
+    assert plan_batches(lengths, bounds=(64,), max_batch_size=4) == [[0, 2, 4, 5], [1, 3]]
+    assert plan_batches(lengths, bounds=(64,), max_batch_size=4, max_batch_tokens=400) == [[0, 2, 4, 5], [1], [3]]
+    fixed = padding_efficiency(plan_batches(lengths, max_batch_size=4), lengths)
+    bucketed = padding_efficiency(plan_batches(lengths, bounds=(64,), max_batch_size=4), lengths)
+    assert bucketed > fixed
+
+
+def test_batcher_separates_buckets_and_restores_order():
+    batcher, batches = recording_batcher(max_batch_size=8, max_wait=0.05, bucket_bounds=(64,), max_batch_tokens=600)
+    lengths = [10, 300, 20, 310, 30]
+    futures = batcher.submit_many(list(range(5)), tokens=lengths)
+    assert [future.result(timeout=5) for future in futures] == [0, 10, 20, 30, 40]
+    assert sorted(batches) == [[0, 2, 4], [1], [3]]
@@ -0,0 +1,69 @@
+import pytest
+
+from compaction import Compactor, approximate_token_counts
+
+LONG = "def long_function(a, b):\n" + "\n".join(f"    value_{i} = a + b * {i}" for i in range(60)) + "\n    return a"
+
+
+def tokens(text):
+    return approximate_token_counts([text])[0]
+
+
+def test_compaction_strips_comments_docstrings_and_nested_bodies():
+    code = '''
+def outer(x):
+    """Docstring."""
+    # a comment
+    def inner(y):
+        return y * 2
+
+    return inner(x)  # trailing
+'''
+    text = Compactor().compact(code)
+    assert "Docstring" not in text and "comment" not in text and "trailing" not in text
+    assert "return y * 2" not in text
+    assert "def inner(y):" in text and "return inner(x)" in text
+
+
+@pytest.mark.parametrize('truncation', ['head-tail', 'signature'])
+@pytest.mark.parametrize('max_tokens', [5, 8, 20, 57, 100])
+def test_truncation_never_exceeds_max_tokens(truncation, max_tokens):
+    result = Compactor(steps=(), truncation=truncation, max_tokens=max_tokens).fit(LONG)
+    assert result.truncated
+    assert result.tokens <= max_tokens
+    assert result.tokens == tokens(result.text)
+
+
+def test_the_marker_is_paid_for():
+    # "..." counts as three tokens here; reserving less used to overshoot by one.
+    code = "def f(a):\n    a = a + 0\n    a = a + 1"
+    result = Compactor(steps=(), truncation='head-tail', max_tokens=13).fit(code)
+    assert result.tokens <= 13
+
+
+def test_head_tail_keeps_both_ends():
+    text = Compactor(steps=(), truncation='head-tail', max_tokens=60).fit(LONG).text
+    lines = text.split("\n")
+    assert lines[0] == "def long_function(a, b):"
+    assert lines[-1] == "    return a"
+    assert "    ..." in lines
+
+
+def test_a_single_huge_line_keeps_what_fits():
+    line = "x = [" + ", ".join(str(i) for i in range(200)) + "]"
+    result = Compactor(steps=(), truncation='head-tail', max_tokens=10).fit(line)
+    assert line.startswith(result.text)
+    assert result.tokens == 10
+
+
+def test_blocks_that_fit_are_left_alone():
+    code = "def f(a):\n    return a"
+    result = Compactor(steps=(), max_tokens=tokens(code)).fit(code)
+    assert not result.truncated and result.text == code
+
+
+def test_unknown_settings_are_rejected():
+    with pytest.raises(ValueError):
+        Compactor(steps=('comments', 'bogus'))
+    with pytest.raises(ValueError):
+        Compactor(truncation='middle')
@@ -0,0 +1,96 @@
+import ast
+
+from docstring_writer import Edit, apply_file, format_docstring, insert_docstrings, read_source
+
+CODE = '''import os
+
+
+class Cache:
+    size = 1
+
+    def get(self, key):
+        return key
+
+
+def short(x): return x
+
+
+@decorated
+def documented():
+    """Already here."""
+    return 1
+'''
+
+
+def test_inserts_at_the_body_indent():
+    new_code, inserted, skipped = insert_docstrings(CODE, [
+        Edit('Cache', 4, 8, "A tiny cache."),
+        Edit('Cache.get', 7, 8, "Returns key."),
+    ])
+    assert inserted == 2 and skipped == {}
+    tree = ast.parse(new_code)
+    cache = tree.body[1]
+    assert ast.get_docstring(cache) == "A tiny cache."
+    assert ast.get_docstring(cache.body[2]) == "Returns key."
+    assert '    """A tiny cache."""\n    size = 1' in new_code
+    assert '        """Returns key."""\n        return key' in new_code
+
+
+def test_skips_stale_one_line_documented_and_empty_edits():
+    edits = [
+        Edit('Cache.get', 6, 8, "Wrong lines."),
+        Edit('Cache.put', 7, 8, "Wrong name."),
+        Edit('short', 11, 11, "Returns x."),
+        Edit('documented', 15, 17, "Another."),
+        Edit('Cache', 4, 8, "  "),
+    ]
+    new_code, inserted, skipped = insert_docstrings(CODE, edits)
+    assert new_code == CODE and inserted == 0
+    assert skipped == {'stale': 2, 'one-line': 1, 'documented': 1, 'empty': 1}
+
+
+def test_keeps_crlf_line_endings():
+    code = CODE.replace("\n", "\r\n")
+    new_code, inserted, _ = insert_docstrings(code, [Edit('Cache.get', 7, 8, "Returns key.")])
+    assert inserted == 1
+    assert '        """Returns key."""\r\n        return key\r\n' in new_code
+    assert "\n" not in new_code.replace("\r\n", "")
+
+
+def test_escapes_backslashes_and_quotes():
+    comment = 'Splits on "\\n" and stops at """ or a trailing quote"'
+    new_code, inserted, _ = insert_docstrings(CODE, [Edit('Cache.get', 7, 8, comment)])
+    assert inserted == 1
+    get = ast.parse(new_code).body[1].body[1]
+    assert ast.get_docstring(get, clean=False).strip() == comment
+
+
+def test_long_comments_are_wrapped():
+    lines = format_docstring("word " * 40, "    ")
+    assert lines[0] == '    """\n' and lines[-1] == '    """\n'
+    assert all(len(line.rstrip("\n")) <= 88 for line in lines)
+
+
+def test_apply_file_keeps_the_encoding(tmp_path):
+    path = tmp_path / "legacy.py"
+    path.write_bytes("# -*- coding: latin-1 -*-\ndef f():\n    return 'caf\xe9'\n".encode('latin-1'))
+    result = apply_file(str(path), [Edit('f', 2, 3, "Returns caf\xe9.")])
+    assert result.error is None and result.inserted == 1
+    text, encoding = read_source(str(path))
+    assert encoding == 'iso-8859-1'
+    assert '"""Returns caf\xe9."""' in text
+
+
+def test_dry_run_leaves_the_file_alone(tmp_path):
+    path = tmp_path / "module.py"
+    path.write_text(CODE)
+    result = apply_file(str(path), [Edit('Cache.get', 7, 8, "Returns key.")], dry_run=True)
+    assert path.read_text() == CODE
+    assert '+        """Returns key."""' in result.diff
+
+
+def test_apply_file_reports_syntax_errors(tmp_path):
+    path = tmp_path / "broken.py"
+    path.write_text("def f(:\n")
+    result = apply_file(str(path), [Edit('f', 1, 1, "Nope.")])
+    assert result.inserted == 0 and result.error
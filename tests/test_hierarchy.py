@@ -0,0 +1,78 @@
+import ast
+
+from code_blocks import find_blocks
+from hierarchy import block_tree, levels, summarize_files, summary_source
+
+CODE = '''class Store:
+    """Old docstring."""
+    limit = 10
+
+    def get(self, key):
+        value = self.data.get(key)
+        return value
+
+    if FAST:
+        def put(self, key, value):
+            self.data[key] = value
+    else:
+        def put(self, key, value):
+            self.data[key] = value
+            self.flush()
+
+    try:
+        import json
+    except ImportError:
+        def dump(self):
+            return repr(self.data)
+
+    def scan(self):
+        def visit(node):
+            return node
+        return visit(self.root)
+'''
+
+
+def children_of(blocks, parent):
+    return [block for block, index in zip(blocks, block_tree(blocks)) if index == parent]
+
+
+def test_tree_and_levels():
+    blocks = find_blocks(CODE)
+    names = [block.qualname for block in blocks]
+    assert names == ['Store', 'Store.get', 'Store.put', 'Store.put#2', 'Store.dump', 'Store.scan',
+                     'Store.scan.visit']
+    parents = block_tree(blocks)
+    assert parents == [None, 0, 0, 0, 0, 0, 5]
+    assert levels(blocks, parents) == [[1, 2, 3, 4, 6], [5], [0]]
+
+
+def test_summary_source_replaces_children_everywhere_in_the_body():
+    blocks = find_blocks(CODE)
+    children = [(block, f"Summary of {block.qualname}.") for block in children_of(blocks, 0)]
+    source = summary_source(blocks[0], children)
+    tree = ast.parse(source)
+    assert ast.get_docstring(tree.body[0]) is None
+    assert "Old docstring" not in source
+    for block in children_of(blocks, 0):
+        assert repr(f"Summary of {block.qualname}.") in source
+    # Bodies are gone, the statements around them stay.
+    assert "self.flush()" not in source and "repr(self.data)" not in source and "def visit" not in source
+    assert "limit = 10" in source and "if FAST:" in source and "except ImportError:" in source
+
+
+def test_summary_source_without_children_or_docstring_is_unchanged():
+    block = find_blocks("def f():\n    return 1\n")[0]
+    assert summary_source(block, []) == block.source
+
+
+def test_summarize_files_goes_children_first():
+    calls = []
+
+    def generate(codes, summarized):
+        calls.append((len(codes), summarized))
+        return [f"comment {len(calls)}.{i}" for i in range(len(codes))]
+
+    comments = summarize_files([find_blocks(CODE), find_blocks("def lone():\n    pass\n")], generate)
+    assert calls == [(6, False), (1, True), (1, True)]
+    assert comments[1] == ["comment 1.5"]
+    assert comments[0][0] == "comment 3.0"
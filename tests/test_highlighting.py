@@ -0,0 +1,55 @@
+from highlighting import IN_DOUBLE_TRIPLE, IN_SINGLE_TRIPLE, NORMAL, scan_line, scan_lines
+
+
+def kinds(text, state=NORMAL):
+    spans, state = scan_line(text, state)
+    return [(text[start:start + length], kind) for start, length, kind in spans], state
+
+
+def test_plain_line():
+    assert kinds("if x in items: return 0x1F  # done") == ([
+        ("if", 'keyword'), ("in", 'keyword'), ("return", 'keyword'), ("0x1F", 'number'), ("# done", 'comment'),
+    ], NORMAL)
+
+
+def test_keywords_only_match_whole_words():
+    assert kinds("import_path = information") == ([], NORMAL)
+
+
+def test_strings_hide_what_is_inside_them():
+    assert kinds("s = 'if # not a comment'") == ([("'if # not a comment'", 'string')], NORMAL)
+    assert kinds('b"\\"quoted\\"" or 1.5e3') == ([('b"\\"quoted\\""', 'string'), ("or", 'keyword'),
+                                                   ("1.5e3", 'number')], NORMAL)
+
+
+def test_triple_quoted_string_on_one_line():
+    assert kinds('x = """doc""" if y else None') == ([('"""doc"""', 'docstring'), ("if", 'keyword'),
+                                                    ("else", 'keyword'), ("None", 'keyword')], NORMAL)
+
+
+def test_open_triple_quotes_carry_to_the_next_lines():
+    assert kinds('    """Starts here') == ([('"""Starts here', 'docstring')], IN_DOUBLE_TRIPLE)
+    assert kinds("still inside, if anything", IN_DOUBLE_TRIPLE) == (
+        [("still inside, if anything", 'docstring')], IN_DOUBLE_TRIPLE)
+    assert kinds("", IN_DOUBLE_TRIPLE) == ([], IN_DOUBLE_TRIPLE)
+    assert kinds('ends """ and return', IN_DOUBLE_TRIPLE) == (
+        [('ends """', 'docstring'), ("and", 'keyword'), ("return", 'keyword')], NORMAL)
+
+
+def test_the_other_delimiter_does_not_close_the_string():
+    assert kinds("r'''raw", NORMAL)[1] == IN_SINGLE_TRIPLE
+    assert kinds('a """ b', IN_SINGLE_TRIPLE) == ([('a """ b', 'docstring')], IN_SINGLE_TRIPLE)
+    assert kinds("escaped \\''' still open", IN_SINGLE_TRIPLE)[1] == IN_SINGLE_TRIPLE
+    assert kinds("end ''' # note", IN_SINGLE_TRIPLE)[0][-1] == ("# note", 'comment')
+
+
+def test_a_string_that_closes_and_reopens_on_one_line():
+    assert kinds('"""one""" + """two')[1] == IN_DOUBLE_TRIPLE
+
+
+def test_scan_lines_threads_the_state():
+    lines = ['def f():', '    """Doc', '    more', '    """', '    return 1']
+    spans = list(scan_lines(lines))
+    assert [kind for _, _, kind in spans[2]] == ['docstring']
+    assert [(lines[4][start:start + length], kind) for start, length, kind in spans[4]] == [
+        ("return", 'keyword'), ("1", 'number')]
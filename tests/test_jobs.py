@@ -0,0 +1,145 @@
+import os
+import socket
+import time
+
+import pytest
+
+import jobs
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobRunner, JobStore
+
+HOST = socket.gethostname()
+
+
+def owner(pid=None, identity=None, token='t'):
+    pid = pid or os.getpid()
+    if identity is None:
+        identity = jobs.process_identity(pid)
+    return f"{HOST}:{pid}:{identity}:{token}"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def start_runner():
+    runners = []
+
+    def start(*args, **kwargs):
+        runner = JobRunner(*args, **kwargs)
+        runners.append(runner)
+        runner.start()
+        return runner
+
+    yield start
+    for runner in runners:
+        runner.stop(timeout=5)
+
+
+def items(count):
+    return [{'code': f"def f{i}(): pass", 'path': 'a.py', 'qualname': f"f{i}", 'lineno': i + 1,
+             'end_lineno': i + 1} for i in range(count)]
+
+
+def test_claim_takes_the_oldest_free_job(store):
+    first = store.create({'n': 1}, items(1))
+    second = store.create({'n': 2}, items(1))
+    assert store.get(first)['status'] == QUEUED
+    assert store.claim(owner(token='a'), 60) == first
+    assert store.get(first)['status'] == RUNNING
+    # A live holder keeps its job until the lease runs out.
+    assert store.claim(owner(token='b'), 60) == second
+    assert store.claim(owner(token='c'), 60) is None
+
+
+def test_record_stores_results_and_progress(store):
+    job_id = store.create({}, items(3))
+    me = owner()
+    store.claim(me, 60)
+    assert store.pending_items(job_id, 10) == [(0, "def f0(): pass"), (1, "def f1(): pass"), (2, "def f2(): pass")]
+    assert store.record(job_id, me, [(0, "First."), (1, "Second.")], 60)
+    assert store.get(job_id)['done'] == 2
+    assert [seq for seq, _ in store.pending_items(job_id, 10)] == [2]
+    store.finish(job_id, me, DONE)
+    job = store.get(job_id)
+    assert job['status'] == DONE and job['progress'] == pytest.approx(2 / 3)
+    assert [row['comment'] for row in store.results(job_id)] == ["First.", "Second.", None]
+    assert store.results(job_id, offset=1, limit=1)[0]['qualname'] == 'f1'
+
+
+def test_record_is_refused_once_the_job_changed_hands(store):
+    job_id = store.create({}, items(1))
+    store.claim(owner(token='old'), 60)
+    assert store.cancel(job_id)
+    assert not store.record(job_id, owner(token='old'), [(0, "Late.")], 60)
+    assert store.results(job_id)[0]['comment'] is None
+    assert not store.cancel(job_id)
+
+
+def test_an_expired_lease_is_taken_over(store):
+    job_id = store.create({}, items(1))
+    store.claim(owner(token='slow'), -1)
+    assert store.claim(owner(token='next'), 60) == job_id
+
+
+def test_the_lease_of_a_dead_process_is_taken_over(store):
+    job_id = store.create({}, items(1))
+    # A pid that is in use, but not by the process that took the lease.
+    store.claim(owner(identity='some-other-boot/1', token='gone'), 60)
+    assert store.claim(owner(token='next'), 60) == job_id
+
+
+def test_a_live_holder_on_another_host_waits_for_its_lease(store):
+    job_id = store.create({}, items(1))
+    store.claim("elsewhere:1:boot/1:t", 60)
+    assert store.claim(owner(token='next'), 60) is None
+    assert store.get(job_id)['status'] == RUNNING
+
+
+def test_runner_expands_and_finishes_jobs(store, start_runner):
+    job_id = store.create({'path': 'project'})
+    seen = []
+
+    def generate(codes, spec):
+        seen.append(len(codes))
+        return [code.upper() for code in codes]
+
+    start_runner(store, generate, lambda spec: items(5), chunk_size=2, poll_seconds=0.05)
+    deadline = time.monotonic() + 5
+    while store.get(job_id)['status'] != DONE and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert store.get(job_id)['status'] == DONE
+    assert seen == [2, 2, 1]
+    assert store.results(job_id)[4]['comment'] == "DEF F4(): PASS"
+
+
+def test_runner_records_failures(store, start_runner):
+    job_id = store.create({}, items(1))
+
+    def generate(codes, spec):
+        raise RuntimeError("Model not loaded")
+
+    start_runner(store, generate, lambda spec: [], poll_seconds=0.05)
+    deadline = time.monotonic() + 5
+    while store.get(job_id)['status'] != FAILED and time.monotonic() < deadline:
+        time.sleep(0.02)
+    job = store.get(job_id)
+    assert job['status'] == FAILED and job['error'] == "Model not loaded"
+
+
+def test_stop_requeues_an_unfinished_job(store, start_runner):
+    runners = []
+
+    def generate(codes, spec):
+        runners[0].stop()
+        return [code.upper() for code in codes]
+
+    runners.append(start_runner(store, generate, lambda spec: [], chunk_size=1, poll_seconds=0.05))
+    job_id = store.create({}, items(4))
+    runners[0].wake()
+    runners[0]._thread.join(5)
+    assert not runners[0]._thread.is_alive()
+    job = store.get(job_id)
+    assert job['status'] == QUEUED and job['done'] == 1
+    assert store.claim(owner(token='next'), 60) == job_id